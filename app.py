@@ -1,15 +1,41 @@
 # CNPJ Finder - B2B Lead Generation Tool for Brazil
 # Multi-source data enrichment
 
-from flask import Flask, render_template_string, request, jsonify
+from flask import Flask, Response, render_template_string, request, jsonify, stream_with_context
 import requests
+import codecs
+import csv
+import io
+import json
 import os
-import re
-from bs4 import BeautifulSoup
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from batching import MicroBatcher
+from cache import MISS, TieredCache
+import upstream
+import html_extract
+import cnpj_utils
+import compression
+import metrics
+import providers
+from health import ProviderUnavailable
+from jobs import JobQueue
+from receita_store import ReceitaStore
+from cnpj_table import CnpjTable
+from refresh import BackgroundRefresher
+from name_index import LEGAL_SUFFIX_RE, NameIndex
+from providers import Provider, register, registry
+from singleflight import SingleFlight
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'cnpj-finder-key')
 
+# Where the app keeps files it creates itself: the job store, and serve.py's shared state
+STATE_DIR = os.environ.get('CNPJ_STATE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'state')
+
 # HTML Template
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -290,6 +316,8 @@ HTML_TEMPLATE = """
             document.getElementById('result').innerHTML = '';
         }
         
+        let nameSearch = null;
+        
         async function searchByName() {
             const input = document.getElementById('nameInput');
             const btn = document.getElementById('searchNameBtn');
@@ -305,50 +333,105 @@ HTML_TEMPLATE = """
             btn.textContent = '⏳ Buscando...';
             result.innerHTML = '';
             
-            try {
-                const response = await fetch('/api/search?q=' + encodeURIComponent(query));
-                const data = await response.json();
-                if (data.error) {
-                    result.innerHTML = `<div class="error-message">❌ ${data.error}</div>`;
-                } else {
-                    displayNameResults(data);
+            if (!window.EventSource) {
+                try {
+                    const response = await fetch('/api/search?q=' + encodeURIComponent(query));
+                    const data = await response.json();
+                    if (data.error) {
+                        result.innerHTML = `<div class="error-message">❌ ${data.error}</div>`;
+                    } else {
+                        displayNameResults(data);
+                    }
+                } catch (error) {
+                    result.innerHTML = `<div class="error-message">❌ Erro na busca</div>`;
+                } finally {
+                    btn.disabled = false;
+                    btn.textContent = '🔍 Buscar';
                 }
-            } catch (error) {
-                result.innerHTML = `<div class="error-message">❌ Erro na busca</div>`;
-            } finally {
+                return;
+            }
+            
+            // Hits arrive one "result" event at a time, as each provider answers
+            const data = {query: query, count: 0, results: [], done: false};
+            if (nameSearch) nameSearch.close();
+            const source = nameSearch = new EventSource('/api/search/stream?q=' + encodeURIComponent(query));
+            const finish = () => {
+                source.close();
                 btn.disabled = false;
                 btn.textContent = '🔍 Buscar';
-            }
+            };
+            displayNameResults(data);
+            
+            source.addEventListener('result', e => {
+                data.results.push(JSON.parse(e.data));
+                data.count = data.results.length;
+                displayNameResults(data);
+            });
+            source.addEventListener('done', e => {
+                const summary = JSON.parse(e.data);
+                finish();
+                if (summary.error) {
+                    result.innerHTML = `<div class="error-message">❌ ${summary.error}</div>`;
+                    return;
+                }
+                Object.assign(data, summary, {done: true});
+                displayNameResults(data);
+            });
+            source.onerror = () => {
+                if (data.done) return;
+                finish();
+                data.done = true;
+                if (data.results.length === 0) {
+                    result.innerHTML = `<div class="error-message">❌ Erro na busca</div>`;
+                } else {
+                    displayNameResults(data);
+                }
+            };
+        }
+        
+        function nameResultCard(company) {
+            const sourceBadge = company.source === 'Google Search' 
+                ? '<span class="source-badge source-gp">Google</span>'
+                : '<span class="source-badge source-br">' + (company.source || 'API') + '</span>';
+            
+            const cnpjLink = company.cnpj 
+                ? `<a href="#" onclick="document.getElementById('cnpjInput').value='${company.cnpj}'; switchTab('cnpj'); searchCNPJ(); return false;" style="color: #667eea;">${formatCNPJ(company.cnpj)}</a>`
+                : '';
+            
+            return `
+                <div class="result-card" style="margin-bottom: 15px;">
+                    <h3>${company.nome_fantasia || company.razao_social} ${sourceBadge}</h3>
+                    ${cnpjLink ? `<div style="margin: 10px 0;">📋 CNPJ: ${cnpjLink}</div>` : ''}
+                    ${company.municipio ? `<div style="color: #666;">📍 ${company.municipio}${company.uf ? '/' + company.uf : ''}</div>` : ''}
+                </div>
+            `;
         }
         
+        // Renders a complete response, or a streamed one as it grows (data.done === false
+        // until the summary arrives); cards already on the page are kept, only new ones are appended
         function displayNameResults(data) {
             const result = document.getElementById('result');
-            if (!data.results || data.results.length === 0) {
+            const done = data.done !== false;
+            if (done && (!data.results || data.results.length === 0)) {
                 result.innerHTML = '<div class="error-message">❌ Nenhuma empresa encontrada. Tente buscar pelo CNPJ diretamente.</div>';
                 return;
             }
             
-            let html = `<div style="margin-bottom: 15px; color: #666;">${data.count} resultado(s)</div>`;
+            let list = document.getElementById('nameResults');
+            if (!list) {
+                result.innerHTML = '<div id="nameStatus" style="margin-bottom: 15px; color: #666;"></div><div id="nameResults"></div>';
+                list = document.getElementById('nameResults');
+            }
             
-            data.results.forEach(company => {
-                const sourceBadge = company.source === 'Google Search' 
-                    ? '<span class="source-badge source-gp">Google</span>'
-                    : '<span class="source-badge source-br">' + (company.source || 'API') + '</span>';
-                
-                const cnpjLink = company.cnpj 
-                    ? `<a href="#" onclick="document.getElementById('cnpjInput').value='${company.cnpj}'; switchTab('cnpj'); searchCNPJ(); return false;" style="color: #667eea;">${formatCNPJ(company.cnpj)}</a>`
-                    : '';
-                
-                html += `
-                    <div class="result-card" style="margin-bottom: 15px;">
-                        <h3>${company.nome_fantasia || company.razao_social} ${sourceBadge}</h3>
-                        ${cnpjLink ? `<div style="margin: 10px 0;">📋 CNPJ: ${cnpjLink}</div>` : ''}
-                        ${company.municipio ? `<div style="color: #666;">📍 ${company.municipio}${company.uf ? '/' + company.uf : ''}</div>` : ''}
-                    </div>
-                `;
-            });
+            let status = done ? `${data.count} resultado(s)` : `⏳ ${data.results.length} resultado(s) até agora...`;
+            if (done && data.sources && data.sources.length) {
+                status += ` · fontes: ${data.sources.join(', ')}`;
+            }
+            document.getElementById('nameStatus').textContent = status;
             
-            result.innerHTML = html;
+            for (let i = list.children.length; i < data.results.length; i++) {
+                list.insertAdjacentHTML('beforeend', nameResultCard(data.results[i]));
+            }
         }
         
         function formatCNPJ(cnpj) {
@@ -362,279 +445,830 @@ HTML_TEMPLATE = """
 </html>
 """
 
+# The template has no variables, so it is rendered (and compressed) once at startup
+with app.app_context():
+    index_page = compression.StaticPage(render_template_string(HTML_TEMPLATE))
+
 @app.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE)
+    status, body, headers = index_page.select(
+        request.headers.get('Accept-Encoding'), request.headers.get('If-None-Match'))
+    return Response(body, status=status, headers=headers)
+
+@app.before_request
+def start_request_trace():
+    metrics.start_trace()
+
+@app.after_request
+def record_request_metrics(response):
+    """Route latency/status metrics, plus per-provider timings in a Server-Timing header"""
+    trace = metrics.current_trace()
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    if trace is None or route == '/metrics':
+        return response
+    metrics.observe_request(route, response.status_code, trace.elapsed())
+    if metrics.SERVER_TIMING and not response.is_streamed:
+        response.headers['Server-Timing'] = trace.server_timing()
+    return response
+
+# JSON routes answered with a weak ETag (304 on a matching If-None-Match) and, with
+# COMPRESS_JSON on, gzip/brotli bodies for clients that accept them
+CONDITIONAL_ENDPOINTS = frozenset(['get_cnpj', 'search_companies'])
+COMPRESS_JSON = os.environ.get('COMPRESS_JSON', '1') != '0'
+
+@app.after_request
+def conditional_json(response):
+    if request.endpoint not in CONDITIONAL_ENDPOINTS or response.status_code != 200 or response.is_streamed:
+        return response
+    response.add_etag(weak=True)
+    response.make_conditional(request)
+    if response.status_code != 200 or not COMPRESS_JSON:
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    encoding = compression.choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is not None and len(body) >= compression.MIN_SIZE:
+        response.set_data(compression.compress(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+def with_timing(data):
+    """Adds this request's provider timings when the caller asked with ?timing=1"""
+    trace = metrics.current_trace()
+    if trace is None or request.args.get('timing') != '1':
+        return data
+    return dict(data, timing=trace.as_dict())
+
+# Overall deadline (seconds) for the concurrent CNPJ source fan-out
+CNPJ_LOOKUP_BUDGET = float(os.environ.get('CNPJ_LOOKUP_BUDGET', 10))
+
+# Stale-while-revalidate: expired records are still served (marked stale, with their age) for up
+# to this many seconds past expiry while a background worker refreshes them; 0 turns it off
+CNPJ_MAX_STALE = float(os.environ.get('CNPJ_MAX_STALE', 7 * 86400))
+
+# Enriched records keyed by the cleaned CNPJ; "not found" answers expire sooner
+cnpj_cache = TieredCache(
+    maxsize=int(os.environ.get('CNPJ_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('CNPJ_CACHE_TTL', 86400)),
+    negative_ttl=float(os.environ.get('CNPJ_CACHE_NEGATIVE_TTL', 600)),
+    db_path=os.environ.get('CNPJ_CACHE_DB') or None,
+    max_stale=CNPJ_MAX_STALE,
+    # Column-store the in-process tier (see record_store.py); CNPJ_CACHE_COMPACT=0 keeps plain dicts
+    compact=os.environ.get('CNPJ_CACHE_COMPACT', '1') != '0',
+)
+
+# Optional local index of the Receita Federal dump (see receita_store.py), checked before any provider
+receita_store = ReceitaStore(os.environ['RECEITA_DB']) if os.environ.get('RECEITA_DB') else None
+
+# Optional mmap'd table of merged records (see cnpj_table.py), read on cache misses before any fetch;
+# rebuilding it in place is picked up without a restart
+cnpj_table = CnpjTable(os.environ['CNPJ_TABLE']) if os.environ.get('CNPJ_TABLE') else None
+
+lookup_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('LOOKUP_WORKERS', 32)))
+
+def brasilapi_request(cnpj_clean):
+    """Source 1: BrasilAPI"""
+    return upstream.url("brasilapi", f"/api/cnpj/v1/{cnpj_clean}"), {}
+
+def minha_receita_request(cnpj_clean):
+    """Source 2: Minha Receita"""
+    return upstream.url("minha_receita", f"/{cnpj_clean}"), {}
+
+# CNPJ sources (see providers.py). Merge priority: lower priority values win when both return a
+# value for a key. Neither has a multi-ID endpoint (batch_request), so bulk lookups are only grouped.
+register(Provider("brasilapi", "cnpj", brasilapi_request, priority=10))
+register(Provider("minha_receita", "cnpj", minha_receita_request, priority=20))
+
+# How the CNPJ sources are run: parallel (all, merged), first_n (first answer only), hedged or sequential
+CNPJ_STRATEGY = os.environ.get('CNPJ_STRATEGY', 'parallel')
+# Hedged strategy: seconds without an answer before the next source is asked
+CNPJ_HEDGE_AFTER = float(os.environ.get('CNPJ_HEDGE_AFTER', 1))
+
+def merge_cnpj_sources(cnpj_clean, payloads):
+    """Merge (source, data) pairs given in priority order"""
+    combined_data = {"cnpj": cnpj_clean, "sources": [], "enriched": False}
+    for name, data in payloads:
+        if not data:
+            continue
+        # First non-empty value wins
+        for key, value in data.items():
+            if key not in combined_data or not combined_data[key]:
+                combined_data[key] = value
+        combined_data["sources"].append(name)
+        metrics.record_results(name, 1)
+    
+    combined_data["enriched"] = len(combined_data["sources"]) > 1
+    return combined_data
+
+def fetch_source_many(source, cnpjs):
+    """One multi-ID request for a micro-batch of lookups; {cnpj: payload}"""
+    url, headers = source.batch_request(cnpjs)
+    response = upstream.get(source.upstream, url, budget=source.budget(CNPJ_LOOKUP_BUDGET), headers=headers)
+    if response.status_code != 200:
+        return {}
+    with metrics.parse_timer(source.upstream):
+        return source.parse_batch(response.json())
+
+# Bulk lookups (batch endpoint and jobs) against providers with a multi-ID endpoint go through
+# per-provider micro-batchers: lookups arriving within UPSTREAM_BATCH_WINDOW seconds share one
+# request of up to the provider's max_batch (capped at UPSTREAM_BATCH_MAX) IDs; a window of 0
+# turns it off. Providers without one are called per lookup, since grouping alone saves nothing.
+UPSTREAM_BATCH_WINDOW = float(os.environ.get('UPSTREAM_BATCH_WINDOW', 0.01))
+UPSTREAM_BATCH_MAX = int(os.environ.get('UPSTREAM_BATCH_MAX', 50))
+batchers = {}
+batchers_lock = threading.Lock()
+
+def batcher_for(source):
+    """The provider's micro-batcher, created on first use; None when its lookups aren't batched"""
+    if UPSTREAM_BATCH_WINDOW <= 0 or source.batch_request is None:
+        return None
+    batcher = batchers.get(source.name)
+    if batcher is None:
+        with batchers_lock:
+            batcher = batchers.get(source.name)
+            if batcher is None:
+                batcher = batchers[source.name] = MicroBatcher(
+                    lambda cnpjs: fetch_source_many(source, cnpjs),
+                    window=UPSTREAM_BATCH_WINDOW,
+                    max_batch=min(source.max_batch, UPSTREAM_BATCH_MAX),
+                    name=f"batch-{source.name}",
+                )
+    return batcher
+
+def enrich_cnpj(cnpj_clean, budget=None, batched=False):
+    """Query all CNPJ sources at once and merge whatever arrives within the budget
+
+    With batched, lookups against providers with a multi-ID endpoint join their micro-batches
+    instead of going out on their own.
+    """
+    budget = CNPJ_LOOKUP_BUDGET if budget is None else budget
+    deadline = time.monotonic() + budget
+    sources = registry.providers("cnpj")
+    futures = []
+    direct = []
+    for source in sources:
+        batcher = batcher_for(source) if batched else None
+        if batcher is not None:
+            futures.append((source.name, batcher.submit(cnpj_clean)))
+        else:
+            direct.append((source, cnpj_clean))
+    
+    answers = providers.execute(
+        direct, lookup_pool, CNPJ_STRATEGY, budget=budget, hedge_after=CNPJ_HEDGE_AFTER,
+    ) if direct else []
+    found = {source.name: data for source, _, data in answers}
+    if futures:
+        wait([future for _, future in futures], timeout=max(0.0, deadline - time.monotonic()))
+        # Unfinished batched futures may be shared with other lookups, so they are left to finish
+        found.update((name, future.result()) for name, future in futures
+                     if future.done() and future.exception() is None)
+    return merge_cnpj_sources(cnpj_clean, [(source.name, found[source.name]) for source in sources if source.name in found])
+
+def table_lookup(cnpj_clean):
+    """Record from the mmap'd CNPJ table, or None"""
+    if cnpj_table is None:
+        return None
+    try:
+        return cnpj_table.get(cnpj_clean)
+    except Exception:
+        return None
+
+def local_lookup(cnpj_clean):
+    """Record from the local Receita Federal index, or None"""
+    if receita_store is None:
+        return None
+    try:
+        data = receita_store.get(cnpj_clean)
+    except Exception:
+        return None
+    if data is None:
+        return None
+    return merge_cnpj_sources(cnpj_clean, [("receita_federal", data)])
+
+# Identical concurrent lookups share one upstream fetch; SINGLEFLIGHT_LOCK_DIR extends this across workers
+inflight = SingleFlight(lock_dir=os.environ.get('SINGLEFLIGHT_LOCK_DIR') or None)
+
+def fetch_cnpj(cnpj_clean, keep_stale=False, batched=False, deadline=None):
+    """Local index, then the providers; runs once per CNPJ however many callers are waiting
+
+    With keep_stale, an empty answer (e.g. every provider down) leaves the cached record alone.
+    deadline (time.monotonic()) is when the caller's lookup budget runs out, time spent waiting
+    on another worker's lock included.
+    """
+    if inflight.lock_dir:
+        # Another worker may have filled the shared cache while we waited on its lock; this
+        # lookup's miss was already counted
+        combined_data = cnpj_cache.peek(cnpj_clean)
+        if combined_data is not MISS:
+            return combined_data
+    
+    local_data = local_lookup(cnpj_clean)
+    if local_data is not None:
+        return local_data
+    budget = None
+    if deadline is not None:
+        budget = min(CNPJ_LOOKUP_BUDGET, max(0.0, deadline - time.monotonic()))
+    combined_data = enrich_cnpj(cnpj_clean, budget=budget, batched=batched)
+    if len(combined_data["sources"]) == 0:
+        combined_data = None
+        # Nothing back from a budget mostly spent waiting on another worker isn't a "not found"
+        # worth caching
+        if keep_stale or (budget is not None and budget < CNPJ_LOOKUP_BUDGET / 2):
+            return None
+    cnpj_cache.set(cnpj_clean, combined_data)
+    return combined_data
+
+def refresh_cnpj(cnpj_clean):
+    inflight.do(f"cnpj:{cnpj_clean}", lambda: fetch_cnpj(cnpj_clean, keep_stale=True), timeout=CNPJ_LOOKUP_BUDGET)
+
+refresher = BackgroundRefresher(
+    refresh_cnpj,
+    workers=int(os.environ.get('REFRESH_WORKERS', 2)),
+    max_pending=int(os.environ.get('REFRESH_QUEUE_SIZE', 1000)),
+)
+
+def cached_cnpj(cnpj_clean):
+    """Cached record or MISS; a stale one is returned marked with its age and queued for refresh"""
+    entry = cnpj_cache.get_entry(cnpj_clean)
+    if entry is MISS:
+        return MISS
+    combined_data, stored_at, expires_at = entry
+    now = time.time()
+    if expires_at > now:
+        return combined_data
+    refresher.submit(cnpj_clean)
+    return dict(combined_data, stale=True, age_seconds=int(now - stored_at))
+
+def parse_cnpj(cnpj):
+    """Cleaned CNPJ and an error message; invalid check digits never reach the network"""
+    cnpj_clean = cnpj_utils.clean(cnpj)
+    if len(cnpj_clean) != 14:
+        return cnpj_clean, "CNPJ deve ter 14 dígitos"
+    if not cnpj_utils.is_valid(cnpj_clean):
+        return cnpj_clean, "CNPJ inválido"
+    return cnpj_clean, None
+
+def lookup_cnpj(cnpj, batched=False):
+    """Cached CNPJ lookup shared by the single and batch endpoints; returns (record, error)"""
+    cnpj_clean, error = parse_cnpj(cnpj)
+    if error:
+        return None, error
+    
+    combined_data = cached_cnpj(cnpj_clean)
+    if combined_data is MISS:
+        deadline = time.monotonic() + CNPJ_LOOKUP_BUDGET
+        combined_data = table_lookup(cnpj_clean) or inflight.do(
+            f"cnpj:{cnpj_clean}", lambda: fetch_cnpj(cnpj_clean, batched=batched, deadline=deadline),
+            timeout=CNPJ_LOOKUP_BUDGET)
+    
+    if combined_data is None:
+        return None, "CNPJ não encontrado"
+    return combined_data, None
 
 @app.route('/api/cnpj/<cnpj>')
 def get_cnpj(cnpj):
     """Fetch CNPJ data from multiple sources"""
-    cnpj_clean = ''.join(c for c in cnpj if c.isdigit())
-    if len(cnpj_clean) != 14:
-        return jsonify({"error": "CNPJ deve ter 14 dígitos"})
-    
-    combined_data = {"cnpj": cnpj_clean, "sources": [], "enriched": False}
+    combined_data, error = lookup_cnpj(cnpj)
+    if error:
+        return jsonify(with_timing({"error": error}))
+    return jsonify(with_timing(combined_data))
+
+# Worker pool for bulk lookups; kept apart from lookup_pool, which runs the per-source fetches
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 8))
+batch_pool = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY)
+
+# A {"cnpjs": [...]} body has to be read whole, so it is capped (bytes); a bare JSON list,
+# NDJSON and CSV are read as they arrive, whatever their size
+BATCH_JSON_OBJECT_MAX = int(os.environ.get('BATCH_JSON_OBJECT_MAX', 1 << 20))
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/jsonl')
+READ_CHUNK = 65536
+
+def iter_csv_input(stream):
+    reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    column = 0
+    for line_no, row in enumerate(reader):
+        if not row:
+            continue
+        if line_no == 0:
+            header = [cell.strip().lower() for cell in row]
+            if 'cnpj' in header:
+                column = header.index('cnpj')
+                continue
+        if column < len(row):
+            yield row[column]
+
+def iter_ndjson_input(stream):
+    """One value per line: a JSON string or number, or a bare CNPJ"""
+    for line in io.TextIOWrapper(stream, encoding='utf-8-sig'):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            value = json.loads(line)
+        except ValueError:
+            value = line
+        yield str(value)
+
+def iter_json_array(chunks):
+    """Values of a JSON array, decoded from text chunks as they arrive; stops at malformed input"""
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+    exhausted = False
+    state = 'open'
     
-    # Source 1: BrasilAPI
-    try:
-        url = f"https://brasilapi.com.br/api/cnpj/v1/{cnpj_clean}"
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            combined_data.update(response.json())
-            combined_data["sources"].append("brasilapi")
-    except:
-        pass
+    def read_more():
+        nonlocal buffer, position, exhausted
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+        else:
+            buffer = buffer[position:] + chunk
+            position = 0
     
-    # Source 2: Minha Receita
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n':
+            position += 1
+        if position == len(buffer):
+            if exhausted:
+                return
+            read_more()
+            continue
+        char = buffer[position]
+        if state == 'open':
+            if char != '[':
+                return
+            position += 1
+            state = 'first'
+        elif state == 'after':
+            if char != ',':
+                return
+            position += 1
+            state = 'value'
+        elif state == 'first' and char == ']':
+            return
+        else:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                end = None
+            # A value touching the end of the buffer may go on in the next chunk (a number)
+            if end is None or (end == len(buffer) and not exhausted):
+                if exhausted:
+                    return
+                read_more()
+                continue
+            yield value
+            position = end
+            state = 'after'
+
+def batch_input():
+    """(raw CNPJ values, error) from an uploaded CSV, a text/csv or NDJSON body, or JSON
+
+    Values are read lazily, except for a {"cnpjs": [...]} object, which is refused past
+    BATCH_JSON_OBJECT_MAX bytes.
+    """
+    upload = request.files.get('file')
+    if upload is not None or request.mimetype == 'text/csv':
+        return iter_csv_input(upload.stream if upload is not None else request.stream), None
+    if request.mimetype in NDJSON_MIMETYPES:
+        return iter_ndjson_input(request.stream), None
+
+    # Look at the first character to tell a list, read as it arrives, from an object
+    stream = request.stream
+    head = b''
+    while not head.lstrip():
+        chunk = stream.read(READ_CHUNK)
+        if not chunk:
+            break
+        head += chunk
+    if head.lstrip()[:1] == b'{':
+        too_large = f"Envie no máximo {BATCH_JSON_OBJECT_MAX} bytes em {{\"cnpjs\": [...]}}; listas maiores como lista JSON, NDJSON ou CSV"
+        if (request.content_length or 0) > BATCH_JSON_OBJECT_MAX:
+            return None, too_large
+        body = [head]
+        size = len(head)
+        while size <= BATCH_JSON_OBJECT_MAX:
+            chunk = stream.read(READ_CHUNK)
+            if not chunk:
+                break
+            body.append(chunk)
+            size += len(chunk)
+        if size > BATCH_JSON_OBJECT_MAX:
+            return None, too_large
+        try:
+            data = json.loads(b''.join(body)).get("cnpjs")
+        except (ValueError, AttributeError):
+            data = None
+        return (str(value) for value in data or []), None
+
+    def text():
+        decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+        yield decoder.decode(head)
+        for chunk in iter(lambda: stream.read(READ_CHUNK), b''):
+            yield decoder.decode(chunk)
+        yield decoder.decode(b'', final=True)
+
+    return (str(value) for value in iter_json_array(text())), None
+
+def lookup_line(index, raw):
+    """One bulk-lookup result line: the record, or the error, tagged with its input position"""
     try:
-        url = f"https://minhareceita.org/{cnpj_clean}"
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            for key, value in data.items():
-                if key not in combined_data or not combined_data[key]:
-                    combined_data[key] = value
-            combined_data["sources"].append("minha_receita")
-    except:
-        pass
+        record, error = lookup_cnpj(raw, batched=True)
+    except Exception as e:
+        record, error = None, f"Erro na consulta: {e}"
+    if error:
+        return {"index": index, "input": raw, "error": error}
+    return {"index": index, "input": raw, **record}
+
+@app.route('/api/cnpj/batch', methods=['POST'])
+def batch_cnpj():
+    """Bulk CNPJ lookup streamed back as NDJSON in completion order"""
+    inputs, error = batch_input()
+    if error:
+        return jsonify({"error": error}), 413
     
-    if len(combined_data["sources"]) == 0:
-        return jsonify({"error": "CNPJ não encontrado"})
+    def generate():
+        pending = set()
+        for index, raw in enumerate(inputs):
+            # Bounded window: never read further ahead than the pool can work on
+            if len(pending) >= BATCH_CONCURRENCY:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield json.dumps(future.result(), ensure_ascii=False) + "\n"
+            pending.add(batch_pool.submit(lookup_line, index, raw.strip()))
+        for future in as_completed(pending):
+            yield json.dumps(future.result(), ensure_ascii=False) + "\n"
     
-    combined_data["enriched"] = len(combined_data["sources"]) > 1
-    return jsonify(combined_data)
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
-@app.route('/api/search')
-def search_companies():
-    """Search companies by name"""
-    query = request.args.get('q', '').strip()
-    if not query or len(query) < 3:
-        return jsonify({"error": "Digite pelo menos 3 caracteres"})
+# Large lists go through background jobs (see jobs.py), checkpointed to JOBS_DB and resumed on restart
+job_queue = JobQueue(
+    os.environ.get('JOBS_DB') or os.path.join(STATE_DIR, 'jobs.db'),
+    lookup_line,
+    concurrency=int(os.environ.get('JOB_CONCURRENCY', 4)),
+)
+
+@app.before_request
+def start_job_runner():
+    # Started by the first request rather than at import, so scripts importing the app
+    # (benchmark, store refresh, table builds) don't create the job store or run jobs
+    job_queue.start()
+
+JOB_FORMATS = {
+    "jsonl": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Queue a CNPJ list (same input formats as /api/cnpj/batch); returns the job ID"""
+    inputs, error = batch_input()
+    if error:
+        return jsonify({"error": error}), 413
+    job = job_queue.submit(inputs)
+    if job is None:
+        return jsonify({"error": "Nenhum CNPJ enviado"}), 400
+    return jsonify(job), 202
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    job = job_queue.status(job_id)
+    if job is None:
+        return jsonify({"error": "Job não encontrado"}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Job não encontrado"}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/results')
+def job_results(job_id):
+    """Finished rows in input order as ?format=jsonl (default), csv or parquet"""
+    if job_queue.status(job_id) is None:
+        return jsonify({"error": "Job não encontrado"}), 404
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in JOB_FORMATS:
+        return jsonify({"error": "Formato deve ser jsonl, csv ou parquet"}), 400
+    headers = {'Content-Disposition': f'attachment; filename="{job_id}.{fmt}"'}
+    if fmt == 'parquet':
+        try:
+            body = job_queue.parquet(job_id)
+        except RuntimeError as e:
+            return jsonify({"error": str(e)}), 501
+        return Response(body, mimetype=JOB_FORMATS[fmt], headers=headers)
+    rows = job_queue.iter_csv(job_id) if fmt == 'csv' else job_queue.iter_jsonl(job_id)
+    return Response(rows, mimetype=JOB_FORMATS[fmt], headers=headers)
+
+def provider_settings():
+    """Registered providers with their settings, and the strategy each kind runs under"""
+    return {
+        "providers": registry.snapshot(),
+        "strategies": {"cnpj": CNPJ_STRATEGY, "search": SEARCH_STRATEGY,
+                       "scrape": "hedged" if SEARCH_HEDGING else "sequential"},
+    }
+
+@app.route('/api/providers')
+def providers_config():
+    return jsonify(provider_settings())
+
+@app.route('/api/providers/health')
+def providers_health():
+    """Breaker state, rate-limit tokens and latency of every upstream provider"""
+    return jsonify(upstream.health.snapshot())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/cache/stats')
+def cache_stats():
+    """Counters of the CNPJ cache, the CNPJ table, request coalescing, background refresh and batching"""
+    return jsonify(dict(cnpj_cache.stats(), singleflight=inflight.stats(), refresh=refresher.stats(),
+                        table=cnpj_table.stats() if cnpj_table else None,
+                        batching={name: batcher.stats() for name, batcher in list(batchers.items())}))
+
+# Overall deadline (seconds) for the concurrent name-search API calls
+SEARCH_API_BUDGET = float(os.environ.get('SEARCH_API_BUDGET', 10))
+# Stop waiting for slower term/provider calls once this many unique hits arrived
+SEARCH_MIN_RESULTS = int(os.environ.get('SEARCH_MIN_RESULTS', 10))
+
+def brasilapi_search_request(term):
+    return upstream.url("brasilapi", f"/api/cnpj/v1/empresas?q={requests.utils.quote(term)}"), {}
+
+def parse_brasilapi_search(data):
+    """BrasilAPI name-search hits; None when the source had no answer"""
+    if not isinstance(data, list):
+        return None
+    return [{
+        "cnpj": item.get("cnpj", ""),
+        "razao_social": item.get("razao_social", ""),
+        "nome_fantasia": item.get("nome_fantasia", ""),
+        "source": "BrasilAPI"
+    } for item in data[:5]]
+
+def receitaws_search_request(term):
+    return upstream.url("receitaws", f"/v1/cnpj/search?q={requests.utils.quote(term)}"), {'Accept': 'application/json'}
+
+def parse_receitaws_search(data):
+    """ReceitaWS name-search hits; None when the source had no answer"""
+    if not data.get("data"):
+        return None
+    return [{
+        "cnpj": cnpj_utils.clean(item.get("cnpj", "")),
+        "razao_social": item.get("nome", ""),
+        "nome_fantasia": item.get("fantasia", ""),
+        "municipio": item.get("municipio", ""),
+        "uf": item.get("uf", ""),
+        "source": "ReceitaWS"
+    } for item in data["data"][:5]]
+
+# ReceitaWS' free tier allows 3 calls a minute, so it is the expensive one
+register(Provider("brasilapi", "search", brasilapi_search_request, parse_brasilapi_search, priority=10))
+register(Provider("receitaws", "search", receitaws_search_request, parse_receitaws_search, priority=20, cost=20))
+
+# How the name-search APIs are run over the term x provider calls (see providers.execute)
+SEARCH_STRATEGY = os.environ.get('SEARCH_STRATEGY', 'parallel')
+
+def add_search_hits(name, items, results, sources_used, seen):
+    """Append hits with an unseen CNPJ and record the source as used"""
+    added = 0
+    for item in items:
+        if item["cnpj"] and item["cnpj"] not in seen:
+            seen.add(item["cnpj"])
+            results.append(item)
+            added += 1
+    metrics.record_results(name, added)
+    if name not in sources_used:
+        sources_used.append(name)
+
+def search_apis(search_terms, results, sources_used, budget=None, on_slow=None):
+    """Run every term x provider combination at once, deduplicating by CNPJ as hits arrive
+
+    on_slow is called once if no hit has arrived after SEARCH_HEDGE_AFTER seconds.
+    """
+    budget = SEARCH_API_BUDGET if budget is None else budget
+    if len(results) >= SEARCH_MIN_RESULTS:
+        return
+    seen = {r.get("cnpj") for r in results}
+    sources = upstream.health.order(registry.providers("search"), key=lambda source: source.upstream)
     
-    results = []
-    sources_used = []
+    def on_result(source, term, items):
+        add_search_hits(source.name, items, results, sources_used, seen)
+        return len(results) >= SEARCH_MIN_RESULTS
+    
+    def hedge():
+        # The scrapers are only worth starting while the APIs have no hits at all
+        if not results:
+            on_slow()
     
-    # Try name variations
+    providers.execute(
+        [(source, term) for term in search_terms for source in sources], lookup_pool, SEARCH_STRATEGY,
+        budget=budget, on_result=on_result,
+        slow_after=SEARCH_HEDGE_AFTER, on_slow=hedge if on_slow is not None else None,
+    )
+
+# Optional name index snapshot (see name_index.py), loaded once at startup
+name_index = NameIndex.load(os.environ['NAME_INDEX_PATH']) if os.environ.get('NAME_INDEX_PATH') else None
+
+def search_local_index(query, results, sources_used, limit=None, prefix=False, partial=None):
+    """Ranked hits from the local name index
+
+    With a partial list, names matching only some of the query tokens are put there instead of
+    into results, for the caller to add after what the providers find.
+    """
+    if name_index is None:
+        return
+    seen = {r.get("cnpj") for r in results}
+    items = []
+    for _, complete, (cnpj, razao_social, nome_fantasia, municipio, uf) in name_index.search_matches(
+            query, limit=limit or SEARCH_MIN_RESULTS, prefix=prefix):
+        item = {
+            "cnpj": cnpj,
+            "razao_social": razao_social,
+            "nome_fantasia": nome_fantasia,
+            "municipio": municipio,
+            "uf": uf,
+            "source": "Receita Federal"
+        }
+        (items if complete or partial is None else partial).append(item)
+    if items:
+        add_search_hits("local_index", items, results, sources_used, seen)
+
+def add_partial_hits(partial, results, sources_used):
+    """Local names that matched only part of the query, after the providers' hits"""
+    if partial:
+        add_search_hits("local_index", partial, results, sources_used, {r.get("cnpj") for r in results})
+
+def name_variations(query):
+    """The raw query plus the name with a trailing legal suffix stripped"""
     search_terms = [query]
-    base_name = re.sub(r'\s+(brasil|brazil|ltda|me|sa)\s*$', '', query, flags=re.IGNORECASE).strip()
+    base_name = LEGAL_SUFFIX_RE.sub('', query).strip()
     if base_name and base_name != query:
         search_terms.append(base_name)
+    return search_terms[:2]
+
+def remaining(deadline):
+    """Seconds left before a monotonic deadline, or None when there is none"""
+    if deadline is None:
+        return None
+    return max(0.1, deadline - time.monotonic())
+
+def is_cancelled(cancel, deadline):
+    if cancel is not None and cancel.is_set():
+        return True
+    return deadline is not None and time.monotonic() >= deadline
+
+def scraped_names(results):
+    """Names already collected, for O(1) duplicate checks while scraping"""
+    return {r.get('nome_fantasia') for r in results} | {r.get('razao_social') for r in results}
+
+def scrape_google(query, results, sources_used, cancel=None, deadline=None):
+    """Google scraping fallback - IMPROVED"""
+    # More realistic browser headers
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
+        'Accept-Language': 'pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7',
+        'Accept-Encoding': 'gzip, deflate, br',
+        'Referer': 'https://www.google.com/',
+        'DNT': '1',
+        'Connection': 'keep-alive',
+        'Upgrade-Insecure-Requests': '1',
+        'Sec-Fetch-Dest': 'document',
+        'Sec-Fetch-Mode': 'navigate',
+        'Sec-Fetch-Site': 'same-origin',
+        'Cache-Control': 'max-age=0',
+    }
     
-    for term in search_terms[:2]:
-        # BrasilAPI
-        try:
-            url = f"https://brasilapi.com.br/api/cnpj/v1/empresas?q={requests.utils.quote(term)}"
-            response = requests.get(url, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                if isinstance(data, list):
-                    for item in data[:5]:
-                        cnpj = item.get("cnpj", "")
-                        if cnpj and not any(r.get("cnpj") == cnpj for r in results):
-                            results.append({
-                                "cnpj": cnpj,
-                                "razao_social": item.get("razao_social", ""),
-                                "nome_fantasia": item.get("nome_fantasia", ""),
-                                "source": "BrasilAPI"
-                            })
-                    if "brasilapi" not in sources_used:
-                        sources_used.append("brasilapi")
-        except:
-            pass
+    # Try different search queries
+    search_queries = [
+        query + ' CNPJ',
+        query + ' empresa',
+        query,
+        '"' + query + '"'
+    ]
+    
+    for search_query in search_queries:
+        if len(results) > 0 or is_cancelled(cancel, deadline):
+            break
+            
+        url = upstream.url("google", f"/search?q={requests.utils.quote(search_query)}&hl=pt-BR")
+        response = upstream.get("google", url, budget=remaining(deadline), headers=headers, allow_redirects=True)
         
-        # ReceitaWS
-        try:
-            url = f"https://www.receitaws.com.br/v1/cnpj/search?q={requests.utils.quote(term)}"
-            response = requests.get(url, headers={'Accept': 'application/json'}, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get("data"):
-                    for item in data["data"][:5]:
-                        cnpj_clean = item.get("cnpj", "").replace(".", "").replace("/", "").replace("-", "")
-                        if cnpj_clean and not any(r.get("cnpj") == cnpj_clean for r in results):
+        if response.status_code == 200:
+            # One pass collects h3 titles, query-matching nodes and CNPJs; ten titles are plenty
+            with metrics.parse_timer("google"):
+                page = html_extract.extract(response.text, query, enough=lambda page: len(page.h3) >= 10)
+            found_cnpjs = page.cnpjs
+            seen_names = scraped_names(results)
+            
+            # Multiple ways to find company names
+            # Method 1: Look for h3 tags (common in Google results)
+            for text in page.h3:
+                # Filter out generic titles
+                if len(text) > 5 and len(text) < 100 and not any(x in text.lower() for x in ['google', 'pesquisa', 'search', 'resultados']):
+                    if text not in seen_names:
+                        seen_names.add(text)
+                        cnpj_clean = found_cnpjs.pop(0) if found_cnpjs else ''
+                        results.append({
+                            "nome_fantasia": text,
+                            "razao_social": text,
+                            "cnpj": cnpj_clean,
+                            "source": "Google Search",
+                            "type": "scraping"
+                        })
+            
+            # Method 2: Look for divs and spans mentioning the company
+            if len(results) == 0:
+                for tag, text in page.containing:
+                    # Check if it looks like a company name
+                    if tag in ('div', 'span') and len(text) > 10 and len(text) < 150:
+                        if text not in seen_names:
+                            cnpj_clean = found_cnpjs.pop(0) if found_cnpjs else ''
                             results.append({
+                                "nome_fantasia": text[:100],
+                                "razao_social": text[:100],
                                 "cnpj": cnpj_clean,
-                                "razao_social": item.get("nome", ""),
-                                "nome_fantasia": item.get("fantasia", ""),
-                                "municipio": item.get("municipio", ""),
-                                "uf": item.get("uf", ""),
-                                "source": "ReceitaWS"
+                                "source": "Google Search",
+                                "type": "scraping"
                             })
-                    if "receitaws" not in sources_used:
-                        sources_used.append("receitaws")
-        except:
-            pass
-    
-    # Google scraping as fallback - IMPROVED
-    if len(results) == 0:
-        try:
-            # More realistic browser headers
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
-                'Accept-Language': 'pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Referer': 'https://www.google.com/',
-                'DNT': '1',
-                'Connection': 'keep-alive',
-                'Upgrade-Insecure-Requests': '1',
-                'Sec-Fetch-Dest': 'document',
-                'Sec-Fetch-Mode': 'navigate',
-                'Sec-Fetch-Site': 'same-origin',
-                'Cache-Control': 'max-age=0',
-            }
+                            break
             
-            # Try different search queries
-            search_queries = [
-                query + ' CNPJ',
-                query + ' empresa',
-                query,
-                '"' + query + '"'
-            ]
-            
-            for search_query in search_queries:
-                if len(results) > 0:
-                    break
-                    
-                url = f"https://www.google.com/search?q={requests.utils.quote(search_query)}&hl=pt-BR"
-                session = requests.Session()
-                response = session.get(url, headers=headers, timeout=15, allow_redirects=True)
+            if results and "google" not in sources_used:
+                sources_used.append("google")
+                break
                 
-                if response.status_code == 200:
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    
-                    # Look for CNPJ in entire page
-                    cnpj_pattern = r'\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2}'
-                    found_cnpjs = re.findall(cnpj_pattern, response.text)
-                    
-                    # Multiple ways to find company names
-                    # Method 1: Look for h3 tags (common in Google results)
-                    for h3 in soup.find_all('h3'):
-                        text = h3.get_text().strip()
-                        # Filter out generic titles
-                        if len(text) > 5 and len(text) < 100 and not any(x in text.lower() for x in ['google', 'pesquisa', 'search', 'resultados']):
-                            if not any(r.get('nome_fantasia') == text or r.get('razao_social') == text for r in results):
-                                cnpj = found_cnpjs.pop(0) if found_cnpjs else ''
-                                cnpj_clean = cnpj.replace('.', '').replace('/', '').replace('-', '') if cnpj else ''
-                                results.append({
-                                    "nome_fantasia": text,
-                                    "razao_social": text,
-                                    "cnpj": cnpj_clean,
-                                    "source": "Google Search",
-                                    "type": "scraping"
-                                })
-                    
-                    # Method 2: Look for divs with specific classes
-                    if len(results) == 0:
-                        for div in soup.find_all(['div', 'span']):
-                            text = div.get_text().strip()
-                            # Check if it looks like a company name
-                            if query.lower() in text.lower() and len(text) > 10 and len(text) < 150:
-                                if not any(r.get('nome_fantasia') == text or r.get('razao_social') == text for r in results):
-                                    cnpj = found_cnpjs.pop(0) if found_cnpjs else ''
-                                    cnpj_clean = cnpj.replace('.', '').replace('/', '').replace('-', '') if cnpj else ''
-                                    results.append({
-                                        "nome_fantasia": text[:100],
-                                        "razao_social": text[:100],
-                                        "cnpj": cnpj_clean,
-                                        "source": "Google Search",
-                                        "type": "scraping"
-                                    })
-                                    break
-                    
-                    if results and "google" not in sources_used:
-                        sources_used.append("google")
-                        break
-                        
-        except Exception as e:
-            print(f"Google scraping error: {e}")
-            pass
+
+YAHOO_RESULT_CLASSES = ['algo', 'ov-a', 'searchCenterMiddle', 'title', 'd-ib', 'ls0']
+
+def scrape_yahoo(query, results, sources_used, cancel=None, deadline=None):
+    """Yahoo search scraping fallback - IMPROVED"""
+    # Better headers to mimic real browser
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+        'Accept-Language': 'pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7',
+        'Accept-Encoding': 'gzip, deflate, br',
+        'Referer': 'https://search.yahoo.com/',
+        'DNT': '1',
+        'Connection': 'keep-alive',
+        'Upgrade-Insecure-Requests': '1',
+    }
     
-    # Yahoo search scraping as another fallback - IMPROVED
-    if len(results) == 0:
-        try:
-            # Better headers to mimic real browser
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                'Accept-Language': 'pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Referer': 'https://search.yahoo.com/',
-                'DNT': '1',
-                'Connection': 'keep-alive',
-                'Upgrade-Insecure-Requests': '1',
-            }
+    # Try different Yahoo search queries
+    yahoo_queries = [
+        query + ' CNPJ',
+        query + ' empresa Brazil',
+        query
+    ]
+    
+    for yahoo_query in yahoo_queries:
+        if len(results) > 0 or is_cancelled(cancel, deadline):
+            break
             
-            # Try different Yahoo search queries
-            yahoo_queries = [
-                query + ' CNPJ',
-                query + ' empresa Brazil',
-                query
-            ]
+        yahoo_url = upstream.url("yahoo", f"/search?p={requests.utils.quote(yahoo_query)}")
+        response = upstream.get("yahoo", yahoo_url, budget=remaining(deadline), headers=headers)
+        
+        if response.status_code == 200:
+            # One pass collects h3 titles, Yahoo result-class nodes, query-matching nodes and CNPJs
+            with metrics.parse_timer("yahoo"):
+                page = html_extract.extract(response.text, query, classes=YAHOO_RESULT_CLASSES)
+            found_cnpjs = page.cnpjs
+            seen_names = scraped_names(results)
+            query_lower = query.lower()
+            query_words = query_lower.split()
             
-            for yahoo_query in yahoo_queries:
-                if len(results) > 0:
-                    break
-                    
-                yahoo_url = f"https://search.yahoo.com/search?p={requests.utils.quote(yahoo_query)}"
-                session = requests.Session()
-                response = session.get(yahoo_url, headers=headers, timeout=15)
-                
-                if response.status_code == 200:
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    
-                    # Look for CNPJ patterns
-                    cnpj_pattern = r'\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2}'
-                    found_cnpjs = re.findall(cnpj_pattern, response.text)
-                    
-                    # Multiple parsing strategies for Yahoo
-                    # Strategy 1: Look for h3 tags
-                    for h3 in soup.find_all('h3'):
-                        text = h3.get_text().strip()
-                        if len(text) > 5 and len(text) < 100:
-                            if query.lower() in text.lower() or any(word in text.lower() for word in query.lower().split()):
-                                if not any(r.get('nome_fantasia') == text or r.get('razao_social') == text for r in results):
-                                    cnpj = found_cnpjs.pop(0) if found_cnpjs else ''
-                                    cnpj_clean = cnpj.replace('.', '').replace('/', '').replace('-', '') if cnpj else ''
-                                    results.append({
-                                        "nome_fantasia": text,
-                                        "razao_social": text,
-                                        "cnpj": cnpj_clean,
-                                        "source": "Yahoo Search",
-                                        "type": "scraping"
-                                    })
-                    
-                    # Strategy 2: Look for specific Yahoo result classes
-                    if len(results) == 0:
-                        yahoo_classes = ['algo', 'ov-a', 'searchCenterMiddle', 'title', 'd-ib', 'ls0']
-                        for class_name in yahoo_classes:
-                            elements = soup.find_all(['div', 'li', 'h3', 'a'], class_=class_name)
-                            for elem in elements[:3]:
-                                text = elem.get_text().strip()
-                                if len(text) > 5 and len(text) < 150:
-                                    if query.lower() in text.lower():
-                                        if not any(r.get('nome_fantasia') == text or r.get('razao_social') == text for r in results):
-                                            cnpj = found_cnpjs.pop(0) if found_cnpjs else ''
-                                            cnpj_clean = cnpj.replace('.', '').replace('/', '').replace('-', '') if cnpj else ''
-                                            results.append({
-                                                "nome_fantasia": text[:100],
-                                                "razao_social": text[:100],
-                                                "cnpj": cnpj_clean,
-                                                "source": "Yahoo Search",
-                                                "type": "scraping"
-                                            })
-                                            break
-                            if len(results) > 0:
-                                break
-                    
-                    # Strategy 3: Look for any text containing the query
-                    if len(results) == 0:
-                        for elem in soup.find_all(['div', 'span', 'a', 'h3']):
-                            text = elem.get_text().strip()
-                            if query.lower() in text.lower() and len(text) > 10 and len(text) < 200:
-                                if not any(r.get('nome_fantasia') == text or r.get('razao_social') == text for r in results):
-                                    cnpj = found_cnpjs.pop(0) if found_cnpjs else ''
-                                    cnpj_clean = cnpj.replace('.', '').replace('/', '').replace('-', '') if cnpj else ''
+            # Multiple parsing strategies for Yahoo
+            # Strategy 1: Look for h3 tags
+            for text in page.h3:
+                if len(text) > 5 and len(text) < 100:
+                    if query_lower in text.lower() or any(word in text.lower() for word in query_words):
+                        if text not in seen_names:
+                            seen_names.add(text)
+                            cnpj_clean = found_cnpjs.pop(0) if found_cnpjs else ''
+                            results.append({
+                                "nome_fantasia": text,
+                                "razao_social": text,
+                                "cnpj": cnpj_clean,
+                                "source": "Yahoo Search",
+                                "type": "scraping"
+                            })
+            
+            # Strategy 2: Look for specific Yahoo result classes
+            if len(results) == 0:
+                for class_name in YAHOO_RESULT_CLASSES:
+                    for text in page.by_class[class_name][:3]:
+                        if len(text) > 5 and len(text) < 150:
+                            if query_lower in text.lower():
+                                if text not in seen_names:
+                                    cnpj_clean = found_cnpjs.pop(0) if found_cnpjs else ''
                                     results.append({
                                         "nome_fantasia": text[:100],
                                         "razao_social": text[:100],
@@ -643,51 +1277,276 @@ def search_companies():
                                         "type": "scraping"
                                     })
                                     break
-                    
-                    if results and any(r.get('source') == 'Yahoo Search' for r in results):
-                        if "yahoo" not in sources_used:
-                            sources_used.append("yahoo")
+                    if len(results) > 0:
                         break
-                        
-        except Exception as e:
-            print(f"Yahoo search error: {e}")
-            pass
-    
-    # Bing search scraping as yet another fallback
-    if len(results) == 0:
-        try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-            }
-            bing_url = f"https://www.bing.com/search?q={requests.utils.quote(query + ' empresa CNPJ')}"
-            response = requests.get(bing_url, headers=headers, timeout=10)
             
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                cnpj_pattern = r'\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2}'
-                found_cnpjs = re.findall(cnpj_pattern, response.text)
-                
-                for cnpj in found_cnpjs[:2]:
-                    cnpj_clean = cnpj.replace('.', '').replace('/', '').replace('-', '')
-                    if not any(r.get("cnpj") == cnpj_clean for r in results):
-                        results.append({
-                            "nome_fantasia": f"Empresa encontrada (Bing)",
-                            "razao_social": query,
-                            "cnpj": cnpj_clean,
-                            "source": "Bing Search"
-                        })
+            # Strategy 3: Look for any text containing the query
+            if len(results) == 0:
+                for tag, text in page.containing:
+                    if len(text) > 10 and len(text) < 200:
+                        if text not in seen_names:
+                            cnpj_clean = found_cnpjs.pop(0) if found_cnpjs else ''
+                            results.append({
+                                "nome_fantasia": text[:100],
+                                "razao_social": text[:100],
+                                "cnpj": cnpj_clean,
+                                "source": "Yahoo Search",
+                                "type": "scraping"
+                            })
+                            break
+            
+            if results and any(r.get('source') == 'Yahoo Search' for r in results):
+                if "yahoo" not in sources_used:
+                    sources_used.append("yahoo")
+                break
                 
-                if found_cnpjs and "bing" not in sources_used:
-                    sources_used.append("bing")
-        except:
+
+def scrape_bing(query, results, sources_used, cancel=None, deadline=None):
+    """Bing search scraping fallback"""
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+    }
+    bing_url = upstream.url("bing", f"/search?q={requests.utils.quote(query + ' empresa CNPJ')}")
+    response = upstream.get("bing", bing_url, budget=remaining(deadline), headers=headers)
+    
+    if response.status_code == 200:
+        # Only CNPJs are used from Bing pages, so no parse tree is needed
+        with metrics.parse_timer("bing"):
+            found_cnpjs = cnpj_utils.find_cnpjs(response.text)
+        seen = {r.get("cnpj") for r in results}
+        
+        for cnpj_clean in found_cnpjs[:2]:
+            if cnpj_clean not in seen:
+                seen.add(cnpj_clean)
+                results.append({
+                    "nome_fantasia": f"Empresa encontrada (Bing)",
+                    "razao_social": query,
+                    "cnpj": cnpj_clean,
+                    "source": "Bing Search"
+                })
+        
+        if found_cnpjs and "bing" not in sources_used:
+            sources_used.append("bing")
+
+
+# Hedging: start the scrapers speculatively once the APIs have been silent this long (seconds)
+SEARCH_HEDGE_AFTER = float(os.environ.get('SEARCH_HEDGE_AFTER', 2))
+# Total time budget (seconds) for one name search, fallbacks included
+SEARCH_TOTAL_BUDGET = float(os.environ.get('SEARCH_TOTAL_BUDGET', 20))
+# Set SEARCH_HEDGING=0 to go back to trying the engines one after another
+SEARCH_HEDGING = os.environ.get('SEARCH_HEDGING', '1') != '0'
+
+scrape_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('SCRAPE_WORKERS', 12)))
+
+def run_scraper(scrape, query, cancel, deadline):
+    """One scraper against private result lists, so racing engines don't interleave hits"""
+    results = []
+    sources_used = []
+    try:
+        scrape(query, results, sources_used, cancel=cancel, deadline=deadline)
+    except ProviderUnavailable:
+        pass
+    except Exception as e:
+        print(f"{scrape.__name__} error: {e}")
+    return results, sources_used
+
+def scraper_fetch(scrape):
+    """Provider fetch for a search-engine scraper: its hits for a query, or None"""
+    def fetch(query, timeout, cancel=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        results, _ = run_scraper(scrape, query, cancel, deadline)
+        return results or None
+    return fetch
+
+register(Provider("google", "scrape", fetch=scraper_fetch(scrape_google), priority=10))
+register(Provider("yahoo", "scrape", fetch=scraper_fetch(scrape_yahoo), priority=20))
+register(Provider("bing", "scrape", fetch=scraper_fetch(scrape_bing), priority=30))
+
+class FallbackRace:
+    """All scraping fallbacks started at once; the first engine with a useful result wins"""
+    
+    def __init__(self, query, deadline):
+        self.query = query
+        self.deadline = deadline
+        self.cancel_event = threading.Event()
+        self.futures = {}
+    
+    def start(self):
+        if not self.futures:
+            self.futures = {
+                scrape_pool.submit(
+                    metrics.bind(scraper.call), self.query, remaining(self.deadline), self.cancel_event): scraper.name
+                for scraper in registry.providers("scrape")
+            }
+    
+    def cancel(self):
+        self.cancel_event.set()
+        for future in self.futures:
+            future.cancel()
+    
+    def collect(self, results, sources_used):
+        self.start()
+        try:
+            for future in as_completed(self.futures, timeout=remaining(self.deadline)):
+                if future.cancelled():
+                    continue
+                own_results = future.result()
+                if own_results:
+                    name = self.futures[future]
+                    metrics.record_results(name, len(own_results))
+                    results.extend(own_results)
+                    if name not in sources_used:
+                        sources_used.append(name)
+                    break
+        except FuturesTimeoutError:
             pass
+        finally:
+            self.cancel()
+
+def search_fallbacks(query, results, sources_used, deadline=None, race=None):
+    """Search-engine scraping, used when the APIs found nothing"""
+    if len(results) > 0:
+        if race is not None:
+            race.cancel()
+        return
+    if deadline is None:
+        deadline = time.monotonic() + SEARCH_TOTAL_BUDGET
+    
+    if SEARCH_HEDGING:
+        (race or FallbackRace(query, deadline)).collect(results, sources_used)
+        return
     
-    return jsonify({
+    # Sequential chain, healthiest engine first, until one finds something
+    def on_result(scraper, _, hits):
+        metrics.record_results(scraper.name, len(hits))
+        results.extend(hits)
+        if scraper.name not in sources_used:
+            sources_used.append(scraper.name)
+    
+    scrapers = upstream.health.order(registry.providers("scrape"), key=lambda scraper: scraper.upstream)
+    providers.execute([(scraper, query) for scraper in scrapers], None, "sequential",
+                      budget=remaining(deadline), on_result=on_result)
+
+def run_search(query, results=None):
+    """Name search across the local index, the APIs and the scraping fallbacks"""
+    results = [] if results is None else results
+    sources_used = []
+    deadline = time.monotonic() + SEARCH_TOTAL_BUDGET
+    
+    # The local index answers in milliseconds; providers are only skipped when a name in it
+    # matches every query token, otherwise partial matches are merged in after their hits
+    partial = []
+    search_local_index(query, results, sources_used, partial=partial)
+    if len(results) > 0:
+        add_partial_hits(partial, results, sources_used)
+        return {"query": query, "count": len(results), "sources": sources_used, "results": results}
+    
+    # Try name variations; if they stay silent past SEARCH_HEDGE_AFTER the scrapers start alongside
+    race = FallbackRace(query, deadline) if SEARCH_HEDGING else None
+    search_apis(
+        name_variations(query), results, sources_used,
+        budget=min(SEARCH_API_BUDGET, remaining(deadline)),
+        on_slow=race.start if race else None,
+    )
+    search_fallbacks(query, results, sources_used, deadline=deadline, race=race)
+    add_partial_hits(partial, results, sources_used)
+    
+    return {
         "query": query,
         "count": len(results),
         "sources": sources_used,
         "results": results
-    })
+    }
+
+def search_key(query):
+    return "search:" + ' '.join(query.lower().split())
+
+@app.route('/api/search')
+def search_companies():
+    """Search companies by name"""
+    query = request.args.get('q', '').strip()
+    if not query or len(query) < 3:
+        return jsonify({"error": "Digite pelo menos 3 caracteres"})
+    
+    # Searches aren't cached, so there's nothing for other workers to pick up: coalesce in-process only
+    data = inflight.do(search_key(query), lambda: run_search(query), cross_process=False)
+    return jsonify(with_timing(dict(data, query=query)))
+
+class ResultStream(list):
+    """Search result list that also queues every hit as it is added, for streaming responses"""
+    
+    def __init__(self):
+        super().__init__()
+        self.queue = queue.SimpleQueue()
+    
+    def append(self, item):
+        super().append(item)
+        self.queue.put(item)
+    
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+    
+    def drain(self):
+        while True:
+            try:
+                yield self.queue.get_nowait()
+            except queue.Empty:
+                return
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# Streamed searches run here rather than in lookup_pool, which they fan out into
+stream_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('SEARCH_STREAM_WORKERS', 16)))
+# Comment line sent when nothing happened for this long (seconds), so proxies keep the stream open
+SSE_KEEPALIVE = 15
+
+@app.route('/api/search/stream')
+def search_companies_stream():
+    """Name search as Server-Sent Events: a "result" event per unique hit, then a "done" summary"""
+    query = request.args.get('q', '').strip()
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    if not query or len(query) < 3:
+        body = sse_event("done", {"query": query, "error": "Digite pelo menos 3 caracteres"})
+        return Response(body, mimetype='text/event-stream', headers=headers)
+    
+    results = ResultStream()
+    future = stream_pool.submit(metrics.bind(run_search), query, results)
+    
+    def generate():
+        idle_since = time.monotonic()
+        while not future.done():
+            try:
+                item = results.queue.get(timeout=0.25)
+            except queue.Empty:
+                if time.monotonic() - idle_since >= SSE_KEEPALIVE:
+                    idle_since = time.monotonic()
+                    yield ": keepalive\n\n"
+                continue
+            idle_since = time.monotonic()
+            yield sse_event("result", item)
+        for item in results.drain():
+            yield sse_event("result", item)
+        try:
+            data = future.result()
+        except Exception as e:
+            yield sse_event("done", {"query": query, "error": f"Erro na busca: {e}"})
+            return
+        yield sse_event("done", {"query": query, "count": data["count"], "sources": data["sources"]})
+    
+    return Response(generate(), mimetype='text/event-stream', headers=headers)
+
+@app.route('/api/search/suggest')
+def suggest_companies():
+    """Type-ahead over the local name index"""
+    query = request.args.get('q', '').strip()
+    results = []
+    sources_used = []
+    if len(query) >= 2:
+        search_local_index(query, results, sources_used, limit=8, prefix=True)
+    return jsonify({"query": query, "count": len(results), "results": results})
 
 if __name__ == '__main__':
+    # Single-process development server; serve.py runs the app under gunicorn for production
     app.run(debug=False, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
@@ -0,0 +1,359 @@
+# CNPJ Finder - asyncio serving mode
+# Same providers, merge rules, budgets and JSON shapes as app.py, with upstream calls as
+# coroutines. Blocking work (SQLite cache tier, local stores, name index, scrapers) runs in
+# threads so it never stalls the event loop.
+# Run with: uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs
+
+import httpx
+
+import metrics
+import providers
+import upstream
+from health import ProviderUnavailable
+from singleflight import AsyncSingleFlight
+from app import (
+    MISS, FallbackRace, ResultStream,
+    add_partial_hits, add_search_hits, cached_cnpj, cnpj_cache, local_lookup, merge_cnpj_sources, name_variations, parse_cnpj, provider_settings,
+    registry, remaining, search_fallbacks, search_key, search_local_index, sse_event, table_lookup,
+)
+import app as flask_app
+
+_clients = {}
+inflight = AsyncSingleFlight()
+# How often (seconds) a streamed search checks for new hits
+STREAM_POLL = 0.05
+
+
+def client_for(provider):
+    """Async keep-alive client per provider, sized like its requests pool"""
+    client = _clients.get(provider)
+    if client is None:
+        config = upstream.PROVIDERS[provider]
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=config["pool_size"], max_keepalive_connections=config["pool_size"]),
+            transport=httpx.AsyncHTTPTransport(retries=config["retries"]),
+            follow_redirects=True,
+        )
+        _clients[provider] = client
+    return client
+
+
+async def close_clients():
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+def error_status(error):
+    if isinstance(error, httpx.TimeoutException):
+        return "timeout"
+    if isinstance(error, httpx.TransportError):
+        return "connection_error"
+    return "error"
+
+
+async def fetch_source(provider, arg, timeout):
+    """Async counterpart of Provider.call's JSON GET, retrying 429/5xx with backoff"""
+    name = provider.upstream
+    timeout = provider.budget(timeout)
+    url, headers = provider.build_request(arg)
+    if not upstream.health.allow(name):
+        metrics.record_rejected(name)
+        raise ProviderUnavailable(name)
+    started = time.monotonic()
+    deadline = started + timeout if timeout is not None else None
+    attempt = 0
+    try:
+        while True:
+            connect, read = upstream.timeout_for(name, deadline - time.monotonic() if deadline is not None else None)
+            response = await client_for(name).get(url, headers=headers, timeout=httpx.Timeout(read, connect=connect))
+            if response.status_code not in upstream.RETRY_STATUSES:
+                break
+            delay = upstream.next_retry(name, attempt, deadline, response.status_code, response.headers)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+            attempt += 1
+    except asyncio.CancelledError:
+        # Abandoned at the caller's deadline: counts as a timeout, which also ends a half-open probe
+        elapsed = time.monotonic() - started
+        upstream.health.record_failure(name, elapsed, "cancelled")
+        metrics.record_call(name, elapsed, "cancelled")
+        raise
+    except Exception as e:
+        elapsed = time.monotonic() - started
+        upstream.health.record_failure(name, elapsed, e)
+        metrics.record_call(name, elapsed, error_status(e))
+        raise
+    elapsed = time.monotonic() - started
+    if upstream.is_failure(response.status_code):
+        upstream.health.record_failure(name, elapsed, f"HTTP {response.status_code}")
+    else:
+        upstream.health.record_success(name, elapsed)
+    metrics.record_call(name, elapsed, response.status_code, len(response.content))
+    if response.status_code == 200:
+        with metrics.parse_timer(name):
+            return response.json()
+    return None
+
+
+async def call_provider(provider, arg, timeout):
+    """Provider.call on the event loop: JSON GETs go through httpx, custom fetches run in a thread"""
+    if provider.fetch is not None:
+        return await asyncio.to_thread(provider.call, arg, timeout)
+    data = await fetch_source(provider, arg, timeout)
+    if data is None or provider.parse is None:
+        return data
+    with metrics.parse_timer(provider.upstream):
+        return provider.parse(data)
+
+
+async def enrich_cnpj(cnpj_clean, budget=None):
+    """Run the CNPJ sources under CNPJ_STRATEGY and merge whatever arrives within the budget"""
+    budget = flask_app.CNPJ_LOOKUP_BUDGET if budget is None else budget
+    sources = registry.providers("cnpj")
+    answers = await providers.execute_async(
+        [(source, cnpj_clean) for source in sources], call_provider, flask_app.CNPJ_STRATEGY,
+        budget=budget, hedge_after=flask_app.CNPJ_HEDGE_AFTER,
+    )
+    found = {source.name: data for source, _, data in answers}
+    return merge_cnpj_sources(cnpj_clean, [(source.name, found[source.name]) for source in sources if source.name in found])
+
+
+async def fetch_cnpj(cnpj_clean):
+    local_data = await asyncio.to_thread(local_lookup, cnpj_clean)
+    if local_data is not None:
+        return local_data
+    combined_data = await enrich_cnpj(cnpj_clean)
+    if len(combined_data["sources"]) == 0:
+        combined_data = None
+    await asyncio.to_thread(cnpj_cache.set, cnpj_clean, combined_data)
+    return combined_data
+
+
+async def lookup_cnpj(cnpj):
+    cnpj_clean, error = parse_cnpj(cnpj)
+    if error:
+        return None, error
+
+    # The cache may go to SQLite and the table to disk
+    combined_data = await asyncio.to_thread(cached_cnpj, cnpj_clean)
+    if combined_data is MISS:
+        combined_data = (await asyncio.to_thread(table_lookup, cnpj_clean)
+                         or await inflight.do(f"cnpj:{cnpj_clean}", lambda: fetch_cnpj(cnpj_clean)))
+
+    if combined_data is None:
+        return None, "CNPJ não encontrado"
+    return combined_data, None
+
+
+async def search_apis(search_terms, results, sources_used, budget=None, on_slow=None):
+    """Every term x provider pair under SEARCH_STRATEGY, stopping early at SEARCH_MIN_RESULTS unique hits
+
+    on_slow is called once if no hit has arrived after SEARCH_HEDGE_AFTER seconds.
+    """
+    budget = flask_app.SEARCH_API_BUDGET if budget is None else budget
+    if len(results) >= flask_app.SEARCH_MIN_RESULTS:
+        return
+    seen = {r.get("cnpj") for r in results}
+    sources = upstream.health.order(registry.providers("search"), key=lambda source: source.upstream)
+
+    def on_result(source, term, items):
+        add_search_hits(source.name, items, results, sources_used, seen)
+        return len(results) >= flask_app.SEARCH_MIN_RESULTS
+
+    def hedge():
+        if not results:
+            on_slow()
+
+    await providers.execute_async(
+        [(source, term) for term in search_terms for source in sources], call_provider, flask_app.SEARCH_STRATEGY,
+        budget=budget, on_result=on_result,
+        slow_after=flask_app.SEARCH_HEDGE_AFTER, on_slow=hedge if on_slow is not None else None,
+    )
+
+
+async def run_search(query, results=None):
+    """app.run_search on the event loop: same order, hedging and SEARCH_TOTAL_BUDGET"""
+    results = [] if results is None else results
+    sources_used = []
+    deadline = time.monotonic() + flask_app.SEARCH_TOTAL_BUDGET
+    partial = []
+    await asyncio.to_thread(search_local_index, query, results, sources_used, partial=partial)
+    if len(results) > 0:
+        add_partial_hits(partial, results, sources_used)
+        return {"query": query, "count": len(results), "sources": sources_used, "results": results}
+
+    # The scrapers start in their own pool once the APIs stay silent past SEARCH_HEDGE_AFTER
+    race = FallbackRace(query, deadline) if flask_app.SEARCH_HEDGING else None
+    await search_apis(
+        name_variations(query), results, sources_used,
+        budget=min(flask_app.SEARCH_API_BUDGET, remaining(deadline)),
+        on_slow=race.start if race else None,
+    )
+    # Collecting the race (or the sequential chain) blocks on page fetches; keep it off the event loop
+    await asyncio.to_thread(search_fallbacks, query, results, sources_used, deadline, race)
+    add_partial_hits(partial, results, sources_used)
+
+    return {
+        "query": query,
+        "count": len(results),
+        "sources": sources_used,
+        "results": results
+    }
+
+
+async def search_companies(query):
+    query = query.strip()
+    if not query or len(query) < 3:
+        return {"error": "Digite pelo menos 3 caracteres"}
+
+    data = await inflight.do(search_key(query), lambda: run_search(query))
+    return dict(data, query=query)
+
+
+async def stream_search(send, query):
+    """Name search as Server-Sent Events, like app.search_companies_stream"""
+    query = query.strip()
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/event-stream; charset=utf-8'),
+                    (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')],
+    })
+
+    async def send_event(event, data, more_body=True):
+        await send({'type': 'http.response.body', 'body': sse_event(event, data).encode(), 'more_body': more_body})
+
+    if not query or len(query) < 3:
+        await send_event("done", {"query": query, "error": "Digite pelo menos 3 caracteres"}, more_body=False)
+        return
+
+    results = ResultStream()
+    task = asyncio.ensure_future(run_search(query, results))
+    while True:
+        finished = task.done()
+        for item in results.drain():
+            await send_event("result", item)
+        if finished:
+            break
+        # Hits from the scraper thread land in the queue without waking the loop, so poll briefly
+        await asyncio.wait([task], timeout=STREAM_POLL)
+    try:
+        data = task.result()
+    except Exception as e:
+        await send_event("done", {"query": query, "error": f"Erro na busca: {e}"}, more_body=False)
+        return
+    await send_event("done", {"query": query, "count": data["count"], "sources": data["sources"]}, more_body=False)
+
+
+async def send_body(send, status, body, content_type, headers=None):
+    extra = [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+    if content_type:
+        extra.insert(0, (b'content-type', content_type.encode()))
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': extra + [(b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, data, status=200):
+    # Same serialization as Flask's jsonify so clients see identical payloads
+    body = json.dumps(data, sort_keys=True).encode()
+    await send_body(send, status, body, 'application/json')
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_clients()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+def with_timing(data, params):
+    trace = metrics.current_trace()
+    if trace is None or params.get('timing', [''])[0] != '1':
+        return data
+    return dict(data, timing=trace.as_dict())
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    trace = metrics.start_trace()
+    statuses = []
+
+    async def traced_send(message):
+        if message['type'] == 'http.response.start':
+            statuses.append(message['status'])
+            if metrics.SERVER_TIMING and scope['path'] != '/metrics':
+                header = (b'server-timing', trace.server_timing().encode())
+                message = dict(message, headers=list(message['headers']) + [header])
+        await send(message)
+
+    route = await dispatch(scope, traced_send)
+    if route != '/metrics':
+        metrics.observe_request(route, statuses[0] if statuses else 500, trace.elapsed())
+
+
+async def dispatch(scope, send):
+    """Serve one HTTP request; returns the route label used in metrics"""
+    path = scope['path']
+    params = parse_qs(scope.get('query_string', b'').decode())
+    if scope['method'] not in ('GET', 'HEAD'):
+        await send_json(send, {"error": "Method not allowed"}, 405)
+        return "unmatched"
+    if path == '/':
+        request_headers = dict(scope.get('headers', []))
+        status, body, headers = flask_app.index_page.select(
+            request_headers.get(b'accept-encoding', b'').decode(), request_headers.get(b'if-none-match', b'').decode())
+        await send_body(send, status, body, headers.pop('Content-Type', None), headers)
+        return '/'
+    if path == '/metrics':
+        await send_body(send, 200, metrics.render().encode(), 'text/plain; version=0.0.4')
+        return '/metrics'
+    if path.startswith('/api/cnpj/'):
+        combined_data, error = await lookup_cnpj(path[len('/api/cnpj/'):])
+        await send_json(send, with_timing({"error": error} if error else combined_data, params))
+        return '/api/cnpj/<cnpj>'
+    if path == '/api/search':
+        await send_json(send, with_timing(await search_companies(params.get('q', [''])[0]), params))
+        return '/api/search'
+    if path == '/api/search/stream':
+        await stream_search(send, params.get('q', [''])[0])
+        return '/api/search/stream'
+    if path == '/api/search/suggest':
+        query = params.get('q', [''])[0].strip()
+        results = []
+        if len(query) >= 2:
+            await asyncio.to_thread(search_local_index, query, results, [], limit=8, prefix=True)
+        await send_json(send, {"query": query, "count": len(results), "results": results})
+        return '/api/search/suggest'
+    if path == '/api/providers':
+        await send_json(send, provider_settings())
+        return '/api/providers'
+    if path == '/api/providers/health':
+        await send_json(send, upstream.health.snapshot())
+        return '/api/providers/health'
+    if path == '/api/cache/stats':
+        await send_json(send, dict(cnpj_cache.stats(), singleflight=inflight.stats(), refresh=flask_app.refresher.stats(),
+                                   table=flask_app.cnpj_table.stats() if flask_app.cnpj_table else None))
+        return '/api/cache/stats'
+    await send_json(send, {"error": "Not found"}, 404)
+    return "unmatched"
@@ -0,0 +1,94 @@
+# Micro-batching of upstream lookups
+# Keys submitted within a short window are collected and resolved together by one
+# fetch_many(keys) call, so a provider with a multi-ID endpoint gets one request per window
+# instead of one per key, and bulk traffic is grouped per provider either way.
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class MicroBatcher:
+    """Groups keys into batches of up to max_batch, closed window seconds after their first key
+
+    fetch_many(keys) returns {key: result}; keys it leaves out resolve to None and an exception
+    fails every key of the batch. A key already waiting in the open batch shares its future.
+    Up to max_inflight batches run at once, so a slow batch doesn't hold up the next window.
+    """
+
+    def __init__(self, fetch_many, window=0.01, max_batch=50, max_inflight=4, name="batch"):
+        self.fetch_many = fetch_many
+        self.window = window
+        self.max_batch = max_batch
+        self.max_inflight = max_inflight
+        self.name = name
+        self._pending = {}
+        self._opened = 0.0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pool = None
+        self._stats = {"keys": 0, "coalesced": 0, "batches": 0, "failed": 0, "largest": 0}
+
+    def _start(self):
+        # Threads start on first use, so importing the app before forking workers stays safe
+        if self._thread is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_inflight, thread_name_prefix=self.name)
+            self._thread = threading.Thread(target=self._collect, name=f"{self.name}-collector", daemon=True)
+            self._thread.start()
+
+    def submit(self, key):
+        """Future resolving to the key's result once its batch has been fetched"""
+        with self._cond:
+            self._start()
+            future = self._pending.get(key)
+            if future is not None:
+                self._stats["coalesced"] += 1
+                return future
+            future = self._pending[key] = Future()
+            self._stats["keys"] += 1
+            if len(self._pending) == 1:
+                self._opened = time.monotonic()
+                self._cond.notify()
+            elif len(self._pending) >= self.max_batch:
+                self._cond.notify()
+            return future
+
+    def _collect(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                while len(self._pending) < self.max_batch:
+                    remaining = self._opened + self.window - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                keys = list(self._pending)[:self.max_batch]
+                batch = {key: self._pending.pop(key) for key in keys}
+                # Keys left over start the next window now
+                self._opened = time.monotonic()
+                # Running futures can no longer be cancelled; cancelled ones are left out
+                batch = {key: future for key, future in batch.items() if future.set_running_or_notify_cancel()}
+                if not batch:
+                    continue
+                self._stats["batches"] += 1
+                self._stats["largest"] = max(self._stats["largest"], len(batch))
+            self._pool.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch):
+        try:
+            results = self.fetch_many(list(batch))
+        except Exception as e:
+            with self._cond:
+                self._stats["failed"] += 1
+            for future in batch.values():
+                future.set_exception(e)
+            return
+        for key, future in batch.items():
+            future.set_result(results.get(key))
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats, pending=len(self._pending), window=self.window, max_batch=self.max_batch)
+        stats["mean_size"] = round(stats["keys"] / stats["batches"], 2) if stats["batches"] else 0.0
+        return stats
@@ -0,0 +1,213 @@
+# Offline benchmark for the CNPJ lookup and name search endpoints
+# Starts mock_upstream.py in-process, points the app at it, serves the app on a local port and
+# drives both endpoints at each concurrency level. Reports throughput, latency percentiles and
+# where the upstream time went, per provider. With --providers, registered providers are called
+# directly instead, one at a time, to profile each source in isolation.
+#
+# Run:  python benchmark.py --concurrency 1,8,32 --requests 200 --latency 0.1 --latency google=0.5
+#       python benchmark.py --providers cnpj/brasilapi,search/receitaws   (or --providers all)
+
+import argparse
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import mock_upstream
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def cnpj_paths(count, hot_keys, seed):
+    """Unique valid CNPJs, or draws from a small hot set to exercise caching and coalescing"""
+    rng = random.Random(seed)
+    if hot_keys:
+        hot = [mock_upstream.fake_cnpj(rng.getrandbits(40)) for _ in range(hot_keys)]
+        return [f"/api/cnpj/{rng.choice(hot)}" for _ in range(count)]
+    return [f"/api/cnpj/{mock_upstream.fake_cnpj(rng.getrandbits(40))}" for _ in range(count)]
+
+
+def search_paths(count, hot_keys, seed):
+    rng = random.Random(seed)
+    terms = [f"empresa {i}" for i in range(hot_keys or count)]
+    return [f"/api/search?q={requests.utils.quote(rng.choice(terms) if hot_keys else terms[i])}"
+            for i in range(count)]
+
+
+def run(base_url, paths, concurrency):
+    """Fire all paths with `concurrency` client threads; returns (latencies, errors, seconds)"""
+    local = threading.local()
+
+    def one(path):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            ok = session.get(base_url + path, timeout=60).status_code < 500
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, paths))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for latency, _ in outcomes)
+    return latencies, sum(1 for _, ok in outcomes if not ok), elapsed
+
+
+def provider_inputs(provider, count, hot_keys, seed):
+    """Arguments for direct provider calls: CNPJs for lookups, search terms otherwise"""
+    if provider.kind == "cnpj":
+        return [path[len("/api/cnpj/"):] for path in cnpj_paths(count, hot_keys, seed)]
+    rng = random.Random(seed)
+    terms = [f"empresa {i}" for i in range(hot_keys or count)]
+    return [rng.choice(terms) if hot_keys else terms[i] for i in range(count)]
+
+
+def run_provider(provider, inputs, concurrency, budget):
+    """Call one provider directly with `concurrency` threads; returns (latencies, errors, seconds)"""
+    def one(arg):
+        started = time.perf_counter()
+        try:
+            provider.call(arg, budget)
+            ok = True
+        except Exception:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, inputs))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for latency, _ in outcomes)
+    return latencies, sum(1 for _, ok in outcomes if not ok), elapsed
+
+
+def summarize(endpoint, concurrency, latencies, errors, elapsed, upstream_stats):
+    providers = {}
+    total_seconds = sum(stats["seconds"] for stats in upstream_stats.values()) or 1.0
+    for provider, stats in upstream_stats.items():
+        if not stats["requests"]:
+            continue
+        providers[provider] = {
+            "requests": stats["requests"],
+            "errors": stats["errors"],
+            "mean_ms": round(stats["seconds"] / stats["requests"] * 1000, 1),
+            "total_s": round(stats["seconds"], 2),
+            "share": round(stats["seconds"] / total_seconds, 3),
+        }
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "providers": providers,
+    }
+
+
+def print_report(report):
+    print(f"\n{report['endpoint']}  concurrency={report['concurrency']}  requests={report['requests']}  "
+          f"errors={report['errors']}")
+    print(f"  throughput {report['throughput_rps']} req/s   "
+          f"p50 {report['p50_ms']} ms   p95 {report['p95_ms']} ms   p99 {report['p99_ms']} ms")
+    for provider, stats in report["providers"].items():
+        print(f"  {provider:<14} {stats['requests']:>6} calls {stats['errors']:>4} errors "
+              f"{stats['mean_ms']:>8} ms avg {stats['total_s']:>8} s total {stats['share'] * 100:>5.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark against mocked upstream providers")
+    parser.add_argument('--concurrency', default='1,8,32', help="comma-separated client concurrency levels")
+    parser.add_argument('--requests', type=int, default=200, help="requests per endpoint and level")
+    parser.add_argument('--endpoints', default='cnpj,search')
+    parser.add_argument('--latency', action='append', help="seconds, or provider=seconds (repeatable)")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--search-hit-rate', type=float, default=1.0)
+    parser.add_argument('--hot-keys', type=int, default=0,
+                        help="draw inputs from this many distinct keys (0 = all unique)")
+    parser.add_argument('--rate-limits', action='store_true',
+                        help="keep the production per-provider rate limits (off by default)")
+    parser.add_argument('--providers', default=None,
+                        help="kind/name,... (or 'all') to load-test registered providers on their own")
+    parser.add_argument('--budget', type=float, default=10.0, help="seconds allowed per direct provider call")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="print the reports as JSON lines")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    _, state, mock_url = mock_upstream.start(
+        latency=mock_upstream.parse_latency(args.latency),
+        error_rate=args.error_rate,
+        search_hit_rate=args.search_hit_rate,
+    )
+    # Base URLs are read at import time, so the app must be imported after this
+    os.environ.update(mock_upstream.provider_env(mock_url))
+    import app
+    import upstream
+    from providers import registry
+    from health import ProviderHealth
+    from werkzeug.serving import make_server
+
+    if not args.rate_limits:
+        upstream.health = ProviderHealth()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    def report(endpoint, level, latencies, errors, elapsed):
+        summary = summarize(endpoint, level, latencies, errors, elapsed, state.snapshot())
+        if args.json:
+            print(json.dumps(summary))
+        else:
+            print_report(summary)
+
+    levels = [int(value) for value in args.concurrency.split(',')]
+    if args.providers:
+        if args.providers == 'all':
+            targets = [p for kind in ("cnpj", "search", "scrape") for p in registry.providers(kind)]
+        else:
+            targets = []
+            for spec in args.providers.split(','):
+                kind, _, name = spec.partition('/')
+                provider = registry.get(kind, name)
+                if provider is None:
+                    parser.error(f"no provider {spec!r}")
+                targets.append(provider)
+        for level in levels:
+            for provider in targets:
+                label = f"{provider.kind}/{provider.name}"
+                inputs = provider_inputs(provider, args.requests, args.hot_keys, f"{args.seed}-{label}-{level}")
+                state.reset()
+                report(label, level, *run_provider(provider, inputs, level, args.budget))
+        server.shutdown()
+        return
+
+    builders = {"cnpj": cnpj_paths, "search": search_paths}
+    for level in levels:
+        for endpoint in args.endpoints.split(','):
+            paths = builders[endpoint](args.requests, args.hot_keys, f"{args.seed}-{endpoint}-{level}")
+            state.reset()
+            report(endpoint, level, *run(base_url, paths, level))
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+# Tiered TTL cache for enriched CNPJ records
+# In-process LRU in front of an optional SQLite store shared by worker processes
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from record_store import RecordStore
+
+# Returned by TieredCache.get when the key is absent or expired
+MISS = object()
+
+
+class _Row(int):
+    """Row number of a record kept in the cache's RecordStore"""
+    __slots__ = ()
+
+
+def content_hash(value):
+    """Stable digest of a record, independent of key order"""
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+
+class TieredCache:
+    """LRU + TTL cache; a value of None is a cached negative result
+
+    With max_stale set, expired positive entries are kept that many seconds longer and
+    returned by get_entry (but not get) so callers can serve them while refreshing.
+    With compact set, the in-process tier keeps dict records in a RecordStore instead of as dicts.
+    """
+
+    def __init__(self, maxsize=10000, ttl=86400, negative_ttl=600, db_path=None, max_stale=0, compact=False):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_stale = max_stale
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._store = RecordStore() if compact else None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {"hits": 0, "disk_hits": 0, "negative_hits": 0, "stale_hits": 0, "misses": 0}
+        if db_path:
+            db = self._db()
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT, stored_at REAL, expires_at REAL, hash TEXT)"
+            )
+            if "hash" not in [row[1] for row in db.execute("PRAGMA table_info(cache)")]:
+                db.execute("ALTER TABLE cache ADD COLUMN hash TEXT")
+
+    def _db(self):
+        # sqlite3 connections can't be shared across threads, so keep one per thread; a connection
+        # inherited through fork (serve.py imports the app before forking) is never reused
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _remember(self, key, entry):
+        with self._lock:
+            if self._store is not None:
+                # Entries hold a store row in place of the record
+                self._forget(self._entries.get(key))
+                value = entry[0]
+                entry = (_Row(self._store.add(value)) if isinstance(value, dict) else value, entry[1], entry[2])
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._forget(self._entries.popitem(last=False)[1])
+
+    def _forget(self, entry):
+        if entry is not None and type(entry[0]) is _Row:
+            self._store.remove(entry[0])
+
+    def _value(self, entry):
+        if type(entry[0]) is _Row:
+            return (self._store.get(entry[0]), entry[1], entry[2])
+        return entry
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _usable_until(self, value, expires_at):
+        return expires_at + self.max_stale if value is not None else expires_at
+
+    def get(self, key):
+        entry = self.get_entry(key, allow_stale=False)
+        return entry if entry is MISS else entry[0]
+
+    def peek(self, key):
+        """Like get, but left out of the hit/miss stats; for re-checking a lookup already counted"""
+        entry = self.get_entry(key, allow_stale=False, count=False)
+        return entry if entry is MISS else entry[0]
+
+    def get_entry(self, key, allow_stale=True, count=True):
+        """(value, stored_at, expires_at), or MISS; stale entries only with allow_stale"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[2] > now or (allow_stale and self._usable_until(entry[0], entry[2]) > now):
+                    self._entries.move_to_end(key)
+                    if count:
+                        self._stats["hits" if entry[2] > now else "stale_hits"] += 1
+                        if entry[0] is None:
+                            self._stats["negative_hits"] += 1
+                    return self._value(entry)
+                if self._usable_until(entry[0], entry[2]) <= now:
+                    self._forget(self._entries.pop(key))
+
+        if self.db_path:
+            try:
+                row = self._db().execute(
+                    "SELECT value, stored_at, expires_at FROM cache WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error:
+                row = None
+            if row and (row[2] > now or (allow_stale and row[0] is not None and row[2] + self.max_stale > now)):
+                value = json.loads(row[0]) if row[0] is not None else None
+                entry = (value, row[1], row[2])
+                self._remember(key, entry)
+                if count:
+                    self._count("disk_hits" if row[2] > now else "stale_hits")
+                    if value is None:
+                        self._count("negative_hits")
+                return entry
+
+        if count:
+            self._count("misses")
+        return MISS
+
+    def set(self, key, value):
+        now = time.time()
+        expires_at = now + (self.negative_ttl if value is None else self.ttl)
+        self._remember(key, (value, now, expires_at))
+        if self.db_path:
+            try:
+                self._db().execute(
+                    "INSERT OR REPLACE INTO cache (key, value, stored_at, expires_at, hash) VALUES (?, ?, ?, ?, ?)",
+                    (key, json.dumps(value) if value is not None else None, now, expires_at,
+                     content_hash(value) if value is not None else None)
+                )
+            except sqlite3.Error:
+                pass
+
+    def set_if_changed(self, key, value):
+        """Store a re-fetched value, rewriting the row only if its content hash changed
+
+        An unchanged record just has its timestamps renewed. Returns True when it changed.
+        """
+        if not self.db_path:
+            self.set(key, value)
+            return True
+        digest = content_hash(value) if value is not None else None
+        row = self._db().execute("SELECT hash FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[0] is None or row[0] != digest:
+            self.set(key, value)
+            return True
+        now = time.time()
+        expires_at = now + self.ttl
+        self._remember(key, (value, now, expires_at))
+        self._db().execute("UPDATE cache SET stored_at = ?, expires_at = ? WHERE key = ?", (now, expires_at, key))
+        return False
+
+    def preload(self, limit=None):
+        """Fill the in-process tier with the most recently stored usable rows; returns how many"""
+        if not self.db_path:
+            return 0
+        limit = self.maxsize if limit is None else min(limit, self.maxsize)
+        now = time.time()
+        rows = self._db().execute(
+            "SELECT key, value, stored_at, expires_at FROM cache WHERE expires_at > ? "
+            "ORDER BY stored_at DESC LIMIT ?", (now - self.max_stale, limit)
+        ).fetchall()
+        loaded = 0
+        # Oldest first, so the newest rows end up most recently used
+        for key, value, stored_at, expires_at in reversed(rows):
+            if value is None and expires_at <= now:
+                continue
+            self._remember(key, (json.loads(value) if value is not None else None, stored_at, expires_at))
+            loaded += 1
+        return loaded
+
+    def keys_stored_before(self, cutoff, keys=None):
+        """Keys of persisted positive entries stored before cutoff, optionally limited to keys"""
+        if not self.db_path:
+            return []
+        db = self._db()
+        if keys is None:
+            return [row[0] for row in db.execute(
+                "SELECT key FROM cache WHERE value IS NOT NULL AND stored_at < ?", (cutoff,))]
+        found = []
+        keys = list(keys)
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            found.extend(row[0] for row in db.execute(
+                f"SELECT key FROM cache WHERE value IS NOT NULL AND stored_at < ? "
+                f"AND key IN ({', '.join('?' * len(chunk))})", [cutoff] + chunk))
+        return found
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+            if self._store is not None:
+                stats["compact"] = self._store.stats()
+        stats["maxsize"] = self.maxsize
+        stats["max_stale"] = self.max_stale
+        stats["persistent"] = bool(self.db_path)
+        served = stats["hits"] + stats["disk_hits"] + stats["stale_hits"]
+        lookups = served + stats["misses"]
+        stats["hit_ratio"] = round(served / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,270 @@
+# Read-only, memory-mapped table of merged CNPJ records for point lookups
+# One file: a sorted index of fixed-width 14-byte CNPJ keys pointing into a blob of
+# zlib-compressed JSON records. It is opened with mmap, so opening is instant, every worker
+# process shares the same page cache, and a lookup only touches the pages it reads.
+# Rebuilds write a new file and rename it over the old one; readers pick it up on their own.
+#
+# Layout (little-endian):
+#   header    64 bytes, see HEADER
+#   blob      compressed records, back to back
+#   fanout    FANOUT + 1 uint32: index of the first key per 4-character prefix
+#   keys      count x 14 ASCII bytes, ascending
+#   offsets   count + 1 uint64: record i is blob[offsets[i]:offsets[i + 1]]
+#
+# Build:  python cnpj_table.py --from-cache <cache_db> <table_path>
+#         python cnpj_table.py --from-receita <receita_db> <table_path>
+
+import argparse
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+
+MAGIC = b'CNPJTBL1'
+# magic, count, built_at, blob_offset, fanout_offset, keys_offset, offsets_offset
+HEADER = struct.Struct('<8sQdQQQQ')
+HEADER_SIZE = 64
+KEY_SIZE = 14
+ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+# Keys are bucketed by their first 4 characters, so a lookup bisects one bucket only
+PREFIX = 4
+FANOUT = len(ALPHABET) ** PREFIX
+COMPRESS_LEVEL = 6
+# How often (seconds) readers check whether the file was replaced
+RELOAD_CHECK = 1.0
+
+_DIGIT = {ord(c): value for value, c in enumerate(ALPHABET)}
+_ALPHABET_BYTES = ALPHABET.encode()
+_U32_PAIR = struct.Struct('<II')
+_U64 = struct.Struct('<Q')
+_U64_PAIR = struct.Struct('<QQ')
+
+
+def _bucket(key):
+    bucket = 0
+    for byte in key[:PREFIX]:
+        bucket = bucket * len(ALPHABET) + _DIGIT[byte]
+    return bucket
+
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def build(records, path, log=print):
+    """Write (cnpj, record) pairs, in ascending CNPJ order, to a new table swapped in atomically
+
+    A record may be a dict or its JSON text. Returns the number of records written.
+    """
+    tmp_path = path + '.building'
+    keys_path = tmp_path + '.keys'
+    offsets_path = tmp_path + '.offsets'
+    counts = array('I', bytes(4 * (FANOUT + 1)))
+    count = 0
+    position = 0
+    previous = b''
+    try:
+        with open(tmp_path, 'wb') as out, open(keys_path, 'wb') as keys, open(offsets_path, 'wb') as offsets:
+            out.write(bytes(HEADER_SIZE))
+            offsets.write(_U64.pack(0))
+            for cnpj, record in records:
+                key = cnpj.encode('ascii', 'replace')
+                if len(key) != KEY_SIZE or key <= previous or key.translate(None, _ALPHABET_BYTES):
+                    raise ValueError(f"CNPJs must be 14 characters A-Z/0-9, unique and ascending (got {cnpj!r})")
+                if not isinstance(record, str):
+                    record = json.dumps(record, separators=(',', ':'), ensure_ascii=False)
+                data = zlib.compress(record.encode(), COMPRESS_LEVEL)
+                out.write(data)
+                position += len(data)
+                keys.write(key)
+                offsets.write(_U64.pack(position))
+                counts[_bucket(key) + 1] += 1
+                previous = key
+                count += 1
+                if count % 1000000 == 0:
+                    log(f"{count} records")
+
+            # Prefix sums turn bucket sizes into bucket start indexes
+            for bucket in range(1, FANOUT + 1):
+                counts[bucket] += counts[bucket - 1]
+            blob_offset = HEADER_SIZE
+            fanout_offset = blob_offset + position
+            out.write(_little_endian(counts))
+            keys_offset = fanout_offset + len(counts) * 4
+            offsets_offset = keys_offset + count * KEY_SIZE
+            for part_path, part in ((keys_path, keys), (offsets_path, offsets)):
+                part.close()
+                with open(part_path, 'rb') as source:
+                    while True:
+                        chunk = source.read(1 << 20)
+                        if not chunk:
+                            break
+                        out.write(chunk)
+            out.seek(0)
+            out.write(HEADER.pack(MAGIC, count, time.time(), blob_offset, fanout_offset, keys_offset, offsets_offset))
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        for leftover in (tmp_path, keys_path, offsets_path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    log(f"{count} records -> {path}")
+    return count
+
+
+class _Mapped:
+    """One opened table file"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            identity = os.fstat(f.fileno())
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.identity = (identity.st_ino, identity.st_mtime_ns)
+        self.size = identity.st_size
+        magic, self.count, self.built_at, self.blob, self.fanout, self.keys, self.offsets = \
+            HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a CNPJ table")
+        if hasattr(self.map, 'madvise'):
+            # Point reads: don't pull neighbouring pages into the cache
+            self.map.madvise(mmap.MADV_RANDOM)
+
+    def find(self, key):
+        """Raw compressed record for key, or None"""
+        try:
+            bucket = _bucket(key)
+        except KeyError:
+            return None
+        lo, hi = _U32_PAIR.unpack_from(self.map, self.fanout + 4 * bucket)
+        mapped = self.map
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self.keys + mid * KEY_SIZE
+            if mapped[start:start + KEY_SIZE] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        start = self.keys + lo * KEY_SIZE
+        if lo >= self.count or mapped[start:start + KEY_SIZE] != key:
+            return None
+        begin, end = _U64_PAIR.unpack_from(mapped, self.offsets + 8 * lo)
+        return mapped[self.blob + begin:self.blob + end]
+
+
+class CnpjTable:
+    """Point lookups over a table file, following atomic replacements of it
+
+    A missing file just means no records until one is built.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._mapped = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "reloads": 0}
+        self._reload()
+
+    def _reload(self):
+        try:
+            identity = os.stat(self.path)
+        except OSError:
+            self._mapped = None
+            return
+        current = self._mapped
+        if current is not None and current.identity == (identity.st_ino, identity.st_mtime_ns):
+            return
+        try:
+            self._mapped = _Mapped(self.path)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"CNPJ table {self.path} not loaded: {e}")
+            return
+        if current is not None:
+            # The old map is closed once no reader holds it any more
+            self._stats["reloads"] += 1
+
+    def _current(self):
+        now = time.monotonic()
+        if now - self._checked >= RELOAD_CHECK:
+            with self._lock:
+                if now - self._checked >= RELOAD_CHECK:
+                    self._checked = now
+                    self._reload()
+        return self._mapped
+
+    def get(self, cnpj_clean):
+        """Stored record for a cleaned CNPJ, or None"""
+        mapped = self._current()
+        data = None
+        if mapped is not None and len(cnpj_clean) == KEY_SIZE:
+            data = mapped.find(cnpj_clean.encode('ascii', 'replace'))
+        self._stats["hits" if data is not None else "misses"] += 1
+        if data is None:
+            return None
+        return json.loads(zlib.decompress(data))
+
+    def __len__(self):
+        mapped = self._current()
+        return mapped.count if mapped is not None else 0
+
+    def stats(self):
+        mapped = self._current()
+        return dict(
+            self._stats,
+            path=self.path,
+            records=mapped.count if mapped is not None else 0,
+            built_at=mapped.built_at if mapped is not None else None,
+            bytes=mapped.size if mapped is not None else 0,
+        )
+
+
+def iter_cache_records(db_path):
+    """Merged records persisted by TieredCache, as stored (JSON text)"""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    yield from conn.execute("SELECT key, value FROM cache WHERE value IS NOT NULL ORDER BY key")
+    conn.close()
+
+
+def iter_receita_records(db_path, merge):
+    """Every establishment of a Receita Federal store, passed through merge(cnpj, record)"""
+    from receita_store import ReceitaStore
+
+    store = ReceitaStore(db_path)
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    for (cnpj,) in conn.execute("SELECT cnpj FROM estabelecimentos ORDER BY cnpj"):
+        record = store.get(cnpj)
+        if record is not None:
+            yield cnpj, merge(cnpj, record)
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the memory-mapped CNPJ lookup table")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--from-cache', metavar='CACHE_DB', help="merged records persisted by the app's cache")
+    source.add_argument('--from-receita', metavar='RECEITA_DB', help="a store built by receita_store.py")
+    parser.add_argument('table_path')
+    args = parser.parse_args()
+
+    if args.from_cache:
+        records = iter_cache_records(args.from_cache)
+    else:
+        import app
+
+        # Same record shape local_lookup serves for the Receita store
+        records = iter_receita_records(
+            args.from_receita, lambda cnpj, data: app.merge_cnpj_sources(cnpj, [("receita_federal", data)]))
+    build(records, args.table_path)
+
+
+if __name__ == '__main__':
+    main()
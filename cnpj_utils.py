@@ -0,0 +1,107 @@
+# CNPJ parsing, normalization and check-digit validation
+# Covers the numeric format and the alphanumeric one (12 base characters A-Z/0-9 + 2 numeric
+# check digits), where each character is worth its ASCII code minus 48.
+
+import re
+
+try:
+    import numpy as np
+except ImportError:  # optional, only speeds up validate_batch
+    np = None
+
+# 00.000.000/0000-00 as printed on pages, numeric or alphanumeric
+CNPJ_FORMATTED_RE = re.compile(r'\b[0-9A-Z]{2}\.[0-9A-Z]{3}\.[0-9A-Z]{3}/[0-9A-Z]{4}-\d{2}\b')
+# 14 bare characters, e.g. in URLs or API payloads
+CNPJ_BARE_RE = re.compile(r'\b[0-9A-Z]{12}\d{2}\b')
+CNPJ_RE = re.compile(r'^[0-9A-Z]{12}\d{2}$')
+
+_NON_ALNUM_RE = re.compile(r'[^0-9A-Za-z]+')
+_NON_DIGIT_RE = re.compile(r'\D+')
+# Punctuation found in formatted CNPJs, deleted with one str.translate call
+_PUNCTUATION = str.maketrans('', '', './- ')
+
+_WEIGHTS_1 = (5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2)
+_WEIGHTS_2 = (6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2)
+
+
+def clean(value):
+    """Strip everything but letters and digits and uppercase, e.g. 12.ABC.345/01DE-35 -> 12ABC34501DE35
+
+    When that doesn't leave 14 characters the letters are dropped too, so labelled input such as
+    "CNPJ 11.222.333/0001-81" still cleans to its digits.
+    """
+    alphanumeric = _NON_ALNUM_RE.sub('', value or '').upper()
+    if len(alphanumeric) == 14:
+        return alphanumeric
+    return _NON_DIGIT_RE.sub('', value or '')
+
+
+def strip_punctuation(formatted):
+    """Fast path for strings known to be formatted CNPJs"""
+    return formatted.translate(_PUNCTUATION)
+
+
+def format_cnpj(cnpj):
+    return f"{cnpj[:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:]}"
+
+
+def _check_digit(values, weights):
+    remainder = sum(v * w for v, w in zip(values, weights)) % 11
+    return 0 if remainder < 2 else 11 - remainder
+
+
+def check_digits(base):
+    """The two check digits for a 12-character CNPJ base"""
+    values = [ord(c) - 48 for c in base]
+    first = _check_digit(values, _WEIGHTS_1)
+    second = _check_digit(values + [first], _WEIGHTS_2)
+    return f"{first}{second}"
+
+
+def is_valid(cnpj):
+    """Check digits of a cleaned 14-character CNPJ"""
+    if not CNPJ_RE.match(cnpj or ''):
+        return False
+    if cnpj == cnpj[0] * 14:
+        return False
+    values = [ord(c) - 48 for c in cnpj]
+    first = _check_digit(values[:12], _WEIGHTS_1)
+    if first != values[12]:
+        return False
+    return _check_digit(values[:13], _WEIGHTS_2) == values[13]
+
+
+def find_cnpjs(text):
+    """Valid formatted CNPJs in page text, cleaned, in order of appearance"""
+    found = (strip_punctuation(match) for match in CNPJ_FORMATTED_RE.findall(text))
+    return [cnpj for cnpj in found if is_valid(cnpj)]
+
+
+def validate_batch(cnpjs):
+    """Validity of many cleaned CNPJs at once, as a list of bools
+
+    Vectorized over an (n, 14) array of character values when NumPy is available.
+    """
+    cnpjs = list(cnpjs)
+    if np is None or not cnpjs:
+        return [is_valid(cnpj) for cnpj in cnpjs]
+
+    shaped = np.array([CNPJ_RE.match(c) is not None for c in cnpjs])
+    padded = [c if ok else '0' * 14 for c, ok in zip(cnpjs, shaped)]
+    values = np.frombuffer(''.join(padded).encode('ascii'), dtype=np.uint8)
+    values = values.reshape(len(padded), 14).astype(np.int64) - 48
+
+    first = values[:, :12] @ np.array(_WEIGHTS_1) % 11
+    first = np.where(first < 2, 0, 11 - first)
+    second = values[:, :13] @ np.array(_WEIGHTS_2) % 11
+    second = np.where(second < 2, 0, 11 - second)
+    repeated = (values == values[:, :1]).all(axis=1)
+
+    valid = shaped & ~repeated & (first == values[:, 12]) & (second == values[:, 13])
+    return valid.tolist()
+
+
+def filter_valid(cnpjs):
+    """The valid entries of an iterable of cleaned CNPJs"""
+    cnpjs = list(cnpjs)
+    return [cnpj for cnpj, ok in zip(cnpjs, validate_batch(cnpjs)) if ok]
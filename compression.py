@@ -0,0 +1,77 @@
+# Response compression: content negotiation plus precompressed static pages
+# gzip always, brotli when the optional brotli package is installed.
+
+import gzip
+import hashlib
+import os
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is used instead
+    brotli = None
+
+# JSON bodies smaller than this (bytes) aren't worth compressing
+MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+# On-the-fly levels favour speed; precompressed pages use the maximum
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def compress(body, encoding, best=False):
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if best else BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=9 if best else GZIP_LEVEL, mtime=0)
+
+
+def choose_encoding(accept_encoding, available=ENCODINGS):
+    """Best of the available encodings the client accepts, or None for identity"""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    for encoding in available:
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+
+class StaticPage:
+    """A page rendered once, with its ETag and every compressed variant computed up front"""
+
+    def __init__(self, body, content_type='text/html; charset=utf-8', cache_control='public, max-age=300'):
+        self.body = body.encode() if isinstance(body, str) else body
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest()[:20] + '"'
+        self.variants = {encoding: compress(self.body, encoding, best=True) for encoding in ENCODINGS}
+
+    def not_modified(self, if_none_match):
+        tags = [tag.strip() for tag in (if_none_match or '').split(',')]
+        return '*' in tags or self.etag in tags or 'W/' + self.etag in tags
+
+    def select(self, accept_encoding, if_none_match=None):
+        """(status, body, headers) for a request with these header values"""
+        headers = {
+            'Content-Type': self.content_type,
+            'ETag': self.etag,
+            'Cache-Control': self.cache_control,
+            'Vary': 'Accept-Encoding',
+        }
+        if self.not_modified(if_none_match):
+            del headers['Content-Type']
+            return 304, b'', headers
+        encoding = choose_encoding(accept_encoding)
+        if encoding is None:
+            return 200, self.body, headers
+        headers['Content-Encoding'] = encoding
+        return 200, self.variants[encoding], headers
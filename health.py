@@ -0,0 +1,231 @@
+# Provider health: per-provider token-bucket rate limits, circuit breakers and latency tracking
+# Lets callers skip a throttled or failing provider instantly instead of waiting out its timeout.
+# With a shared_path, rate limits are drawn from one mmap'd file by every worker process on the host.
+
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; rate limits are then per process
+    fcntl = None
+
+FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURES', 5))
+RESET_TIMEOUT = float(os.environ.get('BREAKER_RESET', 30))
+# Weight of the newest sample in the latency moving average
+EWMA_ALPHA = 0.2
+
+
+class ProviderUnavailable(Exception):
+    """Raised instead of calling a provider whose breaker is open or whose rate limit is spent"""
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def try_acquire(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class SharedBuckets:
+    """Token buckets stored in an mmap'd file, one (tokens, updated) slot per provider
+
+    Every process mapping the same file draws from the same quota; updates are serialized
+    with flock. Slots are assigned by sorted provider name, so all workers must agree on
+    the provider list (they do when they run the same code).
+    """
+
+    SLOT = struct.Struct('dd')
+
+    def __init__(self, path, providers):
+        self.path = path
+        self.slots = {provider: index for index, provider in enumerate(sorted(providers))}
+        self._pid = None
+        self._fd = None
+        self._map = None
+
+    def _mapped(self):
+        # flock is held per open file description, so each process opens the file itself
+        if self._pid != os.getpid():
+            size = max(1, len(self.slots)) * self.SLOT.size
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._fd, self._map, self._pid = fd, mmap.mmap(fd, size), os.getpid()
+        return self._map
+
+    def _update(self, provider, rate, capacity, take):
+        mapped = self._mapped()
+        offset = self.slots[provider] * self.SLOT.size
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            tokens, updated = self.SLOT.unpack_from(mapped, offset)
+            now = time.time()
+            # A zeroed slot is a bucket nobody has used yet
+            tokens = capacity if not updated else min(capacity, tokens + max(0.0, now - updated) * rate)
+            acquired = take and tokens >= 1
+            if acquired:
+                tokens -= 1
+            self.SLOT.pack_into(mapped, offset, tokens, now)
+            return acquired, tokens
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def try_acquire(self, provider, rate, capacity):
+        return self._update(provider, rate, capacity, take=True)[0]
+
+    def tokens(self, provider, rate, capacity):
+        return self._update(provider, rate, capacity, take=False)[1]
+
+
+class SharedTokenBucket:
+    """TokenBucket interface over one provider's slot in a SharedBuckets file"""
+
+    def __init__(self, shared, provider, rate, burst):
+        self.shared = shared
+        self.provider = provider
+        self.rate = rate
+        self.capacity = burst
+
+    @property
+    def tokens(self):
+        return self.shared.tokens(self.provider, self.rate, self.capacity)
+
+    def try_acquire(self):
+        return self.shared.try_acquire(self.provider, self.rate, self.capacity)
+
+
+class ProviderState:
+    """Breaker state, rate limit and latency stats of one provider"""
+
+    def __init__(self, rate=None, burst=None, bucket_factory=TokenBucket):
+        self.bucket = bucket_factory(rate, burst or max(1, rate)) if rate else None
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.latency_ewma = None
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.last_error = None
+
+
+class ProviderHealth:
+    """Breakers and latency are tracked per process; rate limits too unless shared_path is set"""
+
+    def __init__(self, limits=None, shared_path=None):
+        self._limits = limits or {}
+        self._states = {}
+        self._lock = threading.Lock()
+        self._shared = SharedBuckets(shared_path, self._limits) if shared_path and fcntl is not None else None
+
+    def _state(self, provider):
+        state = self._states.get(provider)
+        if state is None:
+            limit = self._limits.get(provider, {})
+            factory = TokenBucket
+            if self._shared is not None and provider in self._shared.slots:
+                factory = lambda rate, burst: SharedTokenBucket(self._shared, provider, rate, burst)
+            state = self._states[provider] = ProviderState(limit.get("rate"), limit.get("burst"), factory)
+        return state
+
+    def allow(self, provider):
+        """Whether a call may go out now; half-open breakers let a single probe through"""
+        with self._lock:
+            state = self._state(provider)
+            if state.state == "open":
+                if time.monotonic() - state.opened_at < RESET_TIMEOUT:
+                    state.rejected += 1
+                    return False
+                state.state = "half_open"
+                state.probing = False
+            if state.state == "half_open":
+                if state.probing:
+                    state.rejected += 1
+                    return False
+                state.probing = True
+            if state.bucket is not None and not state.bucket.try_acquire():
+                if state.state == "half_open":
+                    state.probing = False
+                state.rejected += 1
+                return False
+            return True
+
+    def acquire(self, provider):
+        """Rate-limit token for a retry of a call allow() already let through"""
+        with self._lock:
+            state = self._state(provider)
+            if state.bucket is not None and not state.bucket.try_acquire():
+                state.rejected += 1
+                return False
+            return True
+
+    def rate_limited(self, provider):
+        return bool(self._limits.get(provider, {}).get("rate"))
+
+    def _observe(self, state, latency):
+        if state.latency_ewma is None:
+            state.latency_ewma = latency
+        else:
+            state.latency_ewma += EWMA_ALPHA * (latency - state.latency_ewma)
+
+    def record_success(self, provider, latency):
+        with self._lock:
+            state = self._state(provider)
+            self._observe(state, latency)
+            state.successes += 1
+            state.consecutive_failures = 0
+            state.state = "closed"
+            state.probing = False
+
+    def record_failure(self, provider, latency, error):
+        with self._lock:
+            state = self._state(provider)
+            self._observe(state, latency)
+            state.failures += 1
+            state.consecutive_failures += 1
+            state.last_error = str(error)[:200]
+            state.probing = False
+            if state.state == "half_open" or state.consecutive_failures >= FAILURE_THRESHOLD:
+                state.state = "open"
+                state.opened_at = time.monotonic()
+
+    def order(self, providers, key=lambda provider: provider):
+        """Healthy providers first, fastest first; unmeasured ones keep their relative order"""
+        with self._lock:
+            def rank(item):
+                state = self._states.get(key(item))
+                if state is None:
+                    return (0, 0.0)
+                return (state.state == "open", state.latency_ewma or 0.0)
+            return sorted(providers, key=rank)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                provider: {
+                    "state": state.state,
+                    "latency_ms": round(state.latency_ewma * 1000, 1) if state.latency_ewma is not None else None,
+                    "successes": state.successes,
+                    "failures": state.failures,
+                    "consecutive_failures": state.consecutive_failures,
+                    "rejected": state.rejected,
+                    "tokens": round(state.bucket.tokens, 2) if state.bucket else None,
+                    "last_error": state.last_error,
+                }
+                for provider, state in self._states.items()
+            }
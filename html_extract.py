@@ -0,0 +1,180 @@
+# Single-pass candidate extraction for scraped search-result pages
+# Collects h3 titles, class-matched nodes, query-matching nodes and valid CNPJs in one walk,
+# with a pluggable backend: "stream" (stdlib, the default, stops reading early) or "lxml"
+# (HTML_PARSER=lxml, if installed; it parses the whole page before the walk starts).
+# Both skip script/style text and only join a node's text once it is known to be short enough.
+
+import os
+from html.parser import HTMLParser
+
+try:
+    import lxml.etree
+    import lxml.html
+except ImportError:  # optional backend
+    lxml = None
+
+import cnpj_utils
+
+# Tags whose text can hold a result title, and tags searched for class-matched results
+CONTAINS_TAGS = frozenset(['div', 'span', 'a', 'h3'])
+CLASS_TAGS = frozenset(['div', 'li', 'h3', 'a'])
+VOID_TAGS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+                       'meta', 'param', 'source', 'track', 'wbr'])
+SKIP_TEXT_TAGS = frozenset(['script', 'style'])
+# A new <li> ends an unclosed one in the same list, as browsers and lxml do
+LIST_TAGS = frozenset(['ul', 'ol'])
+
+# Candidates longer than this are never results; skip joining their (large) subtree text
+MAX_CANDIDATE_CHARS = 2000
+CHUNK_SIZE = 65536
+
+BACKEND = os.environ.get('HTML_PARSER', 'stream')
+
+
+class PageExtract:
+    """Candidates found on one page, each list in document order"""
+
+    def __init__(self, query, classes):
+        self.query = query.lower()
+        self.classes = frozenset(classes)
+        self.h3 = []
+        self.by_class = {name: [] for name in self.classes}
+        self.containing = []
+        self.cnpjs = []
+
+    def add(self, position, tag, classes, text):
+        if tag == 'h3':
+            self.h3.append((position, text))
+        if tag in CLASS_TAGS:
+            for name in self.classes.intersection(classes):
+                self.by_class[name].append((position, text))
+        if tag in CONTAINS_TAGS and self.query in text.lower():
+            self.containing.append((position, tag, text))
+
+    def finish(self):
+        # Elements complete at their end tag; sort back to start-tag order, like find_all
+        self.h3 = [text for _, text in sorted(self.h3)]
+        self.by_class = {name: [text for _, text in sorted(items)] for name, items in self.by_class.items()}
+        self.containing = [(tag, text) for _, tag, text in sorted(self.containing)]
+        return self
+
+
+class _StreamParser(HTMLParser):
+    def __init__(self, page):
+        super().__init__(convert_charrefs=True)
+        self.page = page
+        self.stack = []
+        self.chunks = []
+        self.length = 0
+        self.skip = 0
+        self.position = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            return
+        if tag == 'li':
+            for depth in range(len(self.stack) - 1, -1, -1):
+                if self.stack[depth][0] in LIST_TAGS:
+                    break
+                if self.stack[depth][0] == 'li':
+                    while len(self.stack) > depth:
+                        self._close(self.stack.pop())
+                    break
+        if tag in SKIP_TEXT_TAGS:
+            self.skip += 1
+        classes = ()
+        for name, value in attrs:
+            if name == 'class' and value:
+                classes = value.split()
+        self.position += 1
+        self.stack.append((tag, classes, len(self.chunks), self.length, self.position))
+
+    def handle_startendtag(self, tag, attrs):
+        pass
+
+    def handle_endtag(self, tag):
+        if not any(entry[0] == tag for entry in self.stack):
+            return
+        # Close unclosed children (<p>, <li>...) along with the matching element
+        while self.stack:
+            entry = self.stack.pop()
+            self._close(entry)
+            if entry[0] == tag:
+                break
+
+    def _close(self, entry):
+        tag, classes, first_chunk, start_length, position = entry
+        if tag in SKIP_TEXT_TAGS:
+            self.skip -= 1
+            return
+        if tag not in CONTAINS_TAGS and tag not in CLASS_TAGS:
+            return
+        if self.length - start_length > MAX_CANDIDATE_CHARS:
+            return
+        text = ''.join(self.chunks[first_chunk:]).strip()
+        self.page.add(position, tag, classes, text)
+
+    def handle_data(self, data):
+        if self.skip:
+            return
+        self.chunks.append(data)
+        self.length += len(data)
+
+    def close(self):
+        super().close()
+        while self.stack:
+            self._close(self.stack.pop())
+
+
+def _extract_stream(html, page, enough):
+    parser = _StreamParser(page)
+    for start in range(0, len(html), CHUNK_SIZE):
+        parser.feed(html[start:start + CHUNK_SIZE])
+        if enough is not None and enough(page):
+            return
+    parser.close()
+
+
+def _extract_lxml(html, page, enough):
+    # Same bookkeeping as _StreamParser, over the parsed tree: text chunks in document order,
+    # each open element remembering where its text starts
+    chunks = []
+    length = 0
+    skip = 0
+    stack = []
+    for position, (event, element) in enumerate(lxml.etree.iterwalk(lxml.html.fromstring(html),
+                                                                    events=('start', 'end'))):
+        tag = element.tag
+        if event == 'start':
+            if not isinstance(tag, str):
+                continue
+            if tag in SKIP_TEXT_TAGS:
+                skip += 1
+            stack.append((len(chunks), length, position))
+            if element.text and not skip:
+                chunks.append(element.text)
+                length += len(element.text)
+            continue
+        if isinstance(tag, str):
+            first_chunk, start_length, start = stack.pop()
+            if tag in SKIP_TEXT_TAGS:
+                skip -= 1
+            elif (tag in CONTAINS_TAGS or tag in CLASS_TAGS) and length - start_length <= MAX_CANDIDATE_CHARS:
+                page.add(start, tag, (element.get('class') or '').split(), ''.join(chunks[first_chunk:]).strip())
+                if enough is not None and tag == 'h3' and enough(page):
+                    return
+        # Comments contribute no text of their own, only their tail
+        if element.tail and not skip:
+            chunks.append(element.tail)
+            length += len(element.tail)
+
+
+def extract(html, query, classes=(), enough=None, backend=None):
+    """Parse a result page once; enough(page) may end the walk early"""
+    page = PageExtract(query, classes)
+    page.cnpjs = cnpj_utils.find_cnpjs(html)
+    if (backend or BACKEND) == 'lxml' and lxml is not None:
+        _extract_lxml(html, page, enough)
+    else:
+        _extract_stream(html, page, enough)
+    return page.finish()
@@ -0,0 +1,366 @@
+# Background jobs for large CNPJ enrichment batches
+# Submitted lists are stored in SQLite and worked through in chunks off the request path;
+# every chunk is checkpointed, so after a restart a job resumes with its first unfinished row.
+
+import csv
+import io
+import itertools
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional, only needed for Parquet downloads
+    pa = None
+
+# A running job whose lease is this old (seconds) is considered abandoned and picked up again
+LEASE_SECONDS = float(os.environ.get('JOB_LEASE', 300))
+POLL_SECONDS = 5
+# Pause (seconds) before retrying a chunk whose checkpoint found the database locked
+BUSY_RETRY_SECONDS = 1
+INSERT_BATCH = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY, status TEXT, total INTEGER, done INTEGER, errors INTEGER,
+    created_at REAL, updated_at REAL, owner TEXT, lease_until REAL
+);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT, idx INTEGER, input TEXT, done INTEGER DEFAULT 0, result TEXT,
+    PRIMARY KEY (job_id, idx)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS job_items_pending ON job_items (job_id, done, idx);
+"""
+
+# Flat columns for CSV and Parquet downloads; lists (qsa, sources) are JSON-encoded
+RESULT_COLUMNS = [
+    "index", "input", "error", "cnpj", "razao_social", "nome_fantasia", "situacao_cadastral",
+    "descricao_situacao_cadastral", "data_inicio_atividade", "cnae_fiscal", "cnae_fiscal_descricao",
+    "natureza_juridica", "porte", "capital_social", "logradouro", "numero", "complemento", "bairro",
+    "municipio", "uf", "cep", "email", "ddd_telefone_1", "ddd_telefone_2", "qsa", "sources",
+]
+
+
+def flat_row(line):
+    row = {}
+    for column in RESULT_COLUMNS:
+        value = line.get(column)
+        if isinstance(value, (list, dict)):
+            value = json.dumps(value, ensure_ascii=False)
+        row[column] = "" if value is None else str(value)
+    return row
+
+
+def _batches(values, size):
+    values = iter(values)
+    while True:
+        batch = list(itertools.islice(values, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _busy(error):
+    """True for SQLite's lock contention errors, which are worth retrying"""
+    message = str(error)
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in message or "busy" in message)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """Job store plus the runner thread that works through submitted lists
+
+    lookup(index, raw) must return the result line for one input, as the batch endpoint does.
+    """
+
+    def __init__(self, db_path, lookup, concurrency=4, chunk_size=None):
+        self.db_path = db_path
+        self.lookup = lookup
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size or concurrency * 8
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        # Never reuse a connection inherited through fork
+        if conn is None or self._local.pid != os.getpid():
+            # The database is only created on first use, so importing the app leaves no files behind
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def start(self):
+        """Start the runner if it isn't running; unfinished jobs from a previous run are resumed"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self.owner = f"{socket.gethostname()}:{os.getpid()}"
+                self._requeue_orphans()
+                self._thread = threading.Thread(target=self._run, name="job-runner", daemon=True)
+                self._thread.start()
+
+    def _requeue_orphans(self):
+        """Requeue jobs left running by a dead process on this host, without waiting out the lease
+
+        Uploads that a dead process was still storing are dropped.
+        """
+        host = socket.gethostname()
+        rows = self._db().execute(
+            "SELECT id, status, owner FROM jobs WHERE status IN ('running', 'submitting')").fetchall()
+        for job_id, status, owner in rows:
+            owner_host, _, pid = (owner or '').rpartition(':')
+            if owner_host != host or not pid.isdigit() or _alive(int(pid)):
+                continue
+            if status == 'submitting':
+                self._discard(job_id)
+            else:
+                self._db().execute(
+                    "UPDATE jobs SET status = 'queued', owner = NULL WHERE id = ? AND owner = ?", (job_id, owner))
+
+    def _discard(self, job_id):
+        conn = self._db()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM job_items WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def submit(self, inputs):
+        """Store a list of raw CNPJ values as a new queued job; returns its status, or None if empty
+
+        The upload is read outside any transaction and stored in short per-batch ones under a
+        'submitting' job, so a slow client never holds the write lock other workers need.
+        """
+        inputs = iter(inputs)
+        first = next(inputs, None)
+        if first is None:
+            return None
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._db()
+        conn.execute(
+            "INSERT INTO jobs (id, status, total, done, errors, created_at, updated_at, owner) "
+            "VALUES (?, 'submitting', 0, 0, 0, ?, ?, ?)", (job_id, now, now, self.owner))
+        total = 0
+        try:
+            for batch in _batches(itertools.chain([first], inputs), INSERT_BATCH):
+                rows = [(job_id, total + offset, raw.strip()) for offset, raw in enumerate(batch)]
+                total += len(rows)
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.executemany("INSERT INTO job_items (job_id, idx, input) VALUES (?, ?, ?)", rows)
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', total = ?, owner = NULL, updated_at = ? WHERE id = ?",
+                (total, time.time(), job_id))
+        except BaseException:
+            try:
+                self._discard(job_id)
+            except sqlite3.Error as e:
+                # Left 'submitting'; a later start() on this host clears it
+                print(f"Job {job_id} cleanup error: {e}")
+            raise
+        self.start()
+        self._wake.set()
+        return self.status(job_id)
+
+    def status(self, job_id):
+        row = self._db().execute(
+            "SELECT id, status, total, done, errors, created_at, updated_at FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job_id, status, total, done, errors, created_at, updated_at = row
+        return {
+            "job_id": job_id,
+            "status": status,
+            "total": total,
+            "done": done,
+            "errors": errors,
+            "progress": round(done / total, 4) if total else 1.0,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    def cancel(self, job_id):
+        self._db().execute(
+            "UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE id = ? AND status IN ('queued', 'running')",
+            (time.time(), job_id))
+        return self.status(job_id)
+
+    def _claim(self):
+        """Atomically take the oldest queued job, or a running one whose lease ran out"""
+        conn = self._db()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) "
+                "ORDER BY created_at LIMIT 1", (now,)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', owner = ?, lease_until = ?, updated_at = ? WHERE id = ?",
+                    (self.owner, now + LEASE_SECONDS, now, row[0]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row[0] if row else None
+
+    def _run(self):
+        retry = None
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="job") as pool:
+            while True:
+                job_id, retry = retry, None
+                if job_id is None:
+                    try:
+                        job_id = self._claim()
+                    except sqlite3.Error as e:
+                        print(f"Job claim error: {e}")
+                if job_id is None:
+                    self._wake.wait(timeout=POLL_SECONDS)
+                    self._wake.clear()
+                    continue
+                try:
+                    self._process(job_id, pool)
+                except Exception as e:
+                    if _busy(e):
+                        # Still ours: redo the chunk once the database frees up
+                        print(f"Job {job_id} checkpoint deferred: {e}")
+                        retry = job_id
+                        time.sleep(BUSY_RETRY_SECONDS)
+                        continue
+                    print(f"Job {job_id} error: {e}")
+                    self._fail(job_id)
+
+    def _fail(self, job_id):
+        try:
+            self._db().execute(
+                "UPDATE jobs SET status = 'failed', updated_at = ? WHERE id = ? AND owner = ?",
+                (time.time(), job_id, self.owner))
+        except sqlite3.Error as e:
+            # The lease runs out and another runner (or this one) picks the job up again
+            print(f"Job {job_id} could not be marked failed: {e}")
+
+    def _lookup(self, item):
+        index, raw = item
+        try:
+            return self.lookup(index, raw)
+        except Exception as e:
+            return {"index": index, "input": raw, "error": f"Erro na consulta: {e}"}
+
+    def _process(self, job_id, pool):
+        conn = self._db()
+        while True:
+            state = conn.execute("SELECT status, owner FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if state is None or state != ("running", self.owner):
+                return
+            items = conn.execute(
+                "SELECT idx, input FROM job_items WHERE job_id = ? AND done = 0 ORDER BY idx LIMIT ?",
+                (job_id, self.chunk_size)
+            ).fetchall()
+            if not items:
+                conn.execute(
+                    "UPDATE jobs SET status = 'done', updated_at = ? WHERE id = ? AND owner = ?",
+                    (time.time(), job_id, self.owner))
+                return
+
+            lines = list(pool.map(self._lookup, items))
+            errors = sum(1 for line in lines if "error" in line)
+            now = time.time()
+            # Checkpoint: results, counters and lease are committed together, and only while this
+            # runner still owns the job; once its lease has been taken over the chunk is discarded
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                owned = conn.execute(
+                    "UPDATE jobs SET done = done + ?, errors = errors + ?, lease_until = ?, updated_at = ? "
+                    "WHERE id = ? AND owner = ?",
+                    (len(lines), errors, now + LEASE_SECONDS, now, job_id, self.owner)).rowcount
+                if not owned:
+                    conn.execute("ROLLBACK")
+                    return
+                conn.executemany(
+                    "UPDATE job_items SET done = 1, result = ? WHERE job_id = ? AND idx = ?",
+                    [(json.dumps(line, ensure_ascii=False), job_id, line["index"]) for line in lines])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def iter_results(self, job_id):
+        """Finished result lines in input order, read in pages"""
+        conn = self._db()
+        last = -1
+        while True:
+            rows = conn.execute(
+                "SELECT idx, result FROM job_items WHERE job_id = ? AND done = 1 AND idx > ? ORDER BY idx LIMIT ?",
+                (job_id, last, INSERT_BATCH)
+            ).fetchall()
+            if not rows:
+                return
+            for idx, result in rows:
+                yield json.loads(result)
+            last = rows[-1][0]
+
+    def iter_jsonl(self, job_id):
+        for line in self.iter_results(job_id):
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+
+    def iter_csv(self, job_id):
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
+        for count, line in enumerate(self.iter_results(job_id), 1):
+            writer.writerow(flat_row(line))
+            if count % 1000 == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    def parquet(self, job_id):
+        """Results as Parquet bytes; requires pyarrow"""
+        if pa is None:
+            raise RuntimeError("pyarrow is not installed")
+        columns = {column: [] for column in RESULT_COLUMNS}
+        for line in self.iter_results(job_id):
+            for column, value in flat_row(line).items():
+                columns[column].append(value)
+        buffer = io.BytesIO()
+        pq.write_table(pa.table(columns), buffer, compression='zstd')
+        return buffer.getvalue()
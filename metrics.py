@@ -0,0 +1,215 @@
+# Prometheus metrics and per-request tracing for upstream provider calls
+# Counters and histograms are rendered in the Prometheus text format by hand, so no client
+# library is needed. Each request also gets a Trace that sums the time spent per provider,
+# reported back to the caller in a Server-Timing header.
+
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Set SERVER_TIMING=0 to leave the Server-Timing header off responses
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '1') != '0'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20)
+PARSE_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0, 0.0]
+            counts = entry[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            entry[1] += 1
+            entry[2] += value
+
+    def render(self):
+        with self._lock:
+            values = sorted((labels, (list(counts), count, total)) for labels, (counts, count, total) in self._values.items())
+        for labels, (counts, count, total) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_format_labels(self.labels, labels, [('le', bound)])} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(self.labels, labels, [('le', '+Inf')])} {count}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {total!r}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {count}"
+
+
+UPSTREAM_SECONDS = Histogram(
+    'cnpj_finder_upstream_request_seconds', 'Upstream call latency, retries included', ('provider',))
+UPSTREAM_RESPONSES = Counter(
+    'cnpj_finder_upstream_responses_total',
+    'Upstream calls by outcome: HTTP status code, timeout, connection_error, error or rejected',
+    ('provider', 'status'))
+UPSTREAM_BYTES = Counter(
+    'cnpj_finder_upstream_response_bytes_total', 'Response body bytes received from each provider', ('provider',))
+PARSE_SECONDS = Histogram(
+    'cnpj_finder_upstream_parse_seconds', 'Time spent decoding and extracting provider responses', ('provider',),
+    PARSE_BUCKETS)
+RESULTS = Counter(
+    'cnpj_finder_upstream_results_total', 'Records and search hits each source contributed to responses',
+    ('provider',))
+HTTP_SECONDS = Histogram(
+    'cnpj_finder_http_request_seconds', 'Time to produce a response, per route', ('route',))
+HTTP_RESPONSES = Counter(
+    'cnpj_finder_http_responses_total', 'Responses per route and status code', ('route', 'status'))
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class Trace:
+    """Time spent per provider (and parsing) while serving one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            span = self.spans.setdefault(name, [0, 0.0])
+            span[0] += 1
+            span[1] += seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        with self._lock:
+            spans = sorted(self.spans.items())
+        entries = []
+        for name, (count, seconds) in spans:
+            entry = f"{name};dur={seconds * 1000:.1f}"
+            if count > 1:
+                entry += f';desc="{count} calls"'
+            entries.append(entry)
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ', '.join(entries)
+
+    def as_dict(self):
+        with self._lock:
+            spans = {name: {"calls": count, "ms": round(seconds * 1000, 1)} for name, (count, seconds) in self.spans.items()}
+        return {"total_ms": round(self.elapsed() * 1000, 1), "spans": spans}
+
+
+_trace = contextvars.ContextVar('trace', default=None)
+
+
+def start_trace():
+    trace = Trace()
+    _trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _trace.get()
+
+
+def bind(fn):
+    """Carry the current request's trace into a pool thread"""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+def record_call(provider, seconds, status, size=0):
+    UPSTREAM_SECONDS.observe(seconds, provider)
+    UPSTREAM_RESPONSES.inc(provider, str(status))
+    if size:
+        UPSTREAM_BYTES.inc(provider, amount=size)
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(provider, seconds)
+
+
+def record_rejected(provider):
+    UPSTREAM_RESPONSES.inc(provider, "rejected")
+
+
+def record_results(provider, count):
+    if count:
+        RESULTS.inc(provider, amount=count)
+
+
+@contextmanager
+def parse_timer(provider):
+    """Time a decode/extract step into the provider's parse histogram and the request trace"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        PARSE_SECONDS.observe(seconds, provider)
+        trace = _trace.get()
+        if trace is not None:
+            trace.add("parse", seconds)
+
+
+def observe_request(route, status, seconds):
+    HTTP_SECONDS.observe(seconds, route)
+    HTTP_RESPONSES.inc(route, str(status))
@@ -0,0 +1,194 @@
+# Local stand-in for every upstream provider, for offline benchmarks
+# Serves canned BrasilAPI / Minha Receita / ReceitaWS JSON and Google / Yahoo / Bing HTML
+# with configurable latency and error rate, and counts the time spent per provider.
+#
+# Run:  python mock_upstream.py --port 8001 --latency 0.15 --latency google=0.6 --error-rate 0.02
+# then point the app at it with BRASILAPI_URL=http://127.0.0.1:8001/brasilapi (and so on).
+
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import cnpj_utils
+
+PROVIDERS = ["brasilapi", "minha_receita", "receitaws", "google", "yahoo", "bing"]
+
+
+def provider_env(base_url):
+    """Environment pointing app.py at a mock listening on base_url"""
+    return {f"{provider.upper()}_URL": f"{base_url}/{provider}" for provider in PROVIDERS}
+
+
+def stable_seed(*parts):
+    """Deterministic across runs, unlike hash() on strings"""
+    return zlib.crc32(repr(parts).encode())
+
+
+def fake_cnpj(seed):
+    base = f"{seed % 10 ** 12:012d}"
+    return base + cnpj_utils.check_digits(base)
+
+
+def brasilapi_record(cnpj):
+    seed = int(cnpj[:8]) if cnpj[:8].isdigit() else 0
+    return {
+        "cnpj": cnpj,
+        "razao_social": f"EMPRESA TESTE {cnpj[:8]} LTDA",
+        "nome_fantasia": f"TESTE {cnpj[:8]}",
+        "cnae_fiscal": 4751201,
+        "cnae_fiscal_descricao": "Comércio varejista especializado de equipamentos e suprimentos de informática",
+        "logradouro": "RUA DAS FLORES",
+        "numero": str(seed % 1000),
+        "bairro": "CENTRO",
+        "municipio": "SAO PAULO",
+        "uf": "SP",
+        "cep": "01001000",
+        "qsa": [
+            {"nome_socio": "FULANO DE TAL", "qualificacao_socio": "Sócio-Administrador"},
+            {"nome_socio": "BELTRANA DA SILVA", "qualificacao_socio": "Sócio"},
+        ],
+    }
+
+
+def minha_receita_record(cnpj):
+    record = brasilapi_record(cnpj)
+    record.update({"email": "contato@example.com", "ddd_telefone_1": "1155554444", "nome_fantasia": ""})
+    return record
+
+
+def search_html(engine, query, count=8):
+    items = []
+    for i in range(count):
+        cnpj = fake_cnpj(stable_seed(engine, query, i))
+        items.append(
+            f'<div class="algo"><h3><a href="https://example.com/{i}">{query.title()} Empresa {i} Ltda</a></h3>'
+            f'<span>{query} - CNPJ {cnpj_utils.format_cnpj(cnpj)} - Endereço e telefone</span></div>'
+        )
+    filler = '<div class="noise"><span>lorem ipsum dolor sit amet</span></div>' * 200
+    return (f'<html><head><title>{query} - Pesquisa</title><script>var x = 1;</script></head>'
+            f'<body><div id="main">{"".join(items)}{filler}</div></body></html>')
+
+
+class MockState:
+    def __init__(self, latency, error_rate, search_hit_rate):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.search_hit_rate = search_hit_rate
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {provider: {"requests": 0, "errors": 0, "seconds": 0.0} for provider in PROVIDERS}
+
+    def record(self, provider, seconds, error):
+        with self.lock:
+            stats = self.stats[provider]
+            stats["requests"] += 1
+            stats["errors"] += int(error)
+            stats["seconds"] += seconds
+
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps(self.stats))
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Responses go out as header and body writes; without TCP_NODELAY, Nagle plus the client's
+        # delayed ACK holds every keep-alive response back by ~40 ms
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def send(self, status, body, content_type):
+            body = body.encode() if isinstance(body, str) else body
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            started = time.monotonic()
+            parts = urlsplit(self.path)
+            segments = parts.path.strip('/').split('/')
+            provider = segments[0]
+            if provider == '_stats':
+                return self.send(200, json.dumps(state.snapshot()), 'application/json')
+            if provider == '_reset':
+                state.reset()
+                return self.send(200, '{}', 'application/json')
+            if provider not in PROVIDERS:
+                return self.send(404, '{}', 'application/json')
+
+            mean = state.latency.get(provider, state.latency.get('*', 0.1))
+            time.sleep(max(0.0, random.gauss(mean, mean * 0.2)))
+            error = random.random() < state.error_rate
+            if error:
+                self.send(random.choice([429, 500, 503]), '{"message": "mock error"}', 'application/json')
+            else:
+                self.respond(provider, segments[1:], parse_qs(parts.query))
+            state.record(provider, time.monotonic() - started, error)
+
+        def respond(self, provider, segments, params):
+            query = (params.get('q') or params.get('p') or [''])[0]
+            hit = random.random() < state.search_hit_rate
+            if provider == 'brasilapi' and segments[-1] == 'empresas':
+                items = [brasilapi_record(fake_cnpj(stable_seed(query, i))) for i in range(3)] if hit else []
+                return self.send(200, json.dumps(items), 'application/json')
+            if provider == 'brasilapi':
+                return self.send(200, json.dumps(brasilapi_record(segments[-1])), 'application/json')
+            if provider == 'minha_receita':
+                return self.send(200, json.dumps(minha_receita_record(segments[-1])), 'application/json')
+            if provider == 'receitaws':
+                data = [{
+                    "cnpj": cnpj_utils.format_cnpj(fake_cnpj(stable_seed(query, i, 'ws'))),
+                    "nome": f"{query.upper()} {i} LTDA", "fantasia": "", "municipio": "SAO PAULO", "uf": "SP",
+                } for i in range(3)] if hit else []
+                return self.send(200, json.dumps({"data": data}), 'application/json')
+            return self.send(200, search_html(provider, query), 'text/html; charset=utf-8')
+
+    return Handler
+
+
+def start(port=0, latency=None, error_rate=0.0, search_hit_rate=1.0):
+    """Start the mock in a daemon thread; returns (server, state, base_url)"""
+    state = MockState(latency or {}, error_rate, search_hit_rate)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f"http://127.0.0.1:{server.server_port}"
+
+
+def parse_latency(values):
+    """["0.2", "google=0.8"] -> {"*": 0.2, "google": 0.8}"""
+    latency = {}
+    for value in values or []:
+        provider, _, seconds = value.rpartition('=')
+        latency[provider or '*'] = float(seconds)
+    return latency
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Mock upstream providers")
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', action='append', help="seconds, or provider=seconds (repeatable)")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--search-hit-rate', type=float, default=1.0,
+                        help="share of API name searches that return hits (the rest exercise the scrapers)")
+    args = parser.parse_args()
+    server, _, base_url = start(args.port, parse_latency(args.latency), args.error_rate, args.search_hit_rate)
+    for name, value in provider_env(base_url).items():
+        print(f"export {name}={value}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
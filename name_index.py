@@ -0,0 +1,247 @@
+# Local company-name index for /api/search
+# Inverted index over razão social and nome fantasia with trigram fuzzy matching,
+# ranked results and prefix queries, loaded from an on-disk snapshot.
+#
+# Build:  python name_index.py <receita_db> <snapshot_path>
+# Bench:  python name_index.py --bench 500000   (synthetic names, query latency)
+
+import heapq
+import math
+import os
+import pickle
+import re
+import sqlite3
+import sys
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+
+try:
+    import numpy as np
+except ImportError:  # optional, only speeds up probing long posting lists
+    np = None
+
+# Legal suffixes stripped from names, same set /api/search strips from queries
+LEGAL_SUFFIXES = ('brasil', 'brazil', 'ltda', 'me', 'sa')
+LEGAL_SUFFIX_RE = re.compile(r'\s+(' + '|'.join(LEGAL_SUFFIXES) + r')\s*$', re.IGNORECASE)
+
+_NON_ALNUM_RE = re.compile(r'[^a-z0-9]+')
+
+# Minimum trigram similarity for a fuzzy token match
+FUZZY_THRESHOLD = 0.45
+# Most documents a query scores; past it, more common tokens only rescore the ones already found
+MAX_CANDIDATES = 20000
+# A posting list this many times longer than the candidate set is probed, not walked
+PROBE_RATIO = 4
+
+
+def normalize(text):
+    """Lowercase, accent-free tokens with trailing legal suffixes removed"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    # "S.A." and "M.E." collapse to "sa"/"me" before splitting
+    tokens = _NON_ALNUM_RE.sub(' ', text.replace('.', '')).split()
+    while len(tokens) > 1 and tokens[-1] in LEGAL_SUFFIXES:
+        tokens.pop()
+    return tokens
+
+
+def trigrams(token):
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """Token -> document postings plus a trigram index over the vocabulary"""
+
+    def __init__(self):
+        self.docs = []
+        self.vocabulary = []
+        self.postings = []
+        self.trigram_tokens = {}
+
+    @classmethod
+    def build(cls, companies):
+        """Index an iterable of (cnpj, razao_social, nome_fantasia, municipio, uf)"""
+        index = cls()
+        postings = defaultdict(lambda: array('I'))
+        for doc_id, company in enumerate(companies):
+            index.docs.append(tuple(company))
+            tokens = set(normalize(company[1])) | set(normalize(company[2]))
+            for token in tokens:
+                postings[token].append(doc_id)
+
+        index.vocabulary = sorted(postings)
+        index.postings = [postings.pop(token) for token in index.vocabulary]
+        trigram_tokens = defaultdict(lambda: array('I'))
+        for token_id, token in enumerate(index.vocabulary):
+            for gram in trigrams(token):
+                trigram_tokens[gram].append(token_id)
+        index.trigram_tokens = dict(trigram_tokens)
+        return index
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        index = cls()
+        index.docs, index.vocabulary, index.postings, index.trigram_tokens = state
+        return index
+
+    def save(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((self.docs, self.vocabulary, self.postings, self.trigram_tokens), f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def _token_id(self, token):
+        i = bisect_left(self.vocabulary, token)
+        if i < len(self.vocabulary) and self.vocabulary[i] == token:
+            return i
+        return None
+
+    def _expand(self, token, prefix):
+        """Vocabulary matches for one query token as {token_id: weight}"""
+        matches = {}
+        token_id = self._token_id(token)
+        if token_id is not None:
+            matches[token_id] = 1.0
+        if prefix:
+            i = bisect_left(self.vocabulary, token)
+            while i < len(self.vocabulary) and self.vocabulary[i].startswith(token) and len(matches) < 50:
+                matches.setdefault(i, 0.9)
+                i += 1
+        if not matches and len(token) >= 3:
+            grams = trigrams(token)
+            shared = defaultdict(int)
+            for gram in grams:
+                for candidate in self.trigram_tokens.get(gram, ()):
+                    shared[candidate] += 1
+            for candidate, count in shared.items():
+                similarity = count / (len(grams) + len(trigrams(self.vocabulary[candidate])) - count)
+                if similarity >= FUZZY_THRESHOLD:
+                    matches[candidate] = 0.8 * similarity
+        return matches
+
+    def search(self, query, limit=10, prefix=False):
+        """Ranked (score, doc) pairs; prefix=True treats the last token as a prefix (type-ahead)"""
+        return [(score, doc) for score, _, doc in self.search_matches(query, limit, prefix)]
+
+    def search_matches(self, query, limit=10, prefix=False):
+        """Ranked (score, complete, doc) triples; complete is True when the name matched every query token
+
+        Tokens are taken rarest first. Candidates come from the postings walked until there are
+        MAX_CANDIDATES of them; longer lists for common tokens are only probed for those.
+        """
+        tokens = normalize(query)
+        if not tokens or not self.docs:
+            return []
+
+        expanded = [self._expand(token, prefix and position == len(tokens) - 1)
+                    for position, token in enumerate(tokens)]
+        expanded.sort(key=lambda expansions: sum(len(self.postings[token_id]) for token_id in expansions))
+        total = len(self.docs)
+        scores = {}
+        matched = defaultdict(int)
+        for expansions in expanded:
+            best = {}
+            # Exact matches first, so they claim candidate room before fuzzy ones
+            for token_id, weight in sorted(expansions.items(), key=lambda item: -item[1]):
+                postings = self.postings[token_id]
+                score = weight * math.log(1 + total / len(postings))
+                room = MAX_CANDIDATES - len(scores) - len(best)
+                if len(postings) <= room or len(postings) <= PROBE_RATIO * len(scores):
+                    for doc_id in postings:
+                        if doc_id not in scores and doc_id not in best:
+                            if room <= 0:
+                                continue
+                            room -= 1
+                        if score > best.get(doc_id, 0):
+                            best[doc_id] = score
+                    continue
+                for doc_id in self._probe(postings, scores):
+                    if score > best.get(doc_id, 0):
+                        best[doc_id] = score
+                for doc_id in postings:
+                    if room <= 0:
+                        break
+                    if doc_id not in scores and doc_id not in best:
+                        best[doc_id] = score
+                        room -= 1
+            for doc_id, score in best.items():
+                scores[doc_id] = scores.get(doc_id, 0.0) + score
+                matched[doc_id] += 1
+
+        # Documents matching every query token rank above partial matches
+        ranked = heapq.nlargest(limit, scores, key=lambda doc_id: (matched[doc_id], scores[doc_id]))
+        return [(round(scores[doc_id], 4), matched[doc_id] == len(tokens), self.docs[doc_id])
+                for doc_id in ranked]
+
+    @staticmethod
+    def _probe(postings, doc_ids):
+        """The doc_ids present in a sorted posting list, by binary search"""
+        if np is not None and postings.itemsize == 4:
+            sorted_postings = np.frombuffer(postings, dtype=np.uint32)
+            wanted = np.fromiter(doc_ids, dtype=np.uint32, count=len(doc_ids))
+            positions = np.searchsorted(sorted_postings, wanted)
+            positions[positions == len(sorted_postings)] = 0
+            return wanted[sorted_postings[positions] == wanted].tolist()
+        found = []
+        for doc_id in doc_ids:
+            i = bisect_left(postings, doc_id)
+            if i < len(postings) and postings[i] == doc_id:
+                found.append(doc_id)
+        return found
+
+
+def iter_receita_companies(db_path):
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    rows = conn.execute("""
+        SELECT e.cnpj, COALESCE(m.razao_social, ''), COALESCE(e.nome_fantasia, ''),
+               COALESCE(mu.descricao, ''), COALESCE(e.uf, '')
+        FROM estabelecimentos e
+        LEFT JOIN empresas m ON m.cnpj_basico = e.cnpj_basico
+        LEFT JOIN municipios mu ON mu.codigo = e.codigo_municipio
+    """)
+    yield from rows
+    conn.close()
+
+
+def synthetic_companies(count, seed=1):
+    """Receita-like names for benchmarks: a few very common words plus rarer ones"""
+    import random
+
+    rng = random.Random(seed)
+    common = ["comercio", "servicos", "industria", "transportes", "construcoes", "alimentos"]
+    rare = [f"nome{n}" for n in range(max(1, count // 20))]
+    for n in range(count):
+        words = [rng.choice(common), rng.choice(rare), rng.choice(rare), rng.choice(["ltda", "me", "eireli"])]
+        yield (f"{n:014d}", " ".join(words).upper(), "", "SAO PAULO", "SP")
+
+
+def bench(count, queries=("comercio", "comercio servicos", "transportes nome17", "nome42 nome43", "comerc")):
+    started = time.perf_counter()
+    index = NameIndex.build(synthetic_companies(count))
+    print(f"built {count} docs in {time.perf_counter() - started:.1f}s")
+    for query in queries:
+        runs = []
+        for _ in range(5):
+            started = time.perf_counter()
+            index.search(query, prefix=True)
+            runs.append(time.perf_counter() - started)
+        print(f"  {query!r:<24} {min(runs) * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == '--bench':
+        bench(int(sys.argv[2]))
+        sys.exit()
+    if len(sys.argv) != 3:
+        sys.exit("usage: python name_index.py <receita_db> <snapshot_path>\n"
+                 "       python name_index.py --bench <companies>")
+    index = NameIndex.build(iter_receita_companies(sys.argv[1]))
+    index.save(sys.argv[2])
+    print(f"{len(index.docs)} companies, {len(index.vocabulary)} tokens -> {sys.argv[2]}")
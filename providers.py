@@ -0,0 +1,305 @@
+# Provider registry and execution engine
+# Every upstream source is a Provider registered under a kind ("cnpj", "search", "scrape"), with
+# its own timeout, priority, cost and enabled flag. Callers ask the registry for the providers of a
+# kind and run them through execute() (execute_async() on the event loop) under a strategy, so
+# adding, disabling or reordering a source
+# doesn't touch the lookup paths, and each provider can be called on its own (see benchmark.py).
+#
+# Any setting can be overridden with PROVIDER_<KIND>_<NAME>_<SETTING>, e.g.
+# PROVIDER_SEARCH_RECEITAWS_ENABLED=0 or PROVIDER_CNPJ_MINHA_RECEITA_PRIORITY=5.
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import metrics
+import upstream
+
+STRATEGIES = ("sequential", "parallel", "hedged", "first_n")
+
+
+def _setting(kind, name, setting, default, convert):
+    value = os.environ.get(f"PROVIDER_{kind}_{name}_{setting}".upper())
+    return default if value is None else convert(value)
+
+
+def _flag(value):
+    return value.lower() not in ('0', 'false', 'no', 'off')
+
+
+class Provider:
+    """One upstream source for one kind of query
+
+    Either build_request(arg) -> (url, headers), with an optional parse(payload), for plain JSON
+    GETs, or a custom fetch(arg, timeout, cancel). upstream is the name its rate limit, breaker
+    and metrics are kept under. timeout (seconds, None for the caller's budget) caps each call;
+    lower priority runs first and cheaper breaks ties. Sources with a multi-ID endpoint also set
+    batch_request(args) -> (url, headers), parse_batch(payload) -> {arg: result} and max_batch.
+    """
+
+    def __init__(self, name, kind, build_request=None, parse=None, fetch=None, upstream=None,
+                 timeout=None, priority=100, cost=1.0, enabled=True,
+                 batch_request=None, parse_batch=None, max_batch=1):
+        self.name = name
+        self.kind = kind
+        self.build_request = build_request
+        self.parse = parse
+        self.fetch = fetch
+        self.upstream = upstream or name
+        self.timeout = _setting(kind, name, 'timeout', timeout, float)
+        self.priority = _setting(kind, name, 'priority', priority, int)
+        self.cost = _setting(kind, name, 'cost', cost, float)
+        self.enabled = _setting(kind, name, 'enabled', enabled, _flag)
+        self.batch_request = batch_request
+        self.parse_batch = parse_batch
+        self.max_batch = max_batch
+
+    def budget(self, budget):
+        """Time allowed for one call given what the caller has left"""
+        if self.timeout is None:
+            return budget
+        return self.timeout if budget is None else min(self.timeout, budget)
+
+    def call(self, arg, timeout=None, cancel=None):
+        """The provider's answer for arg, or None when it had none"""
+        timeout = self.budget(timeout)
+        if self.fetch is not None:
+            return self.fetch(arg, timeout, cancel)
+        url, headers = self.build_request(arg)
+        response = upstream.get(self.upstream, url, budget=timeout, headers=headers)
+        if response.status_code != 200:
+            return None
+        with metrics.parse_timer(self.upstream):
+            data = response.json()
+            return self.parse(data) if self.parse is not None else data
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "upstream": self.upstream,
+            "enabled": self.enabled,
+            "priority": self.priority,
+            "cost": self.cost,
+            "timeout": self.timeout,
+            "batch": self.max_batch if self.batch_request is not None else None,
+        }
+
+
+class Registry:
+    def __init__(self):
+        self._providers = {}
+        self._lock = threading.Lock()
+
+    def register(self, provider):
+        with self._lock:
+            self._providers[(provider.kind, provider.name)] = provider
+        return provider
+
+    def get(self, kind, name):
+        return self._providers.get((kind, name))
+
+    def providers(self, kind, include_disabled=False):
+        """Providers of a kind, in the order they should be tried"""
+        with self._lock:
+            found = [p for p in self._providers.values() if p.kind == kind and (p.enabled or include_disabled)]
+        return sorted(found, key=lambda p: (p.priority, p.cost))
+
+    def snapshot(self):
+        with self._lock:
+            providers = list(self._providers.values())
+        return [p.describe() for p in sorted(providers, key=lambda p: (p.kind, p.priority, p.cost))]
+
+
+registry = Registry()
+register = registry.register
+
+
+def _collector(strategy, n, on_result):
+    """(answers, answered) for one run; answered(provider, arg, result) says whether to stop"""
+    if strategy not in STRATEGIES:
+        raise ValueError(f"unknown strategy {strategy!r}")
+    if n is None and strategy != "parallel":
+        n = 1
+    answers = []
+
+    def answered(provider, arg, result):
+        if result is None:
+            return False
+        answers.append((provider, arg, result))
+        stop = on_result(provider, arg, result) if on_result is not None else False
+        return bool(stop) or (n is not None and len(answers) >= n)
+
+    return answers, answered
+
+
+def execute(calls, pool, strategy="parallel", budget=None, n=None, hedge_after=1.0,
+            on_result=None, slow_after=None, on_slow=None, cancel=None):
+    """Run (provider, arg) calls under a strategy; returns the answers as (provider, arg, result)
+
+    Answers are the calls that returned something other than None, in the order they arrived.
+    - sequential: one call after another on the caller's thread, until n answers (default 1)
+    - parallel:   every call at once, until all are done (or n answers, if given)
+    - first_n:    every call at once, until n answers (default 1)
+    - hedged:     the first call, then the next each hedge_after seconds without an answer,
+                  until n answers (default 1)
+    on_result(provider, arg, result) sees each answer as it arrives and may return True to stop.
+    on_slow() is called once slow_after seconds in, if the engine is still waiting. Calls still
+    running when the engine stops are abandoned; cancel (a threading.Event) is set for them.
+    """
+    answers, answered = _collector(strategy, n, on_result)
+    started = time.monotonic()
+    deadline = started + budget if budget is not None else None
+
+    def left():
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    if strategy == "sequential":
+        for provider, arg in calls:
+            timeout = left()
+            if timeout == 0:
+                break
+            try:
+                result = provider.call(arg, timeout, cancel)
+            except Exception:
+                continue
+            if answered(provider, arg, result):
+                break
+        return answers
+
+    queued = list(calls)
+    futures = {}
+    pending = set()
+
+    def launch(count):
+        for provider, arg in queued[:count]:
+            future = pool.submit(metrics.bind(provider.call), arg, left(), cancel)
+            futures[future] = (provider, arg)
+            pending.add(future)
+        del queued[:count]
+
+    launch(1 if strategy == "hedged" else len(queued))
+    next_hedge = started + hedge_after
+    try:
+        while pending or queued:
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                break
+            if strategy == "hedged" and queued and (now >= next_hedge or not pending):
+                launch(1)
+                next_hedge = now + hedge_after
+            timeouts = [left()]
+            if strategy == "hedged" and queued:
+                timeouts.append(next_hedge - now)
+            if on_slow is not None:
+                if now - started >= slow_after:
+                    on_slow()
+                    on_slow = None
+                else:
+                    timeouts.append(started + slow_after - now)
+            timeouts = [t for t in timeouts if t is not None]
+            done, still_running = wait(pending, timeout=min(timeouts) if timeouts else None,
+                                       return_when=FIRST_COMPLETED)
+            pending.intersection_update(still_running)
+            stop = False
+            for future in done:
+                provider, arg = futures[future]
+                try:
+                    result = future.result()
+                except Exception:
+                    continue
+                if answered(provider, arg, result):
+                    stop = True
+                    break
+            if stop:
+                break
+    finally:
+        for future in futures:
+            if not future.done():
+                future.cancel()
+        if cancel is not None and any(not future.done() for future in futures):
+            cancel.set()
+    return answers
+
+
+def _threaded_call(provider, arg, timeout):
+    return asyncio.to_thread(provider.call, arg, timeout)
+
+
+async def execute_async(calls, call=_threaded_call, strategy="parallel", budget=None, n=None, hedge_after=1.0,
+                        on_result=None, slow_after=None, on_slow=None):
+    """Coroutine counterpart of execute() for the event loop, with the same strategies and hooks
+
+    Each call is made by awaiting call(provider, arg, timeout), which by default runs provider.call
+    in a thread. Calls still running when the engine stops are cancelled.
+    """
+    answers, answered = _collector(strategy, n, on_result)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + budget if budget is not None else None
+
+    def left():
+        return None if deadline is None else max(0.0, deadline - loop.time())
+
+    if strategy == "sequential":
+        for provider, arg in calls:
+            timeout = left()
+            if timeout == 0:
+                break
+            try:
+                result = await asyncio.wait_for(call(provider, arg, timeout), timeout)
+            except Exception:
+                continue
+            if answered(provider, arg, result):
+                break
+        return answers
+
+    queued = list(calls)
+    tasks = {}
+    pending = set()
+
+    def launch(count):
+        for provider, arg in queued[:count]:
+            task = asyncio.ensure_future(call(provider, arg, left()))
+            tasks[task] = (provider, arg)
+            pending.add(task)
+        del queued[:count]
+
+    launch(1 if strategy == "hedged" else len(queued))
+    next_hedge = started + hedge_after
+    try:
+        while pending or queued:
+            now = loop.time()
+            if deadline is not None and now >= deadline:
+                break
+            if strategy == "hedged" and queued and (now >= next_hedge or not pending):
+                launch(1)
+                next_hedge = now + hedge_after
+            timeouts = [t for t in (left(), next_hedge - now if strategy == "hedged" and queued else None)
+                        if t is not None]
+            if on_slow is not None:
+                if now - started >= slow_after:
+                    on_slow()
+                    on_slow = None
+                else:
+                    timeouts.append(started + slow_after - now)
+            done, _ = await asyncio.wait(pending, timeout=min(timeouts) if timeouts else None,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            pending.difference_update(done)
+            stop = False
+            for task in done:
+                provider, arg = tasks[task]
+                if task.cancelled() or task.exception() is not None:
+                    continue
+                if answered(provider, arg, task.result()):
+                    stop = True
+                    break
+            if stop:
+                break
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+    return answers
@@ -0,0 +1,318 @@
+# Local index of the Receita Federal open CNPJ dataset
+# Streams the zipped CSV dumps (Empresas, Estabelecimentos, Socios and lookup tables)
+# into a compact SQLite file and serves point lookups in the BrasilAPI record shape.
+# Rebuilding over an existing store also records which CNPJs changed between the two dumps.
+#
+# Build:  python receita_store.py <dump_dir> <db_path>
+
+import csv
+import io
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zipfile
+
+from cnpj_utils import validate_batch
+
+# Column layout of each dump file (the CSVs have no header row)
+LAYOUTS = {
+    "empresas": ["cnpj_basico", "razao_social", "natureza_juridica", "qualificacao_responsavel",
+                 "capital_social", "porte", "ente_federativo_responsavel"],
+    "estabelecimentos": ["cnpj_basico", "cnpj_ordem", "cnpj_dv", "identificador_matriz_filial",
+                         "nome_fantasia", "situacao_cadastral", "data_situacao_cadastral",
+                         "motivo_situacao_cadastral", "nome_cidade_exterior", "pais",
+                         "data_inicio_atividade", "cnae_fiscal", "cnaes_secundarios",
+                         "descricao_tipo_de_logradouro", "logradouro", "numero", "complemento",
+                         "bairro", "cep", "uf", "codigo_municipio", "ddd_telefone_1", "telefone_1",
+                         "ddd_telefone_2", "telefone_2", "ddd_fax", "fax", "email",
+                         "situacao_especial", "data_situacao_especial"],
+    "socios": ["cnpj_basico", "identificador_de_socio", "nome_socio", "cnpj_cpf_do_socio",
+               "codigo_qualificacao_socio", "data_entrada_sociedade", "pais",
+               "cpf_representante_legal", "nome_representante_legal",
+               "codigo_qualificacao_representante_legal", "faixa_etaria"],
+    "municipios": ["codigo", "descricao"],
+    "cnaes": ["codigo", "descricao"],
+    "qualificacoes": ["codigo", "descricao"],
+    "naturezas": ["codigo", "descricao"],
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS empresas (
+    cnpj_basico TEXT PRIMARY KEY, razao_social TEXT, natureza_juridica TEXT,
+    qualificacao_responsavel TEXT, capital_social TEXT, porte TEXT, ente_federativo_responsavel TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS estabelecimentos (
+    cnpj TEXT PRIMARY KEY, cnpj_basico TEXT, identificador_matriz_filial TEXT, nome_fantasia TEXT,
+    situacao_cadastral TEXT, data_situacao_cadastral TEXT, motivo_situacao_cadastral TEXT,
+    data_inicio_atividade TEXT, cnae_fiscal TEXT, cnaes_secundarios TEXT,
+    descricao_tipo_de_logradouro TEXT, logradouro TEXT, numero TEXT, complemento TEXT, bairro TEXT,
+    cep TEXT, uf TEXT, codigo_municipio TEXT, ddd_telefone_1 TEXT, ddd_telefone_2 TEXT, email TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS socios (
+    cnpj_basico TEXT, identificador_de_socio TEXT, nome_socio TEXT, cnpj_cpf_do_socio TEXT,
+    codigo_qualificacao_socio TEXT, data_entrada_sociedade TEXT, faixa_etaria TEXT
+);
+CREATE TABLE IF NOT EXISTS municipios (codigo TEXT PRIMARY KEY, descricao TEXT) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cnaes (codigo TEXT PRIMARY KEY, descricao TEXT) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS qualificacoes (codigo TEXT PRIMARY KEY, descricao TEXT) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS naturezas (codigo TEXT PRIMARY KEY, descricao TEXT) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS changes (cnpj TEXT PRIMARY KEY) WITHOUT ROWID;
+"""
+
+# CNPJs whose establishment, company or partner rows differ from the previous store ("prev")
+CHANGES_SQL = [
+    "INSERT OR IGNORE INTO changes SELECT cnpj FROM "
+    "(SELECT * FROM estabelecimentos EXCEPT SELECT * FROM prev.estabelecimentos)",
+    "INSERT OR IGNORE INTO changes SELECT cnpj FROM prev.estabelecimentos EXCEPT SELECT cnpj FROM estabelecimentos",
+    "INSERT OR IGNORE INTO changes SELECT e.cnpj FROM estabelecimentos e JOIN "
+    "(SELECT cnpj_basico FROM (SELECT * FROM empresas EXCEPT SELECT * FROM prev.empresas)) c USING (cnpj_basico)",
+    "INSERT OR IGNORE INTO changes SELECT e.cnpj FROM estabelecimentos e JOIN ("
+    "SELECT cnpj_basico FROM (SELECT * FROM socios EXCEPT SELECT * FROM prev.socios) UNION "
+    "SELECT cnpj_basico FROM (SELECT * FROM prev.socios EXCEPT SELECT * FROM socios)) c USING (cnpj_basico)",
+]
+
+SITUACOES = {1: "NULA", 2: "ATIVA", 3: "SUSPENSA", 4: "INAPTA", 8: "BAIXADA"}
+PORTES = {"00": "NÃO INFORMADO", "01": "MICRO EMPRESA", "03": "EMPRESA DE PEQUENO PORTE", "05": "DEMAIS"}
+
+# Small code tables first, then the three main tables
+LOAD_ORDER = ["municipios", "cnaes", "qualificacoes", "naturezas", "empresas", "estabelecimentos", "socios"]
+
+BATCH_SIZE = 50000
+
+
+def dump_kind(filename):
+    """Dump file kind from its name, e.g. Estabelecimentos3.zip -> estabelecimentos"""
+    name = os.path.basename(filename).lower()
+    for kind in LAYOUTS:
+        if name.startswith(kind):
+            return kind
+    return None
+
+
+def iter_dump_rows(path):
+    """Stream the CSV rows of a dump file, zipped or not, without extracting it"""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.namelist():
+                with archive.open(member) as raw:
+                    text = io.TextIOWrapper(raw, encoding='latin-1', newline='')
+                    yield from csv.reader(text, delimiter=';', quotechar='"')
+    else:
+        with open(path, encoding='latin-1', newline='') as text:
+            yield from csv.reader(text, delimiter=';', quotechar='"')
+
+
+def _row_values(kind, row):
+    record = dict(zip(LAYOUTS[kind], row))
+    if kind == "estabelecimentos":
+        record["cnpj"] = record["cnpj_basico"] + record["cnpj_ordem"] + record["cnpj_dv"]
+        record["ddd_telefone_1"] = record.get("ddd_telefone_1", "") + record.get("telefone_1", "")
+        record["ddd_telefone_2"] = record.get("ddd_telefone_2", "") + record.get("telefone_2", "")
+    return record
+
+
+def _table_columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def build(dump_dir, db_path, log=print):
+    """Ingest every dump file in dump_dir into a fresh store, swapped in atomically"""
+    tmp_path = db_path + '.building'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.executescript(SCHEMA)
+
+    files = sorted(
+        (os.path.join(dump_dir, name) for name in os.listdir(dump_dir) if dump_kind(name)),
+        key=lambda path: LOAD_ORDER.index(dump_kind(path)),
+    )
+    for path in files:
+        kind = dump_kind(path)
+        columns = _table_columns(conn, kind)
+        sql = f"INSERT OR REPLACE INTO {kind} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        count = 0
+        dropped = 0
+        batch = []
+
+        def flush(batch):
+            if kind == "estabelecimentos":
+                # Drop rows whose CNPJ fails its check digits, validated a whole batch at a time
+                cnpj_column = columns.index("cnpj")
+                valid = validate_batch(values[cnpj_column] for values in batch)
+                kept = [values for values, ok in zip(batch, valid) if ok]
+            else:
+                kept = batch
+            conn.executemany(sql, kept)
+            return len(kept), len(batch) - len(kept)
+
+        conn.execute("BEGIN")
+        for row in iter_dump_rows(path):
+            record = _row_values(kind, row)
+            batch.append([record.get(column, "") for column in columns])
+            if len(batch) >= BATCH_SIZE:
+                kept, invalid = flush(batch)
+                count += kept
+                dropped += invalid
+                batch = []
+        kept, invalid = flush(batch)
+        conn.execute("COMMIT")
+        count += kept
+        dropped += invalid
+        log(f"{os.path.basename(path)}: {count} rows -> {kind}" + (f" ({dropped} invalid CNPJs dropped)" if dropped else ""))
+
+    # Built after the load so the inserts don't maintain it row by row
+    conn.execute("CREATE INDEX IF NOT EXISTS socios_cnpj_basico ON socios (cnpj_basico)")
+    if os.path.exists(db_path):
+        _record_changes(conn, db_path, log)
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built_at', ?)", (str(time.time()),))
+    conn.execute("ANALYZE")
+    conn.close()
+    os.replace(tmp_path, db_path)
+
+
+def _record_changes(conn, previous_path, log=print):
+    """Flag CNPJs that differ from the store being replaced, for incremental cache refreshes"""
+    conn.execute("ATTACH DATABASE ? AS prev", (previous_path,))
+    try:
+        conn.execute("BEGIN")
+        for sql in CHANGES_SQL:
+            conn.execute(sql)
+        conn.execute("COMMIT")
+        log(f"{conn.execute('SELECT COUNT(*) FROM changes').fetchone()[0]} CNPJs changed since the previous dump")
+    except sqlite3.Error as e:
+        conn.execute("ROLLBACK")
+        log(f"Previous store not comparable, no changes recorded: {e}")
+    finally:
+        conn.execute("DETACH DATABASE prev")
+
+
+def _int(value):
+    return int(value) if value and value.isdigit() else None
+
+
+def _date(value):
+    """YYYYMMDD -> YYYY-MM-DD, as BrasilAPI returns dates"""
+    if value and len(value) == 8 and value.isdigit() and value != "00000000":
+        return f"{value[:4]}-{value[4:6]}-{value[6:]}"
+    return None
+
+
+def _capital(value):
+    try:
+        return float(value.replace(',', '.'))
+    except (AttributeError, ValueError):
+        return None
+
+
+class ReceitaStore:
+    """Read-only point lookups over a built store"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        # Never reuse a connection inherited through fork
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def built_at(self):
+        """When the store was built (epoch seconds), or None for stores built before it was recorded"""
+        try:
+            row = self._db().execute("SELECT value FROM meta WHERE key = 'built_at'").fetchone()
+        except sqlite3.Error:
+            return None
+        return float(row[0]) if row else None
+
+    def changed_cnpjs(self):
+        """CNPJs whose data changed between the previous dump and this one"""
+        try:
+            cursor = self._db().execute("SELECT cnpj FROM changes")
+        except sqlite3.Error:
+            return
+        for row in cursor:
+            yield row[0]
+
+    def get(self, cnpj_clean):
+        """Joined establishment + company + partners record, or None"""
+        db = self._db()
+        row = db.execute("""
+            SELECT e.*, m.razao_social, m.natureza_juridica, m.capital_social, m.porte,
+                   mu.descricao AS municipio, c.descricao AS cnae_fiscal_descricao,
+                   n.descricao AS natureza_juridica_descricao
+            FROM estabelecimentos e
+            LEFT JOIN empresas m ON m.cnpj_basico = e.cnpj_basico
+            LEFT JOIN municipios mu ON mu.codigo = e.codigo_municipio
+            LEFT JOIN cnaes c ON c.codigo = e.cnae_fiscal
+            LEFT JOIN naturezas n ON n.codigo = m.natureza_juridica
+            WHERE e.cnpj = ?
+        """, (cnpj_clean,)).fetchone()
+        if row is None:
+            return None
+
+        partners = db.execute("""
+            SELECT s.*, q.descricao AS qualificacao_socio
+            FROM socios s LEFT JOIN qualificacoes q ON q.codigo = s.codigo_qualificacao_socio
+            WHERE s.cnpj_basico = ?
+        """, (row["cnpj_basico"],)).fetchall()
+
+        secondary = [code.strip() for code in (row["cnaes_secundarios"] or "").split(",") if code.strip().isdigit()]
+        descriptions = dict(db.execute(
+            f"SELECT codigo, descricao FROM cnaes WHERE codigo IN ({', '.join('?' * len(secondary))})", secondary
+        ).fetchall()) if secondary else {}
+
+        return {
+            "cnpj": row["cnpj"],
+            "razao_social": row["razao_social"] or "",
+            "nome_fantasia": row["nome_fantasia"],
+            "identificador_matriz_filial": _int(row["identificador_matriz_filial"]),
+            "situacao_cadastral": _int(row["situacao_cadastral"]),
+            "descricao_situacao_cadastral": SITUACOES.get(_int(row["situacao_cadastral"]), ""),
+            "data_situacao_cadastral": _date(row["data_situacao_cadastral"]),
+            "data_inicio_atividade": _date(row["data_inicio_atividade"]),
+            "cnae_fiscal": _int(row["cnae_fiscal"]),
+            "cnae_fiscal_descricao": row["cnae_fiscal_descricao"] or "",
+            "cnaes_secundarios": [
+                {"codigo": int(code), "descricao": descriptions.get(code, "")} for code in secondary],
+            "natureza_juridica": row["natureza_juridica_descricao"] or "",
+            "capital_social": _capital(row["capital_social"]),
+            "porte": PORTES.get(row["porte"], ""),
+            "descricao_tipo_de_logradouro": row["descricao_tipo_de_logradouro"],
+            "logradouro": row["logradouro"],
+            "numero": row["numero"],
+            "complemento": row["complemento"],
+            "bairro": row["bairro"],
+            "cep": row["cep"],
+            "uf": row["uf"],
+            "codigo_municipio": _int(row["codigo_municipio"]),
+            "municipio": row["municipio"] or "",
+            "ddd_telefone_1": row["ddd_telefone_1"],
+            "ddd_telefone_2": row["ddd_telefone_2"],
+            "email": row["email"] or None,
+            "qsa": [{
+                "identificador_de_socio": _int(p["identificador_de_socio"]),
+                "nome_socio": p["nome_socio"],
+                "cnpj_cpf_do_socio": p["cnpj_cpf_do_socio"],
+                "codigo_qualificacao_socio": _int(p["codigo_qualificacao_socio"]),
+                "qualificacao_socio": p["qualificacao_socio"] or "",
+                "data_entrada_sociedade": _date(p["data_entrada_sociedade"]),
+                "faixa_etaria": p["faixa_etaria"],
+            } for p in partners],
+        }
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit("usage: python receita_store.py <dump_dir> <db_path>")
+    build(sys.argv[1], sys.argv[2])
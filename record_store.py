@@ -0,0 +1,297 @@
+# Compact in-memory storage for merged CNPJ records
+# Records are kept column-wise instead of as dicts: repeated values (municipio, uf, CNAE, dates...)
+# are dictionary-encoded into per-column pools and referenced by codes in the narrowest integer
+# array that holds them (1 byte for most fields, widened as a pool grows), the rest of each
+# record is packed into one JSON byte string, and partners (qsa) live in a separate table.
+# The original dict is rebuilt only when a record is read.
+
+import json
+import sys
+from array import array
+
+# Low-cardinality record fields, stored as codes into a shared value pool per field
+DICT_FIELDS = (
+    "uf", "municipio", "codigo_municipio", "codigo_municipio_ibge", "bairro", "pais", "codigo_pais",
+    "nome_cidade_exterior", "cnae_fiscal", "cnae_fiscal_descricao", "natureza_juridica",
+    "codigo_natureza_juridica", "porte", "codigo_porte", "situacao_cadastral", "descricao_situacao_cadastral",
+    "data_situacao_cadastral", "motivo_situacao_cadastral", "descricao_motivo_situacao_cadastral",
+    "identificador_matriz_filial", "descricao_identificador_matriz_filial", "descricao_tipo_de_logradouro",
+    "data_inicio_atividade", "opcao_pelo_simples", "data_opcao_pelo_simples", "data_exclusao_do_simples",
+    "opcao_pelo_mei", "data_opcao_pelo_mei", "data_exclusao_do_mei", "situacao_especial",
+    "data_situacao_especial", "ente_federativo_responsavel", "qualificacao_do_responsavel",
+    "ddd_fax", "sources", "enriched",
+)
+# Mostly unique fields, packed per record in a fixed order (no key names stored)
+PACKED_FIELDS = (
+    "cnpj", "razao_social", "nome_fantasia", "logradouro", "numero", "complemento", "cep", "email",
+    "ddd_telefone_1", "ddd_telefone_2", "capital_social", "cnaes_secundarios",
+)
+PARTNER_DICT_FIELDS = (
+    "identificador_de_socio", "codigo_qualificacao_socio", "qualificacao_socio", "data_entrada_sociedade",
+    "codigo_faixa_etaria", "faixa_etaria", "codigo_pais", "pais", "percentual_capital_social",
+    "cpf_representante_legal", "codigo_qualificacao_representante_legal", "qualificacao_representante_legal",
+)
+PARTNER_PACKED_FIELDS = ("nome_socio", "cnpj_cpf_do_socio", "nome_representante_legal")
+
+_DICT_SET = frozenset(DICT_FIELDS)
+_PACKED_SET = frozenset(PACKED_FIELDS)
+_PARTNER_DICT_SET = frozenset(PARTNER_DICT_FIELDS)
+_PARTNER_PACKED_SET = frozenset(PARTNER_PACKED_FIELDS)
+# Presence bit telling that "qsa" is stored in the partner table
+_QSA_BIT = 1 << len(PACKED_FIELDS)
+_MAX_PARTNERS = 0xFFFF
+# Code columns start as bytes and move to the next width when a code no longer fits
+_WIDER = {'B': ('H', 0xFF), 'H': ('I', 0xFFFF), 'I': ('I', 0xFFFFFFFF)}
+
+
+def _put(columns, name, index, code):
+    """Set (or, at index len(column), append) a code, widening the column when it doesn't fit"""
+    codes = columns[name]
+    wider, limit = _WIDER[codes.typecode]
+    if code > limit:
+        codes = columns[name] = array(wider if code <= _WIDER[wider][1] else 'I', codes)
+    if index == len(codes):
+        codes.append(code)
+    else:
+        codes[index] = code
+
+
+class _JsonText(str):
+    """A pooled list/dict value, kept as its JSON text and decoded on read"""
+    __slots__ = ()
+
+
+class ValuePool:
+    """Dictionary encoding for one field: each distinct value stored once, reference counted
+
+    Code 0 means the field is absent from the record.
+    """
+
+    def __init__(self):
+        self.values = [None]
+        self.refs = array('I', [0])
+        self.codes = {}
+        self.free = []
+
+    @staticmethod
+    def _key(value):
+        if isinstance(value, (list, dict)):
+            return (_JsonText, json.dumps(value, sort_keys=True, ensure_ascii=False))
+        # The type keeps 1, 1.0 and True apart
+        return (type(value), value)
+
+    def encode(self, value):
+        key = self._key(value)
+        code = self.codes.get(key)
+        if code is None:
+            stored = _JsonText(key[1]) if key[0] is _JsonText else value
+            if self.free:
+                code = self.free.pop()
+                self.values[code] = stored
+            else:
+                code = len(self.values)
+                self.values.append(stored)
+                self.refs.append(0)
+            self.codes[key] = code
+        self.refs[code] += 1
+        return code
+
+    def decode(self, code):
+        value = self.values[code]
+        return json.loads(value) if type(value) is _JsonText else value
+
+    def release(self, code):
+        if not code:
+            return
+        self.refs[code] -= 1
+        if self.refs[code] == 0:
+            value = self.values[code]
+            key = (_JsonText, str(value)) if type(value) is _JsonText else (type(value), value)
+            del self.codes[key]
+            self.values[code] = None
+            self.free.append(code)
+
+    def __len__(self):
+        return len(self.codes)
+
+
+def _tabular(partners):
+    return (isinstance(partners, list) and len(partners) <= _MAX_PARTNERS
+            and all(isinstance(partner, dict) for partner in partners))
+
+
+class RecordStore:
+    """Column store of merged records addressed by row number
+
+    Not thread-safe on its own; TieredCache calls it under its lock.
+    """
+
+    def __init__(self):
+        self._pools = {name: ValuePool() for name in DICT_FIELDS}
+        self._codes = {name: array('B') for name in DICT_FIELDS}
+        self._packed = []
+        self._partner_start = array('I')
+        self._partner_count = array('H')
+        self._partner_pools = {name: ValuePool() for name in PARTNER_DICT_FIELDS}
+        self._partner_codes = {name: array('B') for name in PARTNER_DICT_FIELDS}
+        self._partner_rows = 0
+        self._dead_partners = 0
+        self._free_rows = []
+
+    def add(self, record):
+        """Store a record dict; returns its row number"""
+        if self._free_rows:
+            row = self._free_rows.pop()
+        else:
+            row = len(self._packed)
+            self._packed.append(None)
+            self._partner_start.append(0)
+            self._partner_count.append(0)
+            for codes in self._codes.values():
+                codes.append(0)
+
+        for name in DICT_FIELDS:
+            if name in record:
+                _put(self._codes, name, row, self._pools[name].encode(record[name]))
+
+        mask = 0
+        packed = [0]
+        for bit, name in enumerate(PACKED_FIELDS):
+            if name in record:
+                mask |= 1 << bit
+                packed.append(record[name])
+        extras = {key: value for key, value in record.items()
+                  if key not in _DICT_SET and key not in _PACKED_SET and key != "qsa"}
+        partners = record.get("qsa")
+        if "qsa" in record and not _tabular(partners):
+            extras["qsa"] = partners
+
+        self._partner_start[row] = self._partner_rows
+        self._partner_count[row] = 0
+        if "qsa" in record and _tabular(partners):
+            mask |= _QSA_BIT
+            packed.append([self._add_partner(partner) for partner in partners])
+            self._partner_count[row] = len(partners)
+        # Extras go last and only when there are any, so most records don't pay for the slot
+        if extras:
+            packed.append(extras)
+
+        packed[0] = mask
+        self._packed[row] = json.dumps(packed, separators=(',', ':'), ensure_ascii=False).encode()
+        return row
+
+    def _add_partner(self, partner):
+        """Append one partner row; returns the packed part kept in the owner's byte string"""
+        index = self._partner_rows
+        self._partner_rows += 1
+        for name in PARTNER_DICT_FIELDS:
+            _put(self._partner_codes, name, index,
+                 self._partner_pools[name].encode(partner[name]) if name in partner else 0)
+        mask = 0
+        packed = [0]
+        for bit, name in enumerate(PARTNER_PACKED_FIELDS):
+            if name in partner:
+                mask |= 1 << bit
+                packed.append(partner[name])
+        extras = {key: value for key, value in partner.items()
+                  if key not in _PARTNER_DICT_SET and key not in _PARTNER_PACKED_SET}
+        packed[0] = mask
+        if extras:
+            packed.append(extras)
+        return packed
+
+    def get(self, row):
+        """Rebuild the record dict stored at row"""
+        packed = json.loads(self._packed[row])
+        record = {}
+        for name, codes in self._codes.items():
+            code = codes[row]
+            if code:
+                record[name] = self._pools[name].decode(code)
+
+        mask = packed[0]
+        position = 1
+        for bit, name in enumerate(PACKED_FIELDS):
+            if mask & (1 << bit):
+                record[name] = packed[position]
+                position += 1
+        partners_packed = None
+        if mask & _QSA_BIT:
+            partners_packed = packed[position]
+            position += 1
+        if position < len(packed):
+            record.update(packed[position])
+
+        if partners_packed is not None:
+            start = self._partner_start[row]
+            partners = []
+            for offset, partner_packed in enumerate(partners_packed):
+                partners.append(self._get_partner(start + offset, partner_packed))
+            record["qsa"] = partners
+        return record
+
+    def _get_partner(self, index, packed):
+        partner = {}
+        for name, codes in self._partner_codes.items():
+            code = codes[index]
+            if code:
+                partner[name] = self._partner_pools[name].decode(code)
+        mask = packed[0]
+        position = 1
+        for bit, name in enumerate(PARTNER_PACKED_FIELDS):
+            if mask & (1 << bit):
+                partner[name] = packed[position]
+                position += 1
+        if position < len(packed):
+            partner.update(packed[position])
+        return partner
+
+    def remove(self, row):
+        for name, codes in self._codes.items():
+            self._pools[name].release(codes[row])
+            codes[row] = 0
+        start = self._partner_start[row]
+        for index in range(start, start + self._partner_count[row]):
+            for name, codes in self._partner_codes.items():
+                self._partner_pools[name].release(codes[index])
+        self._dead_partners += self._partner_count[row]
+        self._partner_count[row] = 0
+        self._packed[row] = None
+        self._free_rows.append(row)
+        if self._dead_partners > 4096 and self._dead_partners * 2 > self._partner_rows:
+            self._compact_partners()
+
+    def _compact_partners(self):
+        """Drop the partner rows of removed records, moving live ones down"""
+        keep = []
+        for row, packed in enumerate(self._packed):
+            start = self._partner_start[row]
+            self._partner_start[row] = len(keep)
+            if packed is not None:
+                keep.extend(range(start, start + self._partner_count[row]))
+        for name, codes in self._partner_codes.items():
+            self._partner_codes[name] = array(codes.typecode, (codes[index] for index in keep))
+        self._partner_rows = len(keep)
+        self._dead_partners = 0
+
+    def __len__(self):
+        return len(self._packed) - len(self._free_rows)
+
+    def nbytes(self):
+        """Approximate memory held by the store"""
+        arrays = list(self._codes.values()) + list(self._partner_codes.values())
+        arrays += [self._partner_start, self._partner_count]
+        total = sum(a.itemsize * len(a) for a in arrays)
+        total += sys.getsizeof(self._packed) + sum(sys.getsizeof(p) for p in self._packed if p is not None)
+        for pool in list(self._pools.values()) + list(self._partner_pools.values()):
+            total += sys.getsizeof(pool.values) + sys.getsizeof(pool.codes)
+            total += sum(sys.getsizeof(value) for value in pool.values if value is not None)
+        return total
+
+    def stats(self):
+        return {
+            "records": len(self),
+            "partners": self._partner_rows - self._dead_partners,
+            "distinct_values": sum(len(pool) for pool in self._pools.values()),
+            "approx_bytes": self.nbytes(),
+        }
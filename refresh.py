@@ -0,0 +1,80 @@
+# Background refresh of stale cache entries
+# Keys are queued as they are served stale and refreshed on a small worker pool, the most
+# requested keys first, so hot records are the first to be fresh again.
+
+import heapq
+import itertools
+import threading
+
+
+class BackgroundRefresher:
+    """Runs refresh(key) on worker threads; repeated submits of a queued key raise its priority"""
+
+    def __init__(self, refresh, workers=2, max_pending=1000):
+        self.refresh = refresh
+        self.workers = workers
+        self.max_pending = max_pending
+        self._heap = []
+        self._pending = {}
+        self._running = set()
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stats = {"submitted": 0, "refreshed": 0, "failed": 0, "dropped": 0}
+
+    def _start(self):
+        # Threads start on first use, so importing the app before forking workers stays safe
+        if not self._threads:
+            self._threads = [
+                threading.Thread(target=self._work, name=f"refresh-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def submit(self, key):
+        with self._cond:
+            self._start()
+            if key in self._running:
+                return
+            demand = self._pending.get(key)
+            if demand is None and len(self._pending) >= self.max_pending:
+                self._stats["dropped"] += 1
+                return
+            self._stats["submitted"] += 1
+            demand = (demand or 0) + 1
+            self._pending[key] = demand
+            heapq.heappush(self._heap, (-demand, next(self._seq), key))
+            if len(self._heap) > 4 * self.max_pending:
+                # Drop superseded entries left behind by priority bumps
+                self._heap = [(-d, next(self._seq), k) for k, d in self._pending.items()]
+                heapq.heapify(self._heap)
+            self._cond.notify()
+
+    def _next(self):
+        with self._cond:
+            while True:
+                while self._heap:
+                    demand, _, key = heapq.heappop(self._heap)
+                    # Only the newest heap entry of a key carries its current demand
+                    if self._pending.get(key) == -demand:
+                        del self._pending[key]
+                        self._running.add(key)
+                        return key
+                self._cond.wait()
+
+    def _work(self):
+        while True:
+            key = self._next()
+            try:
+                self.refresh(key)
+                outcome = "refreshed"
+            except Exception:
+                outcome = "failed"
+            with self._cond:
+                self._running.discard(key)
+                self._stats[outcome] += 1
+
+    def stats(self):
+        with self._cond:
+            return dict(self._stats, pending=len(self._pending), running=len(self._running), workers=self.workers)
@@ -0,0 +1,93 @@
+# CNPJ Finder - multi-process production server
+# Runs the app under gunicorn with preload_app: the master imports it once (name index, Receita
+# store, precompressed page, cache rows preloaded from SQLite) and freezes that heap, then forks
+# one worker per core on a shared listening socket; workers inherit that memory copy-on-write
+# instead of each loading it again, and gunicorn restarts any that die. Between workers:
+#   - the SQLite cache tier (CNPJ_CACHE_DB) is shared, so a record fetched by one serves all
+#   - provider rate limits come from one mmap'd file (RATE_LIMIT_FILE), so quotas hold host-wide
+#   - identical lookups are coalesced across processes with file locks (SINGLEFLIGHT_LOCK_DIR)
+#   - background jobs are claimed atomically from JOBS_DB by whichever worker is free
+# Circuit breakers, the in-process cache tier and /metrics counters stay per worker.
+# Shared files live under CNPJ_STATE_DIR (default: state/ next to app.py) unless set one by one.
+#
+# Run:  python serve.py --workers 8 --threads 16 --port 5000
+
+import argparse
+import gc
+import os
+import time
+
+from gunicorn.app.base import BaseApplication
+
+STATE_DIR = os.environ.get('CNPJ_STATE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'state')
+# Shared-state files, under STATE_DIR, used unless the environment already sets them
+SHARED_DEFAULTS = {
+    'CNPJ_CACHE_DB': 'cache.db',
+    'RATE_LIMIT_FILE': 'ratelimit.bin',
+    'SINGLEFLIGHT_LOCK_DIR': 'singleflight-locks',
+}
+
+
+def post_fork(server, worker):
+    """Resume unfinished jobs in every worker without waiting for a first request"""
+    import app
+
+    app.job_queue.start()
+
+
+class PreforkServer(BaseApplication):
+    def __init__(self, options, preload=None):
+        self.options = options
+        self.preload = preload
+        super().__init__()
+
+    def load_config(self):
+        for name, value in self.options.items():
+            self.cfg.set(name, value)
+
+    def load(self):
+        # Called once in the master since preload_app is set, before any worker is forked
+        import app
+
+        started = time.monotonic()
+        loaded = app.cnpj_cache.preload(self.preload)
+        print(f"Warmed {loaded} cached records in {time.monotonic() - started:.1f}s", flush=True)
+        # Move everything loaded so far out of the collector's reach, so workers don't write to
+        # (and thereby copy) those pages when they collect
+        gc.collect()
+        gc.freeze()
+        return app.app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-forking production server for CNPJ Finder")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('SERVE_THREADS', 16)),
+                        help="request threads per worker (1 = one request at a time)")
+    parser.add_argument('--preload', type=int, default=None,
+                        help="cache rows to load from SQLite before forking (default: the cache size)")
+    args = parser.parse_args()
+
+    os.environ['CNPJ_STATE_DIR'] = STATE_DIR
+    os.makedirs(STATE_DIR, exist_ok=True)
+    for name, value in SHARED_DEFAULTS.items():
+        os.environ.setdefault(name, os.path.join(STATE_DIR, value))
+
+    PreforkServer({
+        'bind': f"{args.host}:{args.port}",
+        'workers': args.workers,
+        'worker_class': 'gthread' if args.threads > 1 else 'sync',
+        'threads': args.threads,
+        'backlog': 1024,
+        # Long enough for a streamed search or batch response; gunicorn restarts stuck workers
+        'timeout': int(os.environ.get('SERVE_TIMEOUT', 120)),
+        'preload_app': True,
+        'post_fork': post_fork,
+        'accesslog': None,
+    }, preload=args.preload).run()
+
+
+if __name__ == '__main__':
+    main()
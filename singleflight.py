@@ -0,0 +1,164 @@
+# Request coalescing for identical concurrent lookups
+# Concurrent callers with the same key share one in-flight call and all receive its result.
+
+import asyncio
+import errno
+import hashlib
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; cross-process coalescing is then disabled
+    fcntl = None
+
+# One file holds every cross-process lock: each key locks its own byte of it, so the directory
+# stays a single file and different keys never wait for each other
+LOCK_FILE = 'singleflight.lock'
+# Longest pause (seconds) between attempts while another process holds a key
+LOCK_POLL_MAX = 0.05
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Thread-level single-flight, optionally serialized across processes with file locks
+
+    With lock_dir set, the leader for a key also locks the key's byte of a shared lock file, so
+    a leader for the same key in another worker waits for it. The wrapped function should
+    re-check a shared cache first so the second process picks up the result instead of
+    fetching again.
+    """
+
+    def __init__(self, lock_dir=None):
+        self.lock_dir = lock_dir if fcntl is not None else None
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "coalesced": 0, "lock_waits": 0, "lock_timeouts": 0}
+        self._fd = None
+        self._fd_pid = None
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+    def do(self, key, fn, cross_process=True, timeout=None):
+        """fn() run once for all concurrent callers of key
+
+        timeout bounds the wait for another process's lock; past it fn runs without the lock.
+        """
+        with self._lock:
+            self._stats["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            if cross_process and self.lock_dir:
+                call.result = self._locked(key, fn, timeout)
+            else:
+                call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def _lock_fd(self):
+        # POSIX record locks belong to the process, and closing any descriptor of the file drops
+        # all of them, so each process opens the file once and keeps it open
+        with self._lock:
+            if self._fd_pid != os.getpid():
+                self._fd = os.open(os.path.join(self.lock_dir, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+                self._fd_pid = os.getpid()
+            return self._fd
+
+    def _locked(self, key, fn, timeout):
+        # A stable digest rather than hash(), which differs between processes
+        offset = int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], 'big') >> 2
+        fd = self._lock_fd()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        delay = 0.001
+        while True:
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, offset)
+                break
+            except OSError as e:
+                if e.errno not in (errno.EACCES, errno.EAGAIN):
+                    raise
+            if delay == 0.001:
+                self._count("lock_waits")
+            if deadline is not None and time.monotonic() + delay > deadline:
+                # The holder is taking longer than our caller can wait; fetch without it
+                self._count("lock_timeouts")
+                return fn()
+            time.sleep(delay)
+            delay = min(delay * 2, LOCK_POLL_MAX)
+        try:
+            return fn()
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN, 1, offset)
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+        stats["cross_process"] = bool(self.lock_dir)
+        return stats
+
+
+class AsyncSingleFlight:
+    """Single-flight for coroutines running on one event loop"""
+
+    def __init__(self):
+        self._calls = {}
+        self._stats = {"calls": 0, "coalesced": 0}
+
+    async def do(self, key, coro_fn):
+        self._stats["calls"] += 1
+        future = self._calls.get(key)
+        if future is not None:
+            self._stats["coalesced"] += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await coro_fn()
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so a failure with no waiters doesn't log "exception never retrieved"
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+            if not future.done():
+                future.cancel()
+
+    def stats(self):
+        return dict(self._stats, in_flight=len(self._calls), cross_process=False)
@@ -0,0 +1,84 @@
+# Incremental refresh of the persisted CNPJ cache
+# Re-fetches only records older than a policy threshold, plus those a newer Receita Federal
+# dump flagged as changed, and rewrites only the rows whose merged content actually changed,
+# so the upstream calls scale with churn instead of with the number of cached companies.
+#
+# Run:  CNPJ_CACHE_DB=cache.db RECEITA_DB=receita.db python store_refresh.py --max-age-days 30
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK_SIZE = 1000
+
+
+def refresh_candidates(cache, max_age, store=None, now=None):
+    """Sorted keys to re-fetch and how many of them only the dump flagged"""
+    now = time.time() if now is None else now
+    keys = set(cache.keys_stored_before(now - max_age))
+    flagged = 0
+    if store is not None:
+        built_at = store.built_at()
+        if built_at is not None:
+            # A record cached after the dump was built already reflects its changes
+            changed = set(cache.keys_stored_before(built_at, store.changed_cnpjs()))
+            flagged = len(changed - keys)
+            keys |= changed
+    return sorted(keys), flagged
+
+
+def incremental_refresh(cache, fetch, keys, concurrency=8, log=print):
+    """Re-fetch keys with fetch(key) -> record or None; unchanged records only get new timestamps"""
+    stats = {"checked": 0, "changed": 0, "unchanged": 0, "failed": 0}
+
+    def refresh_one(key):
+        try:
+            record = fetch(key)
+        except Exception:
+            return "failed"
+        if record is None:
+            # Keep the cached record rather than replacing it with a failed fetch
+            return "failed"
+        return "changed" if cache.set_if_changed(key, record) else "unchanged"
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for start in range(0, len(keys), CHUNK_SIZE):
+            for outcome in pool.map(refresh_one, keys[start:start + CHUNK_SIZE]):
+                stats["checked"] += 1
+                stats[outcome] += 1
+            log(f"{stats['checked']}/{len(keys)} checked, {stats['changed']} changed, {stats['failed']} failed")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally refresh the persisted CNPJ cache")
+    parser.add_argument('--max-age-days', type=float, default=30,
+                        help="re-fetch records stored longer ago than this")
+    parser.add_argument('--limit', type=int, help="refresh at most this many records")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--dry-run', action='store_true', help="only report how many records would be fetched")
+    args = parser.parse_args()
+
+    if not os.environ.get('CNPJ_CACHE_DB'):
+        sys.exit("CNPJ_CACHE_DB must point at the cache database to refresh")
+    import app
+
+    keys, flagged = refresh_candidates(app.cnpj_cache, args.max_age_days * 86400, app.receita_store)
+    if args.limit is not None:
+        keys = keys[:args.limit]
+    print(f"{len(keys)} records to refresh ({flagged} flagged only by the dump)")
+    if args.dry_run or not keys:
+        return
+
+    def fetch(cnpj_clean):
+        record = app.enrich_cnpj(cnpj_clean, batched=True)
+        return record if record["sources"] else None
+
+    stats = incremental_refresh(app.cnpj_cache, fetch, keys, concurrency=args.concurrency)
+    print(stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import io
+import json
+
+import pytest
+
+app = pytest.importorskip("app")
+
+
+class Chunked:
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+        self.read_size = 0
+
+    def read(self, size=-1):
+        chunk = self.data.read(size)
+        self.read_size += len(chunk)
+        return chunk
+
+
+def read_inputs(body, content_type="application/json", **kwargs):
+    with app.app.test_request_context("/api/cnpj/batch", method="POST", data=body,
+                                      content_type=content_type, **kwargs):
+        inputs, error = app.batch_input()
+        return error if inputs is None else list(inputs)
+
+
+def test_json_array_values_split_across_chunks():
+    text = '[ "11.222.333/0001-81", 191 ,\n11222333000181, "a,]b" ]'
+    for size in (1, 2, 3, 7):
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        assert list(app.iter_json_array(chunks)) == ["11.222.333/0001-81", 191, 11222333000181, "a,]b"]
+    assert list(app.iter_json_array(["[]"])) == []
+    assert list(app.iter_json_array(['["a", ', "oops"])) == ["a"]
+    assert list(app.iter_json_array(['{"cnpjs": [1]}'])) == []
+
+
+def test_json_array_body_is_read_as_it_arrives(monkeypatch):
+    monkeypatch.setattr(app, "READ_CHUNK", 5)
+    monkeypatch.setattr(app, "BATCH_JSON_OBJECT_MAX", 10)
+    values = [f"{n:014d}" for n in range(50)]
+    assert read_inputs(json.dumps(values)) == values
+
+
+def test_ndjson_and_csv_bodies():
+    body = '"11222333000181"\n\n191\n11.222.333/0001-81\n'
+    assert read_inputs(body, "application/x-ndjson") == ["11222333000181", "191", "11.222.333/0001-81"]
+    assert read_inputs("cnpj,nome\n191,BANCO\n", "text/csv") == ["191"]
+
+
+def test_object_body_is_capped(monkeypatch):
+    assert read_inputs(json.dumps({"cnpjs": ["191", 11222333000181]})) == ["191", "11222333000181"]
+    monkeypatch.setattr(app, "BATCH_JSON_OBJECT_MAX", 64)
+    body = json.dumps({"cnpjs": [f"{n:014d}" for n in range(10)]})
+    assert isinstance(read_inputs(body), str)
+    # A chunked body has no Content-Length, so the cap is applied while reading
+    monkeypatch.setattr(app, "READ_CHUNK", 8)
+    stream = Chunked(body.encode())
+    chunked = {"wsgi.input": stream, "wsgi.input_terminated": True}
+    assert isinstance(read_inputs(None, environ_overrides=chunked), str)
+    assert stream.read_size <= 64 + 8 < len(body)
+
+    client = app.app.test_client()
+    for path in ("/api/cnpj/batch", "/api/jobs"):
+        response = client.post(path, data=body, content_type="application/json")
+        assert response.status_code == 413
+        assert "NDJSON" in response.get_json()["error"]
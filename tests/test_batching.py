@@ -0,0 +1,60 @@
+import threading
+import time
+
+import pytest
+
+from batching import MicroBatcher
+
+
+def test_keys_in_one_window_share_a_batch():
+    batches = []
+
+    def fetch_many(keys):
+        batches.append(sorted(keys))
+        return {key: key * 2 for key in keys}
+
+    batcher = MicroBatcher(fetch_many, window=0.05, max_batch=10)
+    futures = [batcher.submit(i) for i in range(5)]
+    assert [future.result(timeout=2) for future in futures] == [0, 2, 4, 6, 8]
+    assert batches == [[0, 1, 2, 3, 4]]
+
+
+def test_full_batches_go_out_without_waiting_for_the_window():
+    batches = []
+    batcher = MicroBatcher(lambda keys: batches.append(len(keys)) or {}, window=10, max_batch=4)
+    started = time.monotonic()
+    futures = [batcher.submit(i) for i in range(8)]
+    assert [future.result(timeout=2) for future in futures] == [None] * 8
+    assert time.monotonic() - started < 1
+    assert batches == [4, 4]
+
+
+def test_duplicate_keys_share_a_future():
+    release = threading.Event()
+    batcher = MicroBatcher(lambda keys: release.wait(2) and {key: "x" for key in keys}, window=0.05)
+    first = batcher.submit("a")
+    assert batcher.submit("a") is first
+    release.set()
+    assert first.result(timeout=2) == "x"
+    assert batcher.stats()["coalesced"] == 1
+
+
+def test_a_failed_fetch_fails_every_key():
+    def fetch_many(keys):
+        raise RuntimeError("down")
+
+    batcher = MicroBatcher(fetch_many, window=0.01)
+    futures = [batcher.submit(i) for i in range(3)]
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=2)
+    assert batcher.stats()["failed"] == 1
+
+
+def test_cancelled_keys_are_left_out():
+    batches = []
+    batcher = MicroBatcher(lambda keys: batches.append(sorted(keys)) or {}, window=0.1)
+    kept, dropped = batcher.submit(1), batcher.submit(2)
+    assert dropped.cancel()
+    kept.result(timeout=2)
+    assert batches == [[1]]
@@ -0,0 +1,129 @@
+import pytest
+
+import cache
+from cache import MISS, TieredCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=[False, True], ids=["dicts", "compact"])
+def compact(request):
+    return request.param
+
+
+RECORD = {"cnpj": "11222333000181", "razao_social": "EMPRESA", "uf": "SP", "qsa": [{"nome_socio": "FULANO"}]}
+
+
+def test_positive_entries_expire_after_ttl(clock, compact):
+    store = TieredCache(ttl=100, compact=compact)
+    store.set("k", RECORD)
+    clock.now += 99
+    assert store.get("k") == RECORD
+    clock.now += 2
+    assert store.get("k") is MISS
+    assert store.stats()["hits"] == 1
+    assert store.stats()["misses"] == 1
+
+
+def test_negative_entries_use_their_own_ttl(clock, compact):
+    store = TieredCache(ttl=100, negative_ttl=10, max_stale=1000, compact=compact)
+    store.set("k", None)
+    assert store.get("k") is None
+    assert store.stats()["negative_hits"] == 1
+    clock.now += 11
+    # A "not found" is never served stale
+    assert store.get_entry("k") is MISS
+    assert store.stats()["size"] == 0
+
+
+def test_stale_window_only_through_get_entry(clock, compact):
+    store = TieredCache(ttl=100, max_stale=50, compact=compact)
+    store.set("k", RECORD)
+    clock.now += 120
+    assert store.get("k") is MISS
+    value, stored_at, expires_at = store.get_entry("k")
+    assert value == RECORD
+    assert expires_at < clock.now < expires_at + 50
+    assert store.stats()["stale_hits"] == 1
+    clock.now += 40
+    assert store.get_entry("k") is MISS
+    assert store.stats()["size"] == 0
+
+
+def test_disk_tier_serves_other_instances_and_keeps_ttls(clock, tmp_path):
+    path = str(tmp_path / "cache.db")
+    writer = TieredCache(ttl=100, negative_ttl=10, max_stale=50, db_path=path)
+    writer.set("found", RECORD)
+    writer.set("missing", None)
+
+    reader = TieredCache(ttl=100, negative_ttl=10, max_stale=50, db_path=path, compact=True)
+    assert reader.get("found") == RECORD
+    assert reader.get("missing") is None
+    assert reader.stats()["disk_hits"] == 2
+
+    fresh = TieredCache(ttl=100, negative_ttl=10, max_stale=50, db_path=path)
+    clock.now += 120
+    assert fresh.get("missing") is MISS
+    assert fresh.get("found") is MISS
+    assert fresh.get_entry("found")[0] == RECORD
+    assert fresh.preload() == 1
+
+
+def test_lru_evicts_least_recently_used(clock, compact):
+    store = TieredCache(maxsize=2, compact=compact)
+    store.set("a", dict(RECORD, cnpj="a"))
+    store.set("b", dict(RECORD, cnpj="b"))
+    store.get("a")
+    store.set("c", dict(RECORD, cnpj="c"))
+    assert store.get("b") is MISS
+    assert store.get("a")["cnpj"] == "a"
+    assert store.get("c")["cnpj"] == "c"
+
+
+def test_set_if_changed_renews_unchanged_records(clock, tmp_path):
+    store = TieredCache(ttl=100, db_path=str(tmp_path / "cache.db"))
+    store.set("k", RECORD)
+    clock.now += 90
+    assert store.set_if_changed("k", dict(RECORD)) is False
+    clock.now += 90
+    assert store.get("k") == RECORD
+    assert store.set_if_changed("k", dict(RECORD, uf="RJ")) is True
+    assert store.get("k")["uf"] == "RJ"
+
+
+def test_peek_is_not_counted(clock, tmp_path):
+    store = TieredCache(ttl=100, db_path=str(tmp_path / "cache.db"))
+    assert store.peek("k") is MISS
+    store.set("k", RECORD)
+    assert store.peek("k") == RECORD
+    assert TieredCache(ttl=100, db_path=str(tmp_path / "cache.db")).peek("k") == RECORD
+    stats = store.stats()
+    assert (stats["hits"], stats["disk_hits"], stats["misses"]) == (0, 0, 0)
+
+
+def test_cross_process_lookup_counts_one_miss(tmp_path, monkeypatch):
+    app = pytest.importorskip("app")
+    from singleflight import SingleFlight
+
+    monkeypatch.setattr(app, "inflight", SingleFlight(lock_dir=str(tmp_path)))
+    monkeypatch.setattr(app, "cnpj_cache", TieredCache(db_path=str(tmp_path / "cache.db")))
+    monkeypatch.setattr(app, "cnpj_table", None)
+    monkeypatch.setattr(app, "receita_store", None)
+    monkeypatch.setattr(app, "enrich_cnpj", lambda cnpj, **kwargs: dict(RECORD, cnpj=cnpj, sources=["brasilapi"]))
+    assert app.lookup_cnpj("11222333000181")[1] is None
+    assert app.lookup_cnpj("11222333000181")[1] is None
+    stats = app.cnpj_cache.stats()
+    assert (stats["misses"], stats["hits"], stats["hit_ratio"]) == (1, 1, 0.5)
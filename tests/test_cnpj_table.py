@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+import cnpj_table
+from cache import TieredCache
+from cnpj_table import CnpjTable, build, iter_cache_records
+
+
+def quiet(message):
+    pass
+
+
+RECORDS = [
+    ("00000000000191", {"cnpj": "00000000000191", "razao_social": "BANCO"}),
+    ("11222333000181", {"cnpj": "11222333000181", "razao_social": "EMPRESA", "qsa": [{"nome_socio": "JOÃO"}]}),
+    ("11222333000262", '{"cnpj":"11222333000262","razao_social":"FILIAL"}'),
+    ("12ABC34501DE35", {"cnpj": "12ABC34501DE35", "razao_social": "ALFANUMERICO"}),
+    ("99999999000191", {"cnpj": "99999999000191"}),
+]
+
+
+@pytest.fixture
+def table_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(cnpj_table, "RELOAD_CHECK", 0)
+    return str(tmp_path / "cnpj.table")
+
+
+def test_build_then_find_every_key_and_nothing_else(table_path):
+    assert build(RECORDS, table_path, log=quiet) == len(RECORDS)
+    table = CnpjTable(table_path)
+    assert len(table) == len(RECORDS)
+    assert table.get("11222333000181")["qsa"] == [{"nome_socio": "JOÃO"}]
+    assert table.get("11222333000262") == {"cnpj": "11222333000262", "razao_social": "FILIAL"}
+    assert table.get("12ABC34501DE35")["razao_social"] == "ALFANUMERICO"
+    assert table.get("00000000000191")["razao_social"] == "BANCO"
+    assert table.get("99999999000191") == {"cnpj": "99999999000191"}
+    # Same bucket, before, between and after the stored keys; bad lengths and characters
+    for missing in ("11222333000100", "11222333000200", "11222333000300", "00000000000000",
+                    "99999999999999", "1122233300018", "11222333-00181", "abcdefghijklmn"):
+        assert table.get(missing) is None
+    assert table.stats()["hits"] == 5
+
+
+def test_build_rejects_unordered_keys_and_keeps_the_old_table(table_path):
+    build(RECORDS[:2], table_path, log=quiet)
+    with pytest.raises(ValueError):
+        build(list(reversed(RECORDS)), table_path, log=quiet)
+    with pytest.raises(ValueError):
+        build([RECORDS[0], RECORDS[0]], table_path, log=quiet)
+    assert os.listdir(os.path.dirname(table_path)) == ["cnpj.table"]
+    assert len(CnpjTable(table_path)) == 2
+
+
+def test_readers_pick_up_a_rebuilt_or_new_file(table_path):
+    table = CnpjTable(table_path)
+    assert len(table) == 0
+    assert table.get("11222333000181") is None
+
+    build(RECORDS[:2], table_path, log=quiet)
+    assert table.get("11222333000181")["razao_social"] == "EMPRESA"
+    assert table.get("99999999000191") is None
+
+    build([("11222333000181", {"razao_social": "RENOMEADA"}), RECORDS[-1]], table_path, log=quiet)
+    assert table.get("11222333000181") == {"razao_social": "RENOMEADA"}
+    assert table.get("99999999000191") == {"cnpj": "99999999000191"}
+    assert table.get("00000000000191") is None
+    assert table.stats()["reloads"] == 1
+
+
+def test_build_from_the_persisted_cache(tmp_path, table_path):
+    db_path = str(tmp_path / "cache.db")
+    store = TieredCache(db_path=db_path)
+    for cnpj, record in RECORDS:
+        if isinstance(record, dict):
+            store.set(cnpj, record)
+    store.set("55555555000155", None)
+
+    assert build(iter_cache_records(db_path), table_path, log=quiet) == 4
+    table = CnpjTable(table_path)
+    assert table.get("12ABC34501DE35") == RECORDS[3][1]
+    assert table.get("55555555000155") is None
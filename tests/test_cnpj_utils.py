@@ -0,0 +1,39 @@
+import pytest
+
+import cnpj_utils
+
+
+@pytest.mark.parametrize("raw, cleaned", [
+    ("11.222.333/0001-81", "11222333000181"),
+    ("CNPJ 11.222.333/0001-81", "11222333000181"),
+    ("cnpj: 11222333000181", "11222333000181"),
+    ("12.abc.345/01de-35", "12ABC34501DE35"),
+    ("", ""),
+    (None, ""),
+])
+def test_clean(raw, cleaned):
+    assert cnpj_utils.clean(raw) == cleaned
+
+
+def test_labelled_numeric_input_is_accepted():
+    app = pytest.importorskip("app")
+    assert app.parse_cnpj("CNPJ 11.222.333/0001-81") == ("11222333000181", None)
+    assert app.parse_cnpj("11.222.333/0001-80")[1] == "CNPJ inválido"
+    assert app.parse_cnpj("123")[1] == "CNPJ deve ter 14 dígitos"
+
+
+def test_check_digits():
+    assert cnpj_utils.is_valid("11222333000181")
+    assert not cnpj_utils.is_valid("11222333000180")
+    assert not cnpj_utils.is_valid("11111111111111")
+    assert cnpj_utils.is_valid("12ABC34501DE" + cnpj_utils.check_digits("12ABC34501DE"))
+
+
+def test_find_cnpjs_in_text():
+    text = "Razão social ACME, CNPJ 11.222.333/0001-81; outro 11.222.333/0001-80"
+    assert cnpj_utils.find_cnpjs(text) == ["11222333000181"]
+
+
+def test_validate_batch_matches_is_valid():
+    cnpjs = ["11222333000181", "11222333000180", "00000000000000", "12ABC34501DE35", "short"]
+    assert cnpj_utils.validate_batch(cnpjs) == [cnpj_utils.is_valid(c) for c in cnpjs]
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+import health
+import upstream
+from health import ProviderHealth
+
+
+def trip(tracker, provider="p"):
+    for _ in range(health.FAILURE_THRESHOLD):
+        assert tracker.allow(provider)
+        tracker.record_failure(provider, 0.1, "HTTP 503")
+
+
+def test_breaker_opens_after_consecutive_failures():
+    tracker = ProviderHealth()
+    trip(tracker)
+    assert tracker.snapshot()["p"]["state"] == "open"
+    assert not tracker.allow("p")
+    assert tracker.snapshot()["p"]["rejected"] == 1
+
+
+def test_success_resets_the_failure_count():
+    tracker = ProviderHealth()
+    for _ in range(health.FAILURE_THRESHOLD - 1):
+        tracker.record_failure("p", 0.1, "timeout")
+    tracker.record_success("p", 0.1)
+    tracker.record_failure("p", 0.1, "timeout")
+    assert tracker.snapshot()["p"]["state"] == "closed"
+
+
+def test_half_open_lets_one_probe_through(monkeypatch):
+    tracker = ProviderHealth()
+    trip(tracker)
+    monkeypatch.setattr(health, "RESET_TIMEOUT", 0)
+    assert tracker.allow("p")
+    assert tracker.snapshot()["p"]["state"] == "half_open"
+    assert not tracker.allow("p")
+    tracker.record_success("p", 0.1)
+    assert tracker.snapshot()["p"]["state"] == "closed"
+    assert tracker.allow("p")
+
+
+def test_failed_probe_reopens(monkeypatch):
+    tracker = ProviderHealth()
+    trip(tracker)
+    monkeypatch.setattr(health, "RESET_TIMEOUT", 0)
+    assert tracker.allow("p")
+    tracker.record_failure("p", 0.1, "timeout")
+    assert tracker.snapshot()["p"]["state"] == "open"
+
+
+def test_rate_limit_rejects_when_tokens_run_out():
+    tracker = ProviderHealth({"p": {"rate": 0.001, "burst": 2}})
+    assert tracker.allow("p") and tracker.allow("p")
+    assert not tracker.allow("p")
+
+
+def test_cancelled_async_probe_ends_half_open(monkeypatch):
+    asgi = pytest.importorskip("asgi")
+    provider = asgi.registry.get("cnpj", "brasilapi")
+    tracker = ProviderHealth()
+    monkeypatch.setattr(upstream, "health", tracker)
+    trip(tracker, provider.upstream)
+
+    class StalledClient:
+        async def get(self, url, **kwargs):
+            await asyncio.sleep(60)
+
+    monkeypatch.setattr(asgi, "client_for", lambda name: StalledClient())
+    monkeypatch.setattr(health, "RESET_TIMEOUT", 0)
+
+    async def probe():
+        task = asyncio.ensure_future(asgi.fetch_source(provider, "11222333000181", 5))
+        await asyncio.sleep(0.01)
+        assert tracker.snapshot()[provider.upstream]["state"] == "half_open"
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(probe())
+    # The abandoned probe counts as a failure, so the breaker reopens and will probe again later
+    assert tracker.snapshot()[provider.upstream]["state"] == "open"
+    assert tracker.allow(provider.upstream)
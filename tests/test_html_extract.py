@@ -0,0 +1,63 @@
+import pytest
+
+import html_extract
+from html_extract import extract
+
+GOOGLE_PAGE = """<html><head><title>padaria - Pesquisa</title>
+<style>.padaria { color: red }</style>
+<script>var q = "padaria"; document.write("<div>padaria</div>");</script></head>
+<body><!-- padaria comment --><div id="search">
+<div class="g"><a href="/1"><h3>Padaria Pão Quente Ltda</h3></a>
+<span>CNPJ 11.222.333/0001-81 &mdash; padaria em São Paulo</span></div>
+<div class="g"><a href="/2"><h3>Padaria <b>São</b> Jorge</h3><script>padaria()</script></a>
+<span>Rua das Flores, 12</span>tail text</div>
+<ul><li class="result">PADARIA LIVRE<li class="result">Outra padaria</ul>
+</div></body></html>"""
+
+YAHOO_PAGE = """<html><body>
+<ol><li class="first"><div class="compTitle"><h3 class="title">
+<a href="/x">Mercado Central <span>Comércio</span></a></h3></div>
+<div class="compText">mercado central, CNPJ 11222333000181</div></li>
+<li><div class="compTitle"><h3 class="title"><a href="/y">Mercado Sul</a></h3></div></li></ol>
+</body></html>"""
+
+
+def as_tuple(page):
+    return page.h3, page.by_class, page.containing, page.cnpjs
+
+
+def test_stream_is_the_default_backend():
+    assert html_extract.BACKEND == "stream"
+
+
+def test_script_style_and_comments_are_not_text():
+    page = extract(GOOGLE_PAGE, "padaria", backend="stream")
+    assert page.h3 == ["Padaria Pão Quente Ltda", "Padaria São Jorge"]
+    assert not any("padaria()" in text or "document.write" in text for _, text in page.containing)
+    assert page.cnpjs == ["11222333000181"]
+
+
+def test_long_nodes_are_skipped(monkeypatch):
+    monkeypatch.setattr(html_extract, "MAX_CANDIDATE_CHARS", 40)
+    page = extract(GOOGLE_PAGE, "padaria", backend="stream")
+    assert page.containing and all(len(text) <= 40 for _, text in page.containing)
+
+
+def test_enough_stops_early(monkeypatch):
+    # The stream backend checks between chunks; make the first one end after the first title
+    monkeypatch.setattr(html_extract, "CHUNK_SIZE", GOOGLE_PAGE.index("</h3>") + 5)
+    page = extract(GOOGLE_PAGE, "padaria", enough=lambda page: len(page.h3) >= 1, backend="stream")
+    assert page.h3 == ["Padaria Pão Quente Ltda"]
+
+
+@pytest.mark.skipif(html_extract.lxml is None, reason="needs lxml")
+@pytest.mark.parametrize("html, query, classes", [
+    (GOOGLE_PAGE, "padaria", ("result", "g")),
+    (YAHOO_PAGE, "mercado", ("compTitle", "compText", "title")),
+])
+@pytest.mark.parametrize("max_chars", [2000, 40])
+def test_backends_agree(html, query, classes, max_chars, monkeypatch):
+    monkeypatch.setattr(html_extract, "MAX_CANDIDATE_CHARS", max_chars)
+    stream = extract(html, query, classes, backend="stream")
+    tree = extract(html, query, classes, backend="lxml")
+    assert as_tuple(tree) == as_tuple(stream)
@@ -0,0 +1,179 @@
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import jobs
+from jobs import JobQueue
+
+
+def lookup(index, raw):
+    return {"index": index, "input": raw, "cnpj": raw}
+
+
+@pytest.fixture
+def pool():
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        yield pool
+
+
+def make_queue(tmp_path, owner):
+    queue = JobQueue(str(tmp_path / "jobs.db"), lookup, concurrency=2, chunk_size=2)
+    queue.owner = owner
+    # Keep the runner thread out of the way; tests drive claims and chunks directly
+    queue.start = lambda: None
+    return queue
+
+
+def test_import_does_not_touch_disk(tmp_path):
+    JobQueue(str(tmp_path / "state" / "jobs.db"), lookup)
+    assert not (tmp_path / "state").exists()
+
+
+def test_empty_submission_is_rejected(tmp_path):
+    queue = make_queue(tmp_path, "a")
+    assert queue.submit([]) is None
+    assert queue._db().execute("SELECT COUNT(*) FROM jobs").fetchone() == (0,)
+
+
+def test_job_runs_to_completion(tmp_path, pool):
+    queue = make_queue(tmp_path, "a")
+    job = queue.submit(["1", "2", "3"])
+    assert job["status"] == "queued" and job["total"] == 3
+    assert queue._claim() == job["job_id"]
+    queue._process(job["job_id"], pool)
+    status = queue.status(job["job_id"])
+    assert (status["status"], status["done"], status["errors"]) == ("done", 3, 0)
+    assert [line["input"] for line in queue.iter_results(job["job_id"])] == ["1", "2", "3"]
+
+
+def test_expired_lease_is_taken_over_and_counted_once(tmp_path, pool):
+    first = make_queue(tmp_path, "host:1")
+    second = make_queue(tmp_path, "host:2")
+    job_id = first.submit([str(i) for i in range(5)])["job_id"]
+    assert first._claim() == job_id
+    # While the lease holds, nobody else can claim the job
+    assert second._claim() is None
+
+    def stalled_lookup(index, raw):
+        # The first owner stalls past its lease mid-chunk and another runner takes over
+        if second.status(job_id)["status"] == "running" and not taken.is_set():
+            taken.set()
+            second._db().execute("UPDATE jobs SET lease_until = ? WHERE id = ?", (time.time() - 1, job_id))
+            assert second._claim() == job_id
+        return lookup(index, raw)
+
+    taken = threading.Event()
+    first.lookup = stalled_lookup
+    first._process(job_id, pool)
+    # The late chunk of the previous owner is discarded, not counted
+    assert first.status(job_id)["done"] == 0
+
+    second._process(job_id, pool)
+    status = second.status(job_id)
+    assert (status["status"], status["done"]) == ("done", 5)
+
+
+def test_cancelled_job_stops(tmp_path, pool):
+    queue = make_queue(tmp_path, "a")
+    job_id = queue.submit(["1", "2", "3"])["job_id"]
+    queue._claim()
+    queue.cancel(job_id)
+    queue._process(job_id, pool)
+    assert queue.status(job_id)["status"] == "cancelled"
+
+
+def test_slow_upload_does_not_hold_the_write_lock(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "INSERT_BATCH", 2)
+    queue = make_queue(tmp_path, "a")
+    checked = []
+
+    def upload():
+        for i in range(5):
+            if i == 3:
+                # Mid-upload, another worker must still be able to checkpoint
+                other = sqlite3.connect(str(tmp_path / "jobs.db"), timeout=0.2, isolation_level=None)
+                other.execute("BEGIN IMMEDIATE")
+                other.execute("COMMIT")
+                other.close()
+                checked.append(queue._db().execute("SELECT status FROM jobs").fetchone())
+            yield str(i)
+
+    job = queue.submit(upload())
+    assert checked == [("submitting",)]
+    assert (job["status"], job["total"]) == ("queued", 5)
+    assert [raw for _, raw in queue._db().execute("SELECT idx, input FROM job_items ORDER BY idx")] == list("01234")
+
+
+def test_failed_upload_leaves_nothing_behind(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "INSERT_BATCH", 2)
+    queue = make_queue(tmp_path, "a")
+
+    def upload():
+        yield from ["1", "2", "3"]
+        raise ConnectionError("client went away")
+
+    with pytest.raises(ConnectionError):
+        queue.submit(upload())
+    db = queue._db()
+    assert db.execute("SELECT COUNT(*) FROM jobs").fetchone() == (0,)
+    assert db.execute("SELECT COUNT(*) FROM job_items").fetchone() == (0,)
+
+
+def test_uploads_of_dead_processes_are_dropped(tmp_path):
+    queue = make_queue(tmp_path, f"{socket.gethostname()}:{2 ** 22 + 1}")
+    job_id = queue.submit(["1", "2"])["job_id"]
+    queue._db().execute("UPDATE jobs SET status = 'submitting', owner = ? WHERE id = ?", (queue.owner, job_id))
+    queue._requeue_orphans()
+    assert queue.status(job_id) is None
+
+
+def test_runner_survives_a_locked_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "BUSY_RETRY_SECONDS", 0)
+    queue = JobQueue(str(tmp_path / "jobs.db"), lookup, concurrency=2, chunk_size=2)
+    process = queue._process
+    failures = []
+
+    def flaky_process(job_id, pool):
+        if not failures:
+            failures.append(job_id)
+            raise sqlite3.OperationalError("database is locked")
+        process(job_id, pool)
+
+    queue._process = flaky_process
+    job_id = queue.submit(["1", "2", "3"])["job_id"]
+    for _ in range(100):
+        if queue.status(job_id)["status"] == "done":
+            break
+        time.sleep(0.05)
+    assert failures == [job_id]
+    assert queue.status(job_id)["done"] == 3
+    assert queue._thread.is_alive()
+
+
+def test_runner_survives_when_marking_a_job_failed_fails(tmp_path, monkeypatch):
+    queue = make_queue(tmp_path, "a")
+    job_id = queue.submit(["1"])["job_id"]
+    calls = []
+
+    def broken_process(job_id, pool):
+        calls.append(job_id)
+        raise ValueError("bad chunk")
+
+    def locked_db():
+        raise sqlite3.OperationalError("database is locked")
+
+    queue._process = broken_process
+    queue._claim = lambda: job_id if not calls else None
+    monkeypatch.setattr(jobs, "POLL_SECONDS", 0.01)
+    runner = threading.Thread(target=queue._run, daemon=True)
+    db = queue._db
+    queue._db = locked_db
+    runner.start()
+    time.sleep(0.2)
+    queue._db = db
+    assert calls == [job_id]
+    assert runner.is_alive()
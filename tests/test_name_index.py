@@ -0,0 +1,99 @@
+import pytest
+
+import name_index
+from name_index import NameIndex, normalize, synthetic_companies
+
+COMPANIES = [
+    ("11222333000181", "PADARIA PAO QUENTE LTDA", "PÃO QUENTE", "SAO PAULO", "SP"),
+    ("22333444000192", "MERCADO SAO JORGE LTDA", "", "RIO DE JANEIRO", "RJ"),
+    ("33444555000103", "ACME COMERCIO S.A.", "ACME", "CURITIBA", "PR"),
+]
+
+
+@pytest.fixture
+def index():
+    return NameIndex.build(COMPANIES)
+
+
+def test_normalize_strips_accents_and_legal_suffixes():
+    assert normalize("Padaria Pão Quente Ltda") == ["padaria", "pao", "quente"]
+    assert normalize("ACME Comércio S.A.") == ["acme", "comercio"]
+
+
+def test_full_matches_rank_first_and_are_marked_complete(index):
+    hits = index.search_matches("padaria pao quente")
+    assert hits[0][1] is True
+    assert hits[0][2][0] == "11222333000181"
+
+
+def test_partial_matches_are_not_complete(index):
+    hits = index.search_matches("padaria sao jorge")
+    assert hits and not any(complete for _, complete, _ in hits)
+
+
+def test_fuzzy_and_prefix(index):
+    assert index.search("quentte")[0][1][0] == "11222333000181"
+    assert index.search("ac", prefix=True)[0][1][0] == "33444555000103"
+
+
+def test_save_and_load(index, tmp_path):
+    path = str(tmp_path / "names.pkl")
+    index.save(path)
+    assert NameIndex.load(path).search("acme") == index.search("acme")
+
+
+@pytest.fixture(scope="module")
+def large_index():
+    return NameIndex.build(synthetic_companies(20000))
+
+
+def test_capped_candidates_still_find_rare_complete_matches(large_index, monkeypatch):
+    monkeypatch.setattr(name_index, "MAX_CANDIDATES", 50)
+    target = next(doc for doc in reversed(large_index.docs) if doc[1].startswith("COMERCIO"))
+    query = " ".join(target[1].split()[:3])
+    hits = large_index.search_matches(query, limit=5)
+    assert hits[0][1] is True
+    assert target in [doc for _, complete, doc in hits if complete]
+    assert len(large_index.search_matches("comercio", limit=5)) == 5
+
+
+def test_probing_matches_with_and_without_numpy(large_index, monkeypatch):
+    monkeypatch.setattr(name_index, "MAX_CANDIDATES", 500)
+    queries = ["servicos nome3", "comercio industria", "nome11 transportes", "alimentos nome9 nome10"]
+    with_numpy = [large_index.search_matches(query) for query in queries]
+    monkeypatch.setattr(name_index, "np", None)
+    assert [large_index.search_matches(query) for query in queries] == with_numpy
+
+
+@pytest.fixture
+def search_app(index, monkeypatch):
+    app = pytest.importorskip("app")
+    calls = []
+
+    def search_apis(terms, results, sources_used, budget=None, on_slow=None):
+        calls.append(terms)
+        app.add_search_hits("brasilapi", [{"cnpj": "44555666000114", "razao_social": "PADARIA SAO JORGE"}],
+                            results, sources_used, {r.get("cnpj") for r in results})
+
+    monkeypatch.setattr(app, "name_index", index)
+    monkeypatch.setattr(app, "search_apis", search_apis)
+    monkeypatch.setattr(app, "search_fallbacks", lambda *args, **kwargs: None)
+    monkeypatch.setattr(app, "SEARCH_HEDGING", False)
+    return app, calls
+
+
+def test_complete_local_match_skips_providers(search_app):
+    app, calls = search_app
+    data = app.run_search("padaria pao quente")
+    assert not calls
+    assert data["results"][0]["cnpj"] == "11222333000181"
+
+
+def test_partial_local_match_asks_providers_and_merges(search_app):
+    app, calls = search_app
+    data = app.run_search("padaria sao jorge")
+    assert calls
+    cnpjs = [r["cnpj"] for r in data["results"]]
+    assert cnpjs[0] == "44555666000114"
+    assert "11222333000181" in cnpjs
+    assert data["sources"] == ["brasilapi", "local_index"]
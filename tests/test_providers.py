@@ -0,0 +1,215 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import providers
+from providers import Provider, Registry
+
+
+@pytest.fixture(scope="module")
+def pool():
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        yield pool
+
+
+def fake(name, delay, result=None, fail=False, **settings):
+    def fetch(arg, timeout, cancel=None):
+        time.sleep(delay)
+        if fail:
+            raise RuntimeError(name)
+        return result
+    return Provider(name, "test", fetch=fetch, **settings)
+
+
+FAILING = fake("failing", 0.3, fail=True)
+SLOW = fake("slow", 0.1, "slow")
+EMPTY = fake("empty", 0.05, [])
+CALLS = [(FAILING, 1), (SLOW, 1), (EMPTY, 1)]
+
+
+def test_registry_orders_by_priority_then_cost_and_skips_disabled():
+    registry = Registry()
+    registry.register(Provider("c", "k", priority=20))
+    registry.register(Provider("b", "k", priority=10, cost=5))
+    registry.register(Provider("a", "k", priority=10, cost=1))
+    registry.register(Provider("off", "k", priority=1, enabled=False))
+    assert [p.name for p in registry.providers("k")] == ["a", "b", "c"]
+    assert len(registry.providers("k", include_disabled=True)) == 4
+    assert registry.get("k", "off").enabled is False
+
+
+def test_settings_come_from_the_environment(monkeypatch):
+    monkeypatch.setenv("PROVIDER_CNPJ_SOME_SOURCE_ENABLED", "0")
+    monkeypatch.setenv("PROVIDER_CNPJ_SOME_SOURCE_TIMEOUT", "2.5")
+    provider = Provider("some_source", "cnpj")
+    assert provider.enabled is False
+    assert provider.budget(10) == 2.5 and provider.budget(1) == 1
+
+
+@pytest.mark.parametrize("strategy, expected", [
+    ("sequential", ["slow"]),
+    ("parallel", ["empty", "slow"]),
+    ("first_n", ["empty"]),
+    ("hedged", ["slow"]),
+])
+def test_strategies(pool, strategy, expected):
+    answers = providers.execute(CALLS, pool, strategy, budget=2, hedge_after=0.2)
+    assert [provider.name for provider, _, _ in answers] == expected
+
+
+@pytest.mark.parametrize("strategy, expected", [
+    ("sequential", ["slow"]),
+    ("parallel", ["empty", "slow"]),
+    ("first_n", ["empty"]),
+    ("hedged", ["slow"]),
+])
+def test_async_strategies(strategy, expected):
+    answers = asyncio.run(providers.execute_async(CALLS, strategy=strategy, budget=2, hedge_after=0.2))
+    assert [provider.name for provider, _, _ in answers] == expected
+
+
+def test_hedged_waits_before_asking_the_next_provider(pool):
+    started = time.monotonic()
+    answers = providers.execute([(fake("a", 0.3, "a"), 1), (fake("b", 0.01, "b"), 1)], pool, "hedged",
+                                budget=2, hedge_after=0.1)
+    elapsed = time.monotonic() - started
+    assert [provider.name for provider, _, _ in answers] == ["b"]
+    assert 0.1 <= elapsed < 0.3
+
+
+def test_budget_abandons_slow_calls_and_signals_cancel(pool):
+    cancel = threading.Event()
+    slow_calls = []
+    started = time.monotonic()
+    answers = providers.execute([(fake("late", 1.0, "late"), 1)], pool, "parallel", budget=0.2,
+                                slow_after=0.05, on_slow=lambda: slow_calls.append(1), cancel=cancel)
+    assert answers == []
+    assert time.monotonic() - started < 0.5
+    assert slow_calls == [1] and cancel.is_set()
+
+
+def test_on_result_can_stop_early(pool):
+    seen = []
+    answers = providers.execute(CALLS, pool, "parallel", budget=2,
+                                on_result=lambda provider, arg, result: seen.append(provider.name) or True)
+    assert seen == ["empty"] and len(answers) == 1
+
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        providers.execute([], None, "fastest")
+
+
+def test_bulk_lookups_batch_providers_registered_after_import(monkeypatch):
+    app = pytest.importorskip("app")
+    batches = []
+
+    def batch_request(cnpjs):
+        batches.append(sorted(cnpjs))
+        return "", {}
+
+    source = Provider("bulk", "cnpj", batch_request=batch_request, max_batch=10,
+                      parse_batch=lambda payload: payload)
+    registry = Registry()
+    registry.register(source)
+    monkeypatch.setattr(app, "registry", registry)
+    monkeypatch.setattr(app, "batchers", {})
+    monkeypatch.setattr(app, "fetch_source_many",
+                        lambda source, cnpjs: batch_request(cnpjs) and {c: {"razao_social": c} for c in cnpjs})
+
+    results = []
+    threads = [threading.Thread(target=lambda c=c: results.append(app.enrich_cnpj(c, budget=2, batched=True)))
+               for c in ("11222333000181", "11444777000161")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(r["sources"] for r in results) == [["bulk"], ["bulk"]]
+    assert batches == [["11222333000181", "11444777000161"]]
+    assert "bulk" in app.batchers
+
+
+def test_asgi_runs_fetch_only_providers(monkeypatch):
+    asgi = pytest.importorskip("asgi")
+    registry = Registry()
+    registry.register(Provider("custom", "cnpj", fetch=lambda arg, timeout, cancel=None: {"razao_social": "ACME"}))
+    monkeypatch.setattr(asgi, "registry", registry)
+    record = asyncio.run(asgi.enrich_cnpj("11222333000181", budget=2))
+    assert record["sources"] == ["custom"] and record["razao_social"] == "ACME"
+
+
+def test_execute_async_calls_on_slow_once():
+    slow_calls = []
+
+    async def call(provider, arg, timeout):
+        await asyncio.sleep(0.3)
+        return "late"
+
+    answers = asyncio.run(providers.execute_async(
+        [(SLOW, 1), (SLOW, 2)], call, "parallel", budget=2, slow_after=0.1, on_slow=lambda: slow_calls.append(1)))
+    assert slow_calls == [1]
+    assert len(answers) == 2
+
+
+def test_asgi_search_hedges_within_the_total_budget(monkeypatch):
+    asgi = pytest.importorskip("asgi")
+    started_races = []
+    fallback_args = []
+
+    class Race:
+        def __init__(self, query, deadline):
+            self.deadline = deadline
+
+        def start(self):
+            started_races.append(self.deadline)
+
+    async def silent_provider(provider, arg, timeout):
+        await asyncio.sleep(timeout)
+
+    monkeypatch.setattr(asgi, "FallbackRace", Race)
+    monkeypatch.setattr(asgi, "call_provider", silent_provider)
+    monkeypatch.setattr(asgi, "search_fallbacks", lambda *args: fallback_args.append(args))
+    monkeypatch.setattr(asgi.flask_app, "SEARCH_HEDGING", True)
+    monkeypatch.setattr(asgi.flask_app, "SEARCH_HEDGE_AFTER", 0.1)
+    monkeypatch.setattr(asgi.flask_app, "SEARCH_TOTAL_BUDGET", 0.5)
+    monkeypatch.setattr(asgi.flask_app, "SEARCH_API_BUDGET", 10)
+
+    started = time.monotonic()
+    data = asyncio.run(asgi.run_search("padaria sao jorge"))
+    assert time.monotonic() - started < 0.9
+    assert data["count"] == 0
+    # The scrapers were started early, and the fallback step got the same deadline and race
+    assert len(started_races) == 1
+    (query, _, _, deadline, race), = fallback_args
+    assert deadline == started_races[0] == race.deadline
+
+
+def test_asgi_lookup_keeps_the_event_loop_free(monkeypatch):
+    asgi = pytest.importorskip("asgi")
+
+    def slow_cache(cnpj_clean):
+        time.sleep(0.3)
+        return {"cnpj": cnpj_clean, "sources": ["cache"]}
+
+    monkeypatch.setattr(asgi, "cached_cnpj", slow_cache)
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.02)
+                ticks += 1
+
+        task = asyncio.ensure_future(ticker())
+        record, error = await asgi.lookup_cnpj("11222333000181")
+        task.cancel()
+        return record, error, ticks
+
+    record, error, ticks = asyncio.run(main())
+    assert error is None and record["sources"] == ["cache"]
+    assert ticks >= 5
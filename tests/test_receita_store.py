@@ -0,0 +1,75 @@
+import os
+import shutil
+import zipfile
+
+import pytest
+
+import receita_store
+from receita_store import ReceitaStore
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "receita")
+
+
+@pytest.fixture
+def dump(tmp_path):
+    """The fixture dump, with Estabelecimentos zipped as the Receita ships it"""
+    directory = tmp_path / "dump"
+    shutil.copytree(FIXTURE, directory)
+    with zipfile.ZipFile(directory / "Estabelecimentos0.zip", "w") as archive:
+        archive.write(directory / "Estabelecimentos0.csv", "K3241.K03200Y0.D40511.ESTABELE")
+    os.remove(directory / "Estabelecimentos0.csv")
+    return directory
+
+
+@pytest.fixture
+def store(dump, tmp_path):
+    path = str(tmp_path / "receita.db")
+    logs = []
+    receita_store.build(str(dump), path, log=logs.append)
+    return ReceitaStore(path), path, logs
+
+
+def test_ingestion_drops_invalid_cnpjs(store):
+    store, _, logs = store
+    assert store.get("11222333000200") is None
+    assert "Estabelecimentos0.zip: 2 rows -> estabelecimentos (1 invalid CNPJs dropped)" in logs
+
+
+def test_record_joins_company_partners_and_code_tables(store):
+    record = store[0].get("11222333000181")
+    assert record["razao_social"] == "PADARIA PÃO QUENTE LTDA"
+    assert record["nome_fantasia"] == "PÃO QUENTE"
+    assert record["descricao_situacao_cadastral"] == "ATIVA"
+    assert record["data_inicio_atividade"] == "2005-01-03"
+    assert record["municipio"] == "SAO PAULO"
+    assert record["natureza_juridica"] == "Sociedade Empresária Limitada"
+    assert record["capital_social"] == 50000.0
+    assert record["porte"] == "MICRO EMPRESA"
+    assert record["ddd_telefone_1"] == "1133334444"
+    assert record["cnaes_secundarios"] == [
+        {"codigo": 4721102, "descricao": "Padaria e confeitaria com predominância de revenda"},
+        {"codigo": 4712100, "descricao": "Comércio varejista de mercadorias em geral"},
+    ]
+    assert [(p["nome_socio"], p["qualificacao_socio"]) for p in record["qsa"]] == [
+        ("MARIA DA SILVA", "Sócio-Administrador")]
+
+
+def test_company_without_secondary_activities(store):
+    record = store[0].get("11444777000161")
+    assert record["cnaes_secundarios"] == []
+    assert record["qsa"] == []
+
+
+def test_rebuild_records_changed_cnpjs(store, dump):
+    reader, path, _ = store
+    assert list(reader.changed_cnpjs()) == []
+
+    # Next month's dump: ACME gets a new name, the bakery is unchanged
+    companies = (dump / "Empresas0.csv").read_text(encoding="latin-1")
+    (dump / "Empresas0.csv").write_text(companies.replace("ACME COMÉRCIO", "ACME INDÚSTRIA"), encoding="latin-1")
+    receita_store.build(str(dump), path, log=lambda message: None)
+
+    rebuilt = ReceitaStore(path)
+    assert list(rebuilt.changed_cnpjs()) == ["11444777000161"]
+    assert rebuilt.get("11444777000161")["razao_social"] == "ACME INDÚSTRIA S.A."
+    assert rebuilt.built_at() is not None
@@ -0,0 +1,53 @@
+from record_store import RecordStore
+
+
+def record(n, partners=2, **extra):
+    data = {
+        "cnpj": f"{n:014d}",
+        "razao_social": f"EMPRESA {n} LTDA",
+        "uf": "SP",
+        "municipio": f"CIDADE {n % 7}",
+        "cnae_fiscal": 4751201,
+        "sources": ["brasilapi"],
+        "enriched": True,
+        "qsa": [{"nome_socio": f"SOCIO {n}-{i}", "qualificacao_socio": "Sócio"} for i in range(partners)],
+    }
+    data.update(extra)
+    return data
+
+
+def test_round_trip_keeps_values_types_and_unknown_keys():
+    store = RecordStore()
+    original = record(1, complemento=None, capital_social=1000.0, campo_novo={"a": [1, 2]})
+    original["qsa"][0]["campo_novo"] = 1
+    row = store.add(original)
+    assert store.get(row) == original
+    assert type(store.get(row)["capital_social"]) is float
+    assert store.get(store.add({"cnpj": "2", "qsa": "nao e lista"})) == {"cnpj": "2", "qsa": "nao e lista"}
+
+
+def test_removed_rows_are_reused_and_partners_compacted():
+    store = RecordStore()
+    rows = {n: store.add(record(n, partners=3)) for n in range(3000)}
+    for n in range(0, 3000, 3):
+        store.remove(rows.pop(n))
+    # Past the threshold the dead partner rows are dropped and the survivors move down
+    for n in list(rows)[:1500]:
+        store.remove(rows.pop(n))
+    assert store.stats()["partners"] == 3 * len(rows)
+    assert store._partner_rows < 3 * 3000
+    reused = store.add(record(99999))
+    assert reused not in rows.values()
+    assert store.get(reused) == record(99999)
+    assert all(store.get(row) == record(n, partners=3) for n, row in rows.items())
+    assert len(store) == len(rows) + 1
+
+
+def test_code_columns_widen_as_pools_grow():
+    store = RecordStore()
+    rows = [store.add(record(n, municipio=f"CIDADE {n}")) for n in range(70000)]
+    assert store._codes["uf"].typecode == "B"
+    assert store._codes["municipio"].typecode == "I"
+    assert store.get(rows[0])["municipio"] == "CIDADE 0"
+    assert store.get(rows[300])["municipio"] == "CIDADE 300"
+    assert store.get(rows[-1]) == record(69999, municipio="CIDADE 69999")
@@ -0,0 +1,106 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+import singleflight
+from singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        release.wait(2)
+        return "record"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("k", fetch))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == ["record"] * 5
+    assert len(calls) == 1
+    assert flight.stats()["coalesced"] == 4
+
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    flight = SingleFlight()
+    with pytest.raises(RuntimeError):
+        flight.do("k", lambda: (_ for _ in ()).throw(RuntimeError("down")))
+    assert flight.do("k", lambda: 1) == 1
+
+
+needs_fcntl = pytest.mark.skipif(singleflight.fcntl is None, reason="needs fcntl")
+
+
+def hold_lock(lock_dir, key, seconds, ready):
+    flight = SingleFlight(lock_dir=lock_dir)
+    flight.do(key, lambda: (ready.set(), time.sleep(seconds)))
+
+
+@pytest.fixture
+def other_process(tmp_path):
+    context = multiprocessing.get_context("fork")
+    started = []
+
+    def start(key, seconds):
+        ready = context.Event()
+        process = context.Process(target=hold_lock, args=(str(tmp_path), key, seconds, ready))
+        process.start()
+        started.append(process)
+        assert ready.wait(5)
+        return process
+
+    yield start
+    for process in started:
+        process.join(5)
+
+
+@needs_fcntl
+def test_different_keys_do_not_wait_for_each_other(tmp_path):
+    flight = SingleFlight(lock_dir=str(tmp_path))
+    # Under the old scheme these two shared one of 256 stripe files
+    keys = ["cnpj:0", "cnpj:744"]
+    stripes = {int.from_bytes(hashlib.sha1(key.encode()).digest()[:4], "big") % 256 for key in keys}
+    assert len(stripes) == 1
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=flight.do, args=(key, lambda: time.sleep(0.5))) for key in keys]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.monotonic() - started < 0.9
+    assert os.listdir(tmp_path) == [singleflight.LOCK_FILE]
+
+
+@needs_fcntl
+def test_other_processes_wait_only_on_the_same_key(tmp_path, other_process):
+    flight = SingleFlight(lock_dir=str(tmp_path))
+    other_process("cnpj:0", 0.5)
+    started = time.monotonic()
+    assert flight.do("cnpj:744", lambda: "other key") == "other key"
+    assert time.monotonic() - started < 0.2
+    assert flight.do("cnpj:0", lambda: "same key") == "same key"
+    assert time.monotonic() - started > 0.3
+    assert flight.stats()["lock_waits"] == 1
+
+
+@needs_fcntl
+def test_lock_wait_is_bounded_by_the_timeout(tmp_path, other_process):
+    flight = SingleFlight(lock_dir=str(tmp_path))
+    other_process("cnpj:0", 2)
+    started = time.monotonic()
+    assert flight.do("cnpj:0", lambda: "fetched anyway", timeout=0.3) == "fetched anyway"
+    assert 0.2 < time.monotonic() - started < 0.6
+    assert flight.stats()["lock_timeouts"] == 1
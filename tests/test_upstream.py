@@ -0,0 +1,115 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import upstream
+from health import ProviderHealth
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """Local server answering with the queued (status, headers) pairs, then 200"""
+    replies = []
+    calls = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            calls.append(time.monotonic())
+            status, headers = replies.pop(0) if replies else (200, {})
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    monkeypatch.setattr(upstream, "health", ProviderHealth())
+    yield f"http://127.0.0.1:{httpd.server_port}/", replies, calls
+    httpd.shutdown()
+
+
+def test_retries_a_5xx(server):
+    url, replies, calls = server
+    replies.append((503, {}))
+    response = upstream.get("brasilapi", url, budget=5)
+    assert response.status_code == 200
+    assert len(calls) == 2
+
+
+def test_retry_after_beyond_the_budget_is_not_waited_for(server):
+    url, replies, calls = server
+    replies.append((429, {"Retry-After": "3"}))
+    started = time.monotonic()
+    response = upstream.get("brasilapi", url, budget=1)
+    assert time.monotonic() - started < 0.5
+    assert response.status_code == 429
+    assert len(calls) == 1
+
+
+def test_backoff_stops_at_the_deadline(server, monkeypatch):
+    url, replies, calls = server
+    monkeypatch.setattr(upstream, "BACKOFF", 0.4)
+    replies.extend([(503, {}), (503, {}), (503, {})])
+    started = time.monotonic()
+    response = upstream.get("brasilapi", url, budget=0.6)
+    assert time.monotonic() - started < 0.6
+    # First try, one retry after 0.4 s; the next backoff (0.8 s) would overrun the budget
+    assert response.status_code == 503
+    assert len(calls) == 2
+
+
+def test_retry_delay_honours_retry_after_within_the_deadline():
+    deadline = time.monotonic() + 10
+    assert upstream.retry_delay(0, {"Retry-After": "2"}, deadline) == 2.0
+    assert upstream.retry_delay(0, {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}, deadline) == upstream.BACKOFF
+    assert upstream.retry_delay(0, {"Retry-After": "20"}, deadline) is None
+    assert upstream.retry_delay(5, None, None) == upstream.BACKOFF * 32
+
+
+def rate_limited(monkeypatch, burst):
+    health = ProviderHealth({"receitaws": {"rate": 1 / 3600, "burst": burst}})
+    monkeypatch.setattr(upstream, "health", health)
+    return health
+
+
+def test_every_retry_takes_a_token(server, monkeypatch):
+    url, replies, calls = server
+    health = rate_limited(monkeypatch, burst=2)
+    monkeypatch.setattr(upstream, "BACKOFF", 0.01)
+    replies.extend([(503, {}), (503, {}), (503, {})])
+    response = upstream.get("receitaws", url, budget=5)
+    # Allowed once, retried once; the second retry finds the bucket empty
+    assert response.status_code == 503
+    assert len(calls) == 2
+    assert health.snapshot()["receitaws"]["tokens"] < 1
+    with pytest.raises(upstream.ProviderUnavailable):
+        upstream.get("receitaws", url, budget=5)
+    assert len(calls) == 2
+
+
+def test_throttled_rate_limited_provider_is_not_retried_blindly(server, monkeypatch):
+    url, replies, calls = server
+    rate_limited(monkeypatch, burst=3)
+    replies.append((429, {}))
+    assert upstream.get("receitaws", url, budget=5).status_code == 429
+    assert len(calls) == 1
+
+    replies.append((429, {"Retry-After": "0"}))
+    assert upstream.get("receitaws", url, budget=5).status_code == 200
+    assert len(calls) == 3
+
+
+def test_unlimited_providers_still_retry_a_429(server):
+    url, replies, calls = server
+    replies.append((429, {}))
+    assert upstream.get("brasilapi", url, budget=5).status_code == 200
+    assert len(calls) == 2
@@ -0,0 +1,173 @@
+# Pooled HTTP sessions for upstream providers
+# One keep-alive session per provider, with retries on 429/5xx and split connect/read timeouts.
+# Retries happen here rather than in urllib3 so that, backoff and Retry-After included, they
+# never run past the caller's budget, and so that each one takes its own rate-limit token.
+
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from health import ProviderHealth, ProviderUnavailable
+
+CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05))
+POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 32))
+RETRIES = int(os.environ.get('HTTP_RETRIES', 2))
+BACKOFF = float(os.environ.get('HTTP_BACKOFF', 0.3))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Per-provider settings; scrapers don't retry since a 429 there means we're being blocked.
+# rate/burst is a token bucket in requests per second (ReceitaWS' free tier allows 3 per minute).
+PROVIDERS = {
+    "brasilapi": {"read_timeout": 10, "retries": RETRIES, "pool_size": POOL_SIZE},
+    "minha_receita": {"read_timeout": 10, "retries": RETRIES, "pool_size": POOL_SIZE},
+    "receitaws": {"read_timeout": 10, "retries": RETRIES, "pool_size": POOL_SIZE, "rate": 3 / 60, "burst": 3},
+    "google": {"read_timeout": 15, "retries": 0, "pool_size": 4, "rate": 1, "burst": 4},
+    "yahoo": {"read_timeout": 15, "retries": 0, "pool_size": 4, "rate": 1, "burst": 4},
+    "bing": {"read_timeout": 10, "retries": 0, "pool_size": 4, "rate": 1, "burst": 4},
+}
+
+# Base URLs can be pointed elsewhere (e.g. at mock_upstream.py) with <PROVIDER>_URL
+BASE_URLS = {
+    "brasilapi": os.environ.get('BRASILAPI_URL', 'https://brasilapi.com.br'),
+    "minha_receita": os.environ.get('MINHA_RECEITA_URL', 'https://minhareceita.org'),
+    "receitaws": os.environ.get('RECEITAWS_URL', 'https://www.receitaws.com.br'),
+    "google": os.environ.get('GOOGLE_URL', 'https://www.google.com'),
+    "yahoo": os.environ.get('YAHOO_URL', 'https://search.yahoo.com'),
+    "bing": os.environ.get('BING_URL', 'https://www.bing.com'),
+}
+
+# With RATE_LIMIT_FILE set, every process on the host shares one quota per provider (see serve.py)
+health = ProviderHealth(PROVIDERS, shared_path=os.environ.get('RATE_LIMIT_FILE') or None)
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+def _build_session(config):
+    adapter = HTTPAdapter(
+        pool_connections=2,
+        pool_maxsize=config["pool_size"],
+        max_retries=0,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def url(provider, path):
+    return BASE_URLS[provider] + path
+
+
+def session_for(provider):
+    """Shared keep-alive session for a provider, created on first use"""
+    session = _sessions.get(provider)
+    if session is None:
+        with _lock:
+            session = _sessions.get(provider)
+            if session is None:
+                session = _build_session(PROVIDERS[provider])
+                _sessions[provider] = session
+    return session
+
+
+def timeout_for(provider, budget=None):
+    """(connect, read) timeout tuple, with the read timeout capped by the caller's budget"""
+    read_timeout = PROVIDERS[provider]["read_timeout"]
+    if budget is not None:
+        read_timeout = min(read_timeout, budget)
+    return (min(CONNECT_TIMEOUT, read_timeout), read_timeout)
+
+
+def retry_after(headers):
+    """The server's Retry-After in seconds, or None (absent, or an HTTP date)"""
+    value = headers.get('Retry-After') if headers is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def retry_delay(attempt, headers, deadline):
+    """Seconds to wait before retry number attempt + 1, or None if it wouldn't fit the deadline
+
+    Exponential backoff, stretched to the server's Retry-After (in seconds) when it asks for more.
+    """
+    delay = max(BACKOFF * (2 ** attempt), retry_after(headers) or 0)
+    if deadline is not None and time.monotonic() + delay >= deadline:
+        return None
+    return delay
+
+
+def next_retry(provider, attempt, deadline, status=None, headers=None):
+    """Delay before retrying a failed attempt, or None when it shouldn't be retried
+
+    Every retry is a request of its own and takes its own rate-limit token. A rate-limited
+    provider's 429 is only retried when it says, within the deadline, when to come back.
+    """
+    if attempt >= PROVIDERS[provider]["retries"]:
+        return None
+    if status == 429 and health.rate_limited(provider) and retry_after(headers) is None:
+        return None
+    delay = retry_delay(attempt, headers, deadline)
+    if delay is None or not health.acquire(provider):
+        return None
+    return delay
+
+
+def is_failure(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+def error_status(error):
+    """Metrics label for a call that raised instead of answering"""
+    if isinstance(error, requests.Timeout):
+        return "timeout"
+    if isinstance(error, requests.ConnectionError):
+        return "connection_error"
+    return "error"
+
+
+def get(provider, url, budget=None, **kwargs):
+    """GET through the provider's pooled session, gated and tracked by provider health and metrics"""
+    if not health.allow(provider):
+        metrics.record_rejected(provider)
+        raise ProviderUnavailable(provider)
+    started = time.monotonic()
+    deadline = started + budget if budget is not None else None
+    attempt = 0
+    try:
+        while True:
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            try:
+                response = session_for(provider).get(url, timeout=timeout_for(provider, remaining), **kwargs)
+            except requests.ConnectionError:
+                # Includes connect timeouts; read timeouts already used up the time and aren't retried
+                delay = next_retry(provider, attempt, deadline)
+                if delay is None:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    break
+                delay = next_retry(provider, attempt, deadline, response.status_code, response.headers)
+                if delay is None:
+                    break
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+    except Exception as e:
+        elapsed = time.monotonic() - started
+        health.record_failure(provider, elapsed, e)
+        metrics.record_call(provider, elapsed, error_status(e))
+        raise
+    elapsed = time.monotonic() - started
+    if is_failure(response.status_code):
+        health.record_failure(provider, elapsed, f"HTTP {response.status_code}")
+    else:
+        health.record_success(provider, elapsed)
+    metrics.record_call(provider, elapsed, response.status_code, len(response.content))
+    return response